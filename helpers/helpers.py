@@ -3,6 +3,8 @@ import datetime
 # import requests
 from sqlalchemy.types import TIMESTAMP, TypeDecorator
 
+from helpers.serialization import serializer_for
+
 
 def format_storage_bytes(size: int, decimals: int = 2, binary_system: bool = True) -> str:
     """Convert bytes size to human-readable units.
@@ -55,22 +57,13 @@ class Timestamp(TypeDecorator):
 def jsonize_sqla_model(model):
     """Get a json serializable representation of the SQLAlchemy Model instance.
 
-    This is needed due to datetimes, they are converted to ISO 8601 format strings.
+    Datetimes are converted to ISO 8601 format strings and the credentials are left out, see
+    helpers.serialization.ModelSerializer.
 
     :return: dict
     """
 
-    jdict = {}
-    for key in model.__table__.columns.keys():
-        this_val = getattr(model, key)
-        if isinstance(this_val, datetime.datetime):
-            try:
-                this_val = this_val.isoformat()
-            except AttributeError as er:
-                this_val = str(this_val)
-
-        jdict[key] = this_val
-    return jdict
+    return serializer_for(type(model)).row(model)
 
 
 def remove_empty_parameters(data):
@@ -0,0 +1,96 @@
+"""Memory introspection for the long running monitor, to check that its memory use stays flat from cycle to cycle.
+
+The MemoryTracker takes a tracemalloc snapshot after each cycle and keeps only the last one, the allocations that grew
+since the cycle before, and a bounded history of the process RSS.
+"""
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# the tracing itself and the import machinery aren't the monitor's memory
+_snapshot_filters = (tracemalloc.Filter(False, tracemalloc.__file__),
+                     tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                     tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+                     tracemalloc.Filter(False, '<unknown>'))
+
+
+def rss_bytes():
+    """Get the resident set size of this process, or None if it can't be read on this platform."""
+
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _statistic_dict(stat) -> dict:
+    frame = stat.traceback[0]
+    stat_dict = dict(location=f'{frame.filename}:{frame.lineno}', size_bytes=stat.size, count=stat.count)
+    if hasattr(stat, 'size_diff'):
+        stat_dict.update(size_diff_bytes=stat.size_diff, count_diff=stat.count_diff)
+    return stat_dict
+
+
+class MemoryTracker:
+    """Snapshots the traced memory after each cycle and compares it to the cycle before.
+
+    :param frames: int, the traceback frames tracemalloc keeps for each allocation, more costs more memory.
+    :param top: int, the number of allocation sites to report.
+    :param history: int, the number of RSS samples to keep.
+    """
+
+    def __init__(self, frames: int = 1, top: int = 25, history: int = 1000):
+        self.frames = frames
+        self.top = top
+        self.rss_history = deque(maxlen=history)  # (epoch seconds, bytes)
+        self.cycles = 0
+        self.previous = None
+        self.top_stats = []
+        self.top_diffs = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+    def stop(self):
+        with self.lock:
+            self.previous = None
+        tracemalloc.stop()
+
+    def cycle(self):
+        """Take the snapshot for the end of a cycle."""
+
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces(_snapshot_filters)
+        top_stats = [_statistic_dict(stat) for stat in snapshot.statistics('lineno')[:self.top]]
+        with self.lock:
+            if self.previous is not None:
+                self.top_diffs = [_statistic_dict(stat) for stat in snapshot.compare_to(self.previous, 'lineno')
+                                  [:self.top]]
+            self.previous = snapshot
+            self.top_stats = top_stats
+            self.cycles += 1
+            self.rss_history.append((time.time(), rss_bytes()))
+
+    def report(self) -> dict:
+        """Get the memory use, the largest allocation sites, and the sites that grew the most over the last cycle.
+
+        :return: dict, json serializable.
+        """
+
+        traced_bytes, peak_traced_bytes = tracemalloc.get_traced_memory()
+        with self.lock:
+            return dict(tracing=tracemalloc.is_tracing(),
+                        cycles=self.cycles,
+                        rss_bytes=rss_bytes(),
+                        traced_bytes=traced_bytes,
+                        peak_traced_bytes=peak_traced_bytes,
+                        tracemalloc_overhead_bytes=tracemalloc.get_tracemalloc_memory(),
+                        top_allocations=self.top_stats,
+                        top_growth_last_cycle=self.top_diffs,
+                        rss_history=list(self.rss_history))
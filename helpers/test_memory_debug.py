@@ -0,0 +1,27 @@
+import unittest
+
+from helpers.memory_debug import MemoryTracker
+
+
+class TestMemoryTracker(unittest.TestCase):
+    def test_growth_between_cycles(self):
+        tracker = MemoryTracker(top=5, history=2)
+        tracker.start()
+        try:
+            tracker.cycle()
+            kept = [bytearray(1000) for _ in range(1000)]
+            tracker.cycle()
+            tracker.cycle()
+            report = tracker.report()
+        finally:
+            tracker.stop()
+        self.assertEqual(report['cycles'], 3)
+        self.assertEqual(len(report['rss_history']), 2)
+        self.assertTrue(report['top_allocations'])
+        self.assertLessEqual(len(report['top_growth_last_cycle']), 5)
+        self.assertTrue(any(stat['size_bytes'] >= 1_000_000 for stat in report['top_allocations']))
+        del kept
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import datetime
+import decimal
+import json
+import unittest
+
+import sqlalchemy
+import sqlalchemy_utils
+from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy.orm import declarative_base, relationship, selectinload, sessionmaker
+from sqlalchemy_utils.types.encrypted.encrypted_type import AesEngine
+
+from helpers.serialization import ModelSerializer, serializer_for, to_json_bytes
+
+LocalBase = declarative_base()
+
+
+class LocalSystem(LocalBase):
+    __tablename__ = 'local_system'
+    serialize_exclude = frozenset({'username', 'password', 'api_token'})
+
+    id = Column(Integer, primary_key=True)
+    checks = relationship('LocalCheck', back_populates='system')
+    hostname = Column(String)
+    username = Column(String)
+    password = Column(sqlalchemy_utils.StringEncryptedType(sqlalchemy.Unicode, 'local key', AesEngine))
+    api_token = Column(sqlalchemy_utils.StringEncryptedType(sqlalchemy.Unicode, 'local key', AesEngine))
+    created_ts = Column(sqlalchemy.DateTime(timezone=True))
+    threshold = Column(sqlalchemy.Numeric(10, 2))
+    serial_number = Column(sqlalchemy_utils.StringEncryptedType(sqlalchemy.Unicode, 'local key', AesEngine))
+    commissioned_ts = Column(sqlalchemy_utils.StringEncryptedType(sqlalchemy.DateTime, 'local key', AesEngine))
+
+
+class LocalCheck(LocalBase):
+    __tablename__ = 'local_check'
+
+    id = Column(Integer, primary_key=True)
+    system = relationship('LocalSystem', back_populates='checks')
+    system_id = Column(Integer, ForeignKey('local_system.id'))
+    settings = Column(sqlalchemy.JSON)
+
+
+class LocalCredential(LocalBase):
+    __tablename__ = 'local_credential'
+
+    id = Column(Integer, primary_key=True)
+    username = Column(String)
+    password = Column(String)
+    api_token = Column(sqlalchemy_utils.StringEncryptedType(sqlalchemy.Unicode, 'local key', AesEngine))
+
+
+class TestModelSerializer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        engine = sqlalchemy.create_engine('sqlite:///:memory:')
+        LocalBase.metadata.create_all(engine)
+        cls.session = sessionmaker(bind=engine)()
+        created = datetime.datetime(2024, 1, 2, 3, 4, 5)
+        for id_ in range(1, 4):
+            cls.session.add(LocalSystem(id=id_, hostname=f'host{id_}', username='su', password='secret',
+                                        api_token='token', created_ts=created, threshold=decimal.Decimal('1.50'),
+                                        serial_number=f'SN{id_}', commissioned_ts=created,
+                                        checks=[LocalCheck(settings={'status_code': 200})]))
+        cls.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.close()
+
+    def test_excluded_columns(self):
+        # the other encrypted columns are serialized decrypted
+        self.assertEqual(serializer_for(LocalSystem).keys,
+                         ['id', 'hostname', 'created_ts', 'threshold', 'serial_number', 'commissioned_ts'])
+        # the credentials are left out of a model without a serialize_exclude
+        self.assertEqual(ModelSerializer(LocalCredential).keys, ['id', 'api_token'])
+
+    def test_rows(self):
+        serializer = ModelSerializer(LocalSystem, nested={'checks': serializer_for(LocalCheck)})
+        systems = self.session.query(LocalSystem).options(selectinload(LocalSystem.checks)).order_by(LocalSystem.id)
+        rows = json.loads(to_json_bytes(serializer.rows(systems)))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0], {'id': 1, 'hostname': 'host1', 'created_ts': '2024-01-02T03:04:05',
+                                   'threshold': 1.5, 'serial_number': 'SN1', 'commissioned_ts': '2024-01-02T03:04:05',
+                                   'checks': [{'id': 1, 'system_id': 1, 'settings': {'status_code': 200}}]})
+        self.assertNotIn(b'secret', to_json_bytes(serializer.rows(systems)))
+        self.assertNotIn(b'token', to_json_bytes(serializer.rows(systems)))
+
+    def test_single_column(self):
+        self.assertEqual(ModelSerializer(LocalCheck, exclude=('system_id', 'settings')).row(LocalCheck(id=4)),
+                         {'id': 4})
+
+
+if __name__ == '__main__':
+    unittest.main()
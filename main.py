@@ -1,16 +1,45 @@
 import datetime
+from typing import List
 
-import requests
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
 
-from helpers.helpers import format_storage_bytes
+from helpers.memory_debug import MemoryTracker
+from helpers.serialization import json_response
 from log_setup import lg
-from monitors.ftp.drive_free_space import SystemConnection
-from monitors.time_check.time_check import seconds_between
+from monitors.history.availability import AvailabilityTimeline
+from monitors.history.ingest import MetricIngest
+from monitors.poller import poll_cycle
 from untracked_config.system_dicts import check_server_lists_dict, sysdicts, drive_check_table
 
+try:
+    from untracked_config.system_dicts import system_uplinks, uplink_devices
+except ImportError:  # the network devices the systems depend on are optional
+    system_uplinks, uplink_devices = {}, {}
+
 app = FastAPI()
 
+run_polling_daemon = False  # poll the fleet in the background for as long as the API is served
+trace_memory = False  # snapshot the memory after each polling cycle, for /debug/memory
+memory_tracker = MemoryTracker() if trace_memory else None
+polling_daemon = None
+
+
+@app.on_event("startup")
+def start_polling_daemon():
+    global polling_daemon
+    if run_polling_daemon:
+        from monitors.daemon import PollingDaemon
+
+        polling_daemon = PollingDaemon(drive_check_table, uplink_devices, system_uplinks, memory_tracker)
+        polling_daemon.start()
+
+
+@app.on_event("shutdown")
+def stop_polling_daemon():
+    if polling_daemon is not None:
+        polling_daemon.stop(timeout=30)
+
 
 @app.get("/")
 async def root():
@@ -22,6 +51,69 @@ async def say_hello(name: str):
     return {"message": f"Hello {name}"}
 
 
+@app.get("/systems")
+def systems():
+    """All of the systems with their check servers, without the credentials."""
+    from models.systems_settings import SystemModel
+
+    with SystemModel.session():
+        return json_response(SystemModel.fleet_rows())
+
+
+def _availability_window(days: float):
+    end = datetime.datetime.now(tz=datetime.timezone.utc)
+    return end - datetime.timedelta(days=days), end
+
+
+@app.get("/availability")
+def availability(days: float = 30):
+    """The availability, MTBF and MTTR of every host and CheckServer over the last days."""
+    from models.availability_interval import AvailabilityInterval
+
+    with AvailabilityInterval.session():
+        return AvailabilityInterval.window_summaries(*_availability_window(days))
+
+
+@app.get("/availability/{check_key}")
+def check_availability(check_key: str, days: float = 30):
+    """The availability, MTBF and MTTR of one check ('host:<system id>' or 'check:<CheckServer id>')."""
+    from models.availability_interval import AvailabilityInterval
+
+    with AvailabilityInterval.session():
+        summaries = AvailabilityInterval.window_summaries(*_availability_window(days), check_key=check_key)
+    if check_key not in summaries:
+        raise HTTPException(status_code=404, detail=f'No availability recorded for {check_key} in the window.')
+    return summaries[check_key]
+
+
+@app.get("/history/export.csv")
+def export_history(system_id: List[int] = Query(None), metric: List[str] = Query(None), days: float = None):
+    """Stream the metric history as CSV, optionally only some systems (?system_id=1&system_id=2), metrics, or days."""
+    from monitors.history.export import csv_chunks, history_chunks
+
+    start = _availability_window(days)[0] if days is not None else None
+    return StreamingResponse(csv_chunks(history_chunks(system_ids=system_id, metrics=metric, start=start)),
+                             media_type='text/csv',
+                             headers={'Content-Disposition': 'attachment; filename="metric_history.csv"'})
+
+
+@app.get("/ssh/handshakes")
+def ssh_handshakes(slow_secs: float = 2.0):
+    """The hosts whose last profiled SSH handshake was slow or failed, the slowest first, with where the time went."""
+    from monitors.ftp.ssh_profile import default_store
+
+    return default_store().slow_hosts(slow_secs)
+
+
+@app.get("/debug/memory")
+def debug_memory():
+    """The memory use of the monitor, the largest allocation sites, and the ones that grew over the last cycle."""
+
+    if memory_tracker is None:
+        raise HTTPException(status_code=404, detail='Memory tracing is off, see trace_memory in main.py.')
+    return memory_tracker.report()
+
+
 if __name__ == '__main__':
     # todo:
     #  * refactor this script into functions or such
@@ -30,18 +122,29 @@ if __name__ == '__main__':
     #  * interface for viewing status, history, and trends
     from models.systems_settings import SystemModel
     from models.check_server_table import CheckServer
+    from models.fleet_snapshot import database_available, load_fleet, SnapshotReconciler
+    from models.metric_history import MetricPoint
+    from models.availability_interval import AvailabilityInterval
 
     drop_old = False  # whether to drop old copies of the tables (creating them anew)
     load_data_to_tables = True  # whether to load table data into the database
+    poll_continuously = False  # keep polling each system on its adaptive interval instead of a single cycle
+    profile_ssh_handshakes = False  # time the SSH handshake to each system first, learning its preferred algorithms
 
     if drop_old:
         _ = CheckServer  # if this is not imported then relationship stuff starts throwing errors all over
         SystemModel.metadata.drop_all(bind=SystemModel.metadata.bind)
         SystemModel.metadata.create_all(bind=SystemModel.metadata.bind)
 
+    database_up = database_available()  # checked once, each check can wait for the connect timeout
+    if database_up:
+        # create any tables that don't exist yet, like the metric history
+        _ = MetricPoint, AvailabilityInterval
+        SystemModel.metadata.create_all(bind=SystemModel.metadata.bind, checkfirst=True)
+
     chk_svr: CheckServer  # for type hinting in loops below
 
-    if load_data_to_tables:
+    if load_data_to_tables and database_up:
         # loading system definitions to the db
         # todo: it looks like the check server table is being added repeatedly, possibly here
         with SystemModel.session() as sesn:
@@ -55,70 +158,46 @@ if __name__ == '__main__':
                         this_stm.add_check_server(**chk_svr)
             all_systems = [stm.__dict__ for stm in SystemModel.find_all()]  # look at existing systems
 
-    # proof of concept check system storage
-    with SystemModel.session() as sesn:
-        for stm in SystemModel.find_all():
-            try:
-                with SystemConnection(stm, retry=2) as ssc:
-                    # check drive space available
-                    # ---------------------------
-                    check_drive_letter: str = drive_check_table[stm.id]['drive_letter']
-                    free_space_bytes: int = ssc.get_free_space(check_drive_letter)
-                    free_space: str = format_storage_bytes(free_space_bytes, binary_system=False)
-                    lg.info('System %s has %s remaining free on the %s drive.',
-                            stm.nickname, free_space, check_drive_letter)
-                    warning_bytes = drive_check_table[stm.id]['alert_low_bytes'][0]
-                    warning_bytes_formatted: str = format_storage_bytes(warning_bytes, binary_system=False)
-                    if warning_bytes >= free_space_bytes:
-                        lg.warning('BELOW WARNING LIMIT: %s for System %s has %s remaining free on the %s drive.',
-                                   warning_bytes_formatted, stm.nickname, free_space, check_drive_letter)
-
-                    system_up_since = ssc.get_windows_boot_time()
-                    system_up_time = datetime.datetime.now() - system_up_since
-                    uptime_str = f' System up for {str(system_up_time)} since {system_up_since}'
-
-                    # check clock drift
-                    # -----------------
-                    remote_system_time = ssc.get_system_time()
-                    time_diff_secs: float = seconds_between(datetime.datetime.now(), remote_system_time)
-
-                    # if the time is off enough, start pushing it a little closer
-                    if abs(time_diff_secs) > 10:
-                        fixing_str = ' The time will be nudged ~300 milliseconds closer.'  # leading space for below
-                    else:
-                        fixing_str = ''
-
-                    lg.info(
-                        f'The time for the remote system {stm.nickname} is {remote_system_time}, off from local system '
-                        f'time by {time_diff_secs:.2f} seconds.{fixing_str}'
-                        f'{uptime_str}')
-                    # if time_diff_secs >= 60:  # todo: better notification
-                    #     input('Please note the time difference. (enter)\n')
-                    if fixing_str:
-                        ssc.nudge_system_time('+' if time_diff_secs < 0 else '-')
-                        remote_system_time_new = ssc.get_system_time()
-                        time_diff_secs_new: float = seconds_between(datetime.datetime.now(), remote_system_time_new)
-
-                    # check the web servers
-                    # ---------------------
-                    for chk_svr in stm.check_servers:
-                        if chk_svr.status_condition_type == 'status_code':
-                            server_address = f'http://{stm.web_address}:{chk_svr.port}/{chk_svr.address_suffix}'
-                            try:
-                                response = requests.get(server_address, timeout=5)
-                                if response.status_code == chk_svr.status_condition_value_data['status_code']:
-                                    lg.info('Server active at: %s', server_address)
-                                else:
-                                    lg.warning('Server failure %s at %s', response.status_code, server_address)
-                            except requests.exceptions.ReadTimeout:
-                                lg.warning('Server timeout at %s', server_address)
-                            except requests.exceptions.ConnectionError as cerr:
-                                lg.warning('Server connection failure: %s', cerr)
-
-            except AttributeError as atter:
-                if '''NoneType' object has no attribute 'open_session''' in str(atter):
-                    lg.warning('''Couldn't connect to %s''', stm['hostname'])
-                else:
-                    raise atter
+    # check the systems, sweeping for reachability first so down hosts are skipped
+    # if the database is down use the fleet snapshot, refreshing it in the background once the database is back
+    if poll_continuously:
+        from monitors.daemon import PollingDaemon
+
+        daemon = PollingDaemon(drive_check_table, uplink_devices, system_uplinks, database_up=database_up)
+        daemon.start()
+        try:
+            while daemon.is_alive():
+                daemon.join(1)
+        except KeyboardInterrupt:
+            daemon.stop()
+            lg.info('Stopped polling.')
+    else:
+        with SystemModel.session() as sesn:
+            systems, drive_checks, from_database = load_fleet(drive_check_table, database_up=database_up)
+            if from_database:
+                ingest = MetricIngest()
+                timeline = AvailabilityInterval.resume_timeline()
+            else:
+                # the history is only kept in the database, the cycle's is held until the database is back
+                pending_points = []
+                ingest = MetricIngest(save_points=lambda *system_metric_points: pending_points.append(
+                    system_metric_points))
+                timeline = AvailabilityTimeline()
+            if profile_ssh_handshakes:
+                from monitors.ftp.ssh_profile import profile_fleet
+                profile_fleet(systems)
+            poll_cycle(systems, drive_checks, ingest=ingest, uplink_devices=uplink_devices,
+                       system_uplinks=system_uplinks, timeline=timeline)
+            ingest.flush()
+            if from_database:
+                AvailabilityInterval.save_timeline(timeline)
+            else:
+                def save_pending_history(_systems):
+                    for system_id, metric, points in pending_points:
+                        MetricPoint.add_points(system_id, metric, points)
+                    AvailabilityInterval.save_timeline(timeline)
+                    lg.info('The database is back, the history of the cycle was saved.')
+
+                SnapshotReconciler(drive_check_table, on_reconciled=save_pending_history).start()
     input('Press enter to continue.')
 pass
@@ -0,0 +1,119 @@
+"""Contains the AvailabilityInterval SQLAlchemy definition, the up/down timeline of the hosts and CheckServers."""
+import datetime
+
+from sqlalchemy import Column, DateTime, Index, Integer, String
+
+from helpers.dev_common import exception_one_line
+from helpers.helpers import jsonize_sqla_model
+from log_setup import lg
+from models.sqla_instance import Base
+from monitors.history.availability import AvailabilityTimeline, DEFAULT_MAX_GAP, Interval
+
+
+def _to_datetime(ts: float) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)
+
+
+def _to_timestamp(dt: datetime.datetime) -> float:
+    if dt.tzinfo is None:  # some databases (SQLite) don't keep the time zone, they are stored as UTC
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+class AvailabilityInterval(Base):
+    """A closed interval that a check (see monitors.history.availability) had the same status for."""
+
+    __tablename__ = 'availability_interval'
+    __table_args__ = (
+        Index('availability_interval_check_start', 'check_key', 'start_ts'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    check_key = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    start_ts = Column(DateTime(timezone=True), nullable=False)
+    end_ts = Column(DateTime(timezone=True), nullable=False)
+
+    @classmethod
+    def save_intervals(cls, changed):
+        """Save the intervals changed in an AvailabilityTimeline, new ones are given their ids.
+
+        :param changed: list, of (check key, Interval) from AvailabilityTimeline.take_dirty.
+        """
+
+        new_rows = []
+        for key, interval in changed:
+            if interval.id is None:
+                row = cls(check_key=key, status=interval.status, start_ts=_to_datetime(interval.start),
+                          end_ts=_to_datetime(interval.end))
+                cls.session.add(row)
+                new_rows.append((interval, row))
+            else:
+                cls.query.filter_by(id=interval.id).update({'end_ts': _to_datetime(interval.end)})
+        try:
+            cls.session.commit()
+            for interval, row in new_rows:
+                interval.id = row.id
+        except Exception as exc:
+            lg.error(exception_one_line(exception_obj=exc))
+            cls.session.rollback()
+
+    @classmethod
+    def find_overlapping(cls, start: datetime.datetime, end: datetime.datetime, check_key: str = None):
+        """Get the intervals overlapping the window, grouped by check.
+
+        :param start: datetime.datetime
+        :param end: datetime.datetime
+        :param check_key: str, only this check, or None for all of them.
+        :return: dict, {check key: list of Interval in time order}
+        """
+
+        query = cls.session.query(cls.id, cls.check_key, cls.status, cls.start_ts, cls.end_ts).filter(
+            cls.start_ts <= end, cls.end_ts >= start)
+        if check_key is not None:
+            query = query.filter(cls.check_key == check_key)
+
+        intervals = {}
+        for id_, key, status, start_ts, end_ts in query.order_by(cls.check_key, cls.start_ts):
+            intervals.setdefault(key, []).append(Interval(_to_timestamp(start_ts), _to_timestamp(end_ts), status, id_))
+        return intervals
+
+    @classmethod
+    def resume_timeline(cls, max_gap: float = DEFAULT_MAX_GAP) -> AvailabilityTimeline:
+        """Get a timeline with the recent intervals loaded, so the intervals open when the monitor stopped continue.
+
+        :param max_gap: float, seconds, see AvailabilityTimeline.
+        :return: AvailabilityTimeline
+        """
+
+        timeline = AvailabilityTimeline(max_gap)
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        for key, intervals in cls.find_overlapping(now - datetime.timedelta(seconds=max_gap), now).items():
+            timeline.load(key, intervals)
+        return timeline
+
+    @classmethod
+    def save_timeline(cls, timeline: AvailabilityTimeline):
+        """Save the intervals changed in the timeline, then drop the ones it no longer needs from memory."""
+
+        cls.save_intervals(timeline.take_dirty())
+        # only the intervals in the current gap window are needed to continue the timeline
+        timeline.prune(datetime.datetime.now().timestamp() - timeline.max_gap)
+
+    @classmethod
+    def window_summaries(cls, start: datetime.datetime, end: datetime.datetime, check_key: str = None) -> dict:
+        """Get the availability, MTBF and MTTR of the checks over the window, see CheckTimeline.summary.
+
+        :param start: datetime.datetime
+        :param end: datetime.datetime
+        :param check_key: str, only this check, or None for all of them.
+        :return: dict, {check key: summary dict}
+        """
+
+        timeline = AvailabilityTimeline()
+        for key, intervals in cls.find_overlapping(start, end, check_key).items():
+            timeline.load(key, intervals)
+        return timeline.summaries(start.timestamp(), end.timestamp())
+
+    def jsonizable(self):
+        return jsonize_sqla_model(self)
@@ -28,7 +28,7 @@ class CheckServer(Base):
     port = Column(String)
     address_suffix = Column(String)
     status_condition_type = Column(String)
-    status_condition_value_data = Column(JSONB)
+    status_condition_value_data = Column(sqlalchemy.JSON().with_variant(JSONB, 'postgresql'))  # JSON on sqlite
 
     def __init__(self, **kwargs):
         # for the kwargs provided, assign them to the corresponding columns
@@ -76,6 +76,36 @@ class CheckServer(Base):
         """
         return cls.query.all()
 
+    @classmethod
+    def apply_config(cls, system_id: int, check_server_dicts):
+        """Make the system's check servers match its configuration, as in check_server_lists_dict.
+
+        Check servers are matched on their port and address suffix, those not in the configuration are deleted.
+
+        :param system_id: int, the SystemModel id.
+        :param check_server_dicts: iterable, of {column name: value}
+        """
+
+        existing = {(str(chk_svr.port), chk_svr.address_suffix): chk_svr
+                    for chk_svr in cls.query.filter_by(parent_id=system_id)}
+        wanted = {(str(server_dict.get('port')), server_dict.get('address_suffix')): server_dict
+                  for server_dict in check_server_dicts}
+        for key in existing.keys() - wanted.keys():
+            cls.session.delete(existing[key])
+        for key, server_dict in wanted.items():
+            chk_svr = existing.get(key)
+            if chk_svr is None:
+                cls.session.add(cls(**({'parent_id': system_id} | server_dict)))
+                continue
+            for column, value in server_dict.items():
+                if column not in ('id', 'parent_id') and column in cls.__table__.columns:
+                    setattr(chk_svr, column, value)
+        try:
+            cls.session.commit()
+        except Exception as exc:
+            lg.error(exception_one_line(exception_obj=exc))
+            cls.session.rollback()
+
     def save_to_database(self):
         """Save the changed to entry to the database."""
 
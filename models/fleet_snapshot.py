@@ -0,0 +1,229 @@
+"""A local snapshot file of the fleet configuration, so the monitor can start and poll while the database is down.
+
+The snapshot has the systems, their check servers, and the drive check thresholds. The credentials are encrypted with
+the same AES key and engine as the password column in the database. It is a compact JSON file, re-exported every time
+the fleet is loaded from the database.
+"""
+import datetime
+import json
+import os
+import threading
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy.orm import selectinload
+from sqlalchemy.pool import NullPool
+
+from log_setup import lg
+from models.check_server_table import CheckServer
+from models.sqla_instance import engine, Session
+from models.systems_settings import SystemModel
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(Path(__file__).parent.parent.resolve(), 'untracked_config', 'fleet_snapshot.json')
+SNAPSHOT_VERSION = 1
+DATABASE_CHECK_TIMEOUT_SECS = 5
+
+SYSTEM_FIELDS = 'id', 'hostname', 'static_ip', 'nickname', 'physical_location'
+CREDENTIAL_FIELDS = 'username', 'password'
+CHECK_SERVER_FIELDS = 'id', 'parent_id', 'port', 'address_suffix', 'status_condition_type', \
+    'status_condition_value_data'
+
+# the column type does the encryption, so the snapshot is encrypted the same way as the database
+_credential_type = SystemModel.__table__.columns['password'].type
+
+
+def encrypt_credential(value: str) -> str:
+    return _credential_type.process_bind_param(value, None)
+
+
+def decrypt_credential(value: str) -> str:
+    return _credential_type.process_result_value(value, None)
+
+
+class SnapshotCheckServer:
+    """A CheckServer loaded from the snapshot, it has the same attributes used by the poller."""
+
+    def __init__(self, **kwargs):
+        for key in CHECK_SERVER_FIELDS:
+            setattr(self, key, kwargs.get(key))
+
+
+class SnapshotSystem:
+    """A SystemModel loaded from the snapshot, it has the same attributes used by the poller and SystemConnection."""
+
+    def __init__(self, check_servers=(), **kwargs):
+        for key in SYSTEM_FIELDS:
+            setattr(self, key, kwargs.get(key))
+        for key in CREDENTIAL_FIELDS:
+            setattr(self, key, decrypt_credential(kwargs[key]) if kwargs.get(key) is not None else None)
+        self.check_servers = [SnapshotCheckServer(**chk_svr) for chk_svr in check_servers]
+
+    def __repr__(self):
+        lcb, rcb = '{', '}'
+        return f'''{super().__repr__()}: SnapshotSystem{lcb}id: {self.id}, nickname:"{self.nickname}{rcb}"'''
+
+    @property
+    def web_address(self):
+        if self.static_ip:
+            return self.static_ip
+        return self.hostname
+
+
+def export_snapshot(systems, drive_check_table: dict, file_path: str = DEFAULT_SNAPSHOT_PATH):
+    """Write the fleet configuration to the snapshot file.
+
+    :param systems: iterable of SystemModel, with their check_servers.
+    :param drive_check_table: dict, {system id: drive check settings}
+    :param file_path: str, where to write the snapshot.
+    """
+
+    system_dicts = []
+    for stm in systems:
+        system_dict = {key: getattr(stm, key) for key in SYSTEM_FIELDS}
+        system_dict.update({key: encrypt_credential(getattr(stm, key)) for key in CREDENTIAL_FIELDS})
+        system_dict['check_servers'] = [{key: getattr(chk_svr, key) for key in CHECK_SERVER_FIELDS}
+                                        for chk_svr in stm.check_servers]
+        system_dicts.append(system_dict)
+
+    snapshot = dict(version=SNAPSHOT_VERSION,
+                    exported=datetime.datetime.now().isoformat(),
+                    systems=system_dicts,
+                    drive_check_table=drive_check_table)
+
+    # write then swap so a reader never sees a half written snapshot
+    temp_path = f'{file_path}.tmp'
+    with open(temp_path, 'w') as sf:
+        json.dump(snapshot, sf, separators=(',', ':'))
+    os.replace(temp_path, file_path)
+    lg.debug('Exported the fleet snapshot of %s systems to %s', len(system_dicts), file_path)
+
+
+def load_snapshot(file_path: str = DEFAULT_SNAPSHOT_PATH):
+    """Load the fleet configuration from the snapshot file.
+
+    :param file_path: str, the snapshot file.
+    :return: tuple, (list of SnapshotSystem, drive_check_table dict)
+    """
+
+    with open(file_path, 'rb') as sf:
+        snapshot = json.loads(sf.read())
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f'Unsupported fleet snapshot version {snapshot.get("version")} in {file_path}')
+
+    systems = [SnapshotSystem(**system_dict) for system_dict in snapshot['systems']]
+    # json keys are always strings, the system ids are ints
+    drive_check_table = {int(system_id): drive_check for system_id, drive_check
+                         in snapshot['drive_check_table'].items()}
+    lg.info('Loaded %s systems from the fleet snapshot exported %s.', len(systems), snapshot['exported'])
+    return systems, drive_check_table
+
+
+_check_engine = None
+
+
+def _database_check_engine():
+    """An engine for checking the database with a connect timeout, so a hung database can't block the startup."""
+
+    global _check_engine
+    if _check_engine is None:
+        connect_args = {}
+        if engine.url.get_backend_name() in ('postgresql', 'mysql', 'mariadb'):
+            connect_args['connect_timeout'] = DATABASE_CHECK_TIMEOUT_SECS
+        elif engine.url.get_backend_name() == 'sqlite':
+            connect_args['timeout'] = DATABASE_CHECK_TIMEOUT_SECS
+        _check_engine = sqlalchemy.create_engine(engine.url, poolclass=NullPool, connect_args=connect_args)
+    return _check_engine
+
+
+def database_available() -> bool:
+    """Whether the database can be reached, waiting at most DATABASE_CHECK_TIMEOUT_SECS to connect."""
+
+    try:
+        with _database_check_engine().connect() as conn:
+            conn.execute(sqlalchemy.text('SELECT 1'))
+        return True
+    except sqlalchemy.exc.DBAPIError as db_err:
+        lg.warning('The database is not available: %s', db_err.orig)
+        return False
+
+
+def load_systems_from_database(system_ids=None):
+    """Get the systems that aren't retired with their check servers loaded.
+
+    :param system_ids: iterable, of the SystemModel ids to get, or None for all of them.
+    :return: list of SystemModel
+    """
+
+    _ = CheckServer  # needed for the relationship
+    query = SystemModel.query.options(selectinload(SystemModel.check_servers)).filter(
+        SystemModel.entry_retired_ts.is_(None))
+    if system_ids is not None:
+        query = query.filter(SystemModel.id.in_(list(system_ids)))
+    return query.all()
+
+
+def load_fleet(drive_check_table: dict, file_path: str = DEFAULT_SNAPSHOT_PATH, database_up: bool = None):
+    """Load the fleet from the database, refreshing the snapshot, or from the snapshot if the database is down.
+
+    :param drive_check_table: dict, {system id: drive check settings} from the configuration.
+    :param file_path: str, the snapshot file.
+    :param database_up: bool, whether the database is available if it was just checked, or None to check it.
+    :return: tuple, (list of systems, drive_check_table dict, bool loaded from the database), the list of systems is
+        empty if the database is down and there is no snapshot yet.
+    """
+
+    if database_up is None:
+        database_up = database_available()
+    if database_up:
+        systems = load_systems_from_database()
+        try:
+            export_snapshot(systems, drive_check_table, file_path)
+        except OSError as os_err:
+            lg.warning('Could not write the fleet snapshot: %s', os_err)
+        return systems, drive_check_table, True
+
+    try:
+        systems, snapshot_drive_check_table = load_snapshot(file_path)
+    except FileNotFoundError:
+        lg.error('The database is down and there is no fleet snapshot at %s yet, no systems can be polled until the '
+                 'database is available.', file_path)
+        return [], drive_check_table, False
+    return systems, snapshot_drive_check_table, False
+
+
+class SnapshotReconciler(threading.Thread):
+    """Waits in the background for the database to come back, then refreshes the snapshot from it.
+
+    :param drive_check_table: dict, {system id: drive check settings} from the configuration.
+    :param on_reconciled: callable, called with the list of systems from the database once it is back.
+    :param retry_seconds: float, how long to wait between tries.
+    :param file_path: str, the snapshot file.
+    """
+
+    def __init__(self, drive_check_table: dict, on_reconciled=None, retry_seconds: float = 60,
+                 file_path: str = DEFAULT_SNAPSHOT_PATH):
+        super().__init__(name='SnapshotReconciler', daemon=True)
+        self.drive_check_table = drive_check_table
+        self.on_reconciled = on_reconciled
+        self.retry_seconds = retry_seconds
+        self.file_path = file_path
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.retry_seconds):
+            if not database_available():
+                continue
+            try:
+                systems = load_systems_from_database()
+                export_snapshot(systems, self.drive_check_table, self.file_path)
+                lg.info('The database is back, the fleet snapshot was refreshed.')
+                if self.on_reconciled is not None:
+                    self.on_reconciled(systems)
+                return
+            except (sqlalchemy.exc.DBAPIError, OSError) as reconcile_err:
+                lg.warning('Could not reconcile the fleet snapshot: %s', reconcile_err)
+            finally:
+                Session.remove()  # this thread's session
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,66 @@
+"""Contains the MetricPoint SQLAlchemy definition, the compressed history of the metrics measured for each system."""
+import datetime
+
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, String
+
+from helpers.dev_common import exception_one_line
+from helpers.helpers import jsonize_sqla_model
+from log_setup import lg
+from models.sqla_instance import Base
+
+
+class MetricPoint(Base):
+    """A kept point of a compressed metric series (free space, clock drift, uptime) for a system."""
+
+    __tablename__ = 'metric_history'
+    __table_args__ = (
+        Index('metric_history_series', 'system_id', 'metric', 'ts'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    system_id = Column(Integer, ForeignKey('system_info.id'), nullable=False)
+    metric = Column(String, nullable=False)
+    ts = Column(DateTime(timezone=True), nullable=False)
+    value = Column(Float, nullable=False)
+
+    @classmethod
+    def add_points(cls, system_id: int, metric: str, points):
+        """Save the kept points of a series to the database.
+
+        :param system_id: int, the SystemModel id.
+        :param metric: str, the metric name.
+        :param points: list, of (epoch seconds, value)
+        """
+
+        if not points:
+            return
+        for ts, value in points:
+            cls.session.add(cls(system_id=system_id, metric=metric, value=value,
+                                ts=datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)))
+        try:
+            cls.session.commit()
+        except Exception as exc:
+            lg.error(exception_one_line(exception_obj=exc))
+            cls.session.rollback()
+
+    @classmethod
+    def find_series(cls, system_id: int, metric: str, start: datetime.datetime = None,
+                    end: datetime.datetime = None):
+        """Get the kept points of a series in time order.
+
+        :param system_id: int, the SystemModel id.
+        :param metric: str, the metric name.
+        :param start: datetime.datetime, the earliest point, or None for all.
+        :param end: datetime.datetime, the latest point, or None for all.
+        :return: list, of (epoch seconds, value)
+        """
+
+        query = cls.session.query(cls.ts, cls.value).filter(cls.system_id == system_id, cls.metric == metric)
+        if start is not None:
+            query = query.filter(cls.ts >= start)
+        if end is not None:
+            query = query.filter(cls.ts <= end)
+        return [(ts.timestamp(), value) for ts, value in query.order_by(cls.ts)]
+
+    def jsonizable(self):
+        return jsonize_sqla_model(self)
@@ -3,11 +3,12 @@ from pprint import pformat
 import sqlalchemy
 import sqlalchemy_utils
 from sqlalchemy import Column, func
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, selectinload
 from sqlalchemy_utils.types.encrypted.encrypted_type import AesEngine
 
 from helpers.dev_common import exception_one_line
 from helpers.helpers import jsonize_sqla_model
+from helpers.serialization import ModelSerializer, serializer_for
 from log_setup import lg
 from models.model_wrapper import ModelWrapper
 from models.sqla_instance import Base
@@ -25,6 +26,8 @@ class SystemModel(Base):
                                  )
 
     db_current_ts = func.current_timestamp()
+    serialize_exclude = frozenset({'username', 'password'})  # the credentials are never serialized
+    _fleet_serializer = None  # built on first use, see fleet_rows
 
     hostname = Column(sqlalchemy.String, nullable=False)
     static_ip = Column(sqlalchemy.String)
@@ -96,6 +99,59 @@ class SystemModel(Base):
         """
         return cls.query.all()
 
+    @classmethod
+    def fleet_rows(cls):
+        """Get the systems that aren't retired with their check servers as json serializable dicts, without the
+        credentials.
+
+        The check servers are loaded with one more query for all of the systems, not one for each system.
+
+        :return: list
+        """
+
+        from models.check_server_table import CheckServer
+        if cls._fleet_serializer is None:
+            cls._fleet_serializer = ModelSerializer(cls, nested={'check_servers': serializer_for(CheckServer)})
+        return cls._fleet_serializer.rows(cls.query.options(selectinload(cls.check_servers)).filter(
+            cls.entry_retired_ts.is_(None)).order_by(cls.id))
+
+    @classmethod
+    def apply_config(cls, system_dict: dict):
+        """Add or update a system from its configuration dict, as in untracked_config.system_dicts.sysdicts.
+
+        The system is found by its id if the dict has one, otherwise by its hostname. A retired system is brought
+        back.
+
+        :param system_dict: dict, {column name: value}
+        :return: int, the system id, or None if it could not be saved.
+        """
+
+        stm = None
+        if system_dict.get('id') is not None:
+            stm = cls.query.filter_by(id=system_dict['id']).first()
+        if stm is None:
+            stm = cls.query.filter_by(hostname=system_dict['hostname']).first()
+        if stm is None:
+            stm = cls(**system_dict)
+        else:
+            for key, value in system_dict.items():
+                if key != 'id' and key in cls.__table__.columns:
+                    setattr(stm, key, value)
+            stm.entry_retired_ts = None
+        stm.save_to_database()
+        return stm.id
+
+    @classmethod
+    def retire(cls, system_id: int):
+        """Mark a system as retired so it is no longer polled, its history is kept."""
+
+        cls.query.filter_by(id=system_id).update({'entry_retired_ts': func.current_timestamp()})
+        try:
+            cls.session.commit()
+        except Exception as exc:
+            lg.error(exception_one_line(exception_obj=exc))
+            cls.session.rollback()
+
     def save_to_database(self):
         """Save the changed to defect to the database."""
 
@@ -0,0 +1,103 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+import mock
+
+from models.fleet_snapshot import database_available, export_snapshot, load_fleet, load_snapshot, SnapshotReconciler
+
+
+class LocalCheckServer:
+    def __init__(self, id_, parent_id):
+        self.id = id_
+        self.parent_id = parent_id
+        self.port = '8080'
+        self.address_suffix = 'status'
+        self.status_condition_type = 'status_code'
+        self.status_condition_value_data = {'status_code': 200}
+
+
+class LocalSystem:
+    """Stands in for a SystemModel with its check servers loaded."""
+
+    def __init__(self, id_, hostname):
+        self.id = id_
+        self.hostname = hostname
+        self.static_ip = None
+        self.nickname = hostname.upper()
+        self.physical_location = 'rack 1'
+        self.username = 'su'
+        self.password = f'{hostname} secret'
+        self.check_servers = [LocalCheckServer(id_ * 10, id_)]
+
+
+DRIVE_CHECK_TABLE = {1: dict(drive_letter='C', alert_low_bytes=[1_000]),
+                     2: dict(drive_letter='D', alert_low_bytes=[2_000])}
+
+
+class TestFleetSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_path = os.path.join(self.tmp_dir.name, 'fleet_snapshot.json')
+        self.systems = [LocalSystem(1, 'host1'), LocalSystem(2, 'host2')]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        export_snapshot(self.systems, DRIVE_CHECK_TABLE, self.snapshot_path)
+        systems, drive_check_table = load_snapshot(self.snapshot_path)
+
+        self.assertEqual(drive_check_table, DRIVE_CHECK_TABLE)  # the int system ids survive the JSON keys
+        self.assertEqual([(stm.id, stm.hostname, stm.nickname, stm.web_address) for stm in systems],
+                         [(1, 'host1', 'HOST1', 'host1'), (2, 'host2', 'HOST2', 'host2')])
+        self.assertEqual([(stm.username, stm.password) for stm in systems],
+                         [('su', 'host1 secret'), ('su', 'host2 secret')])
+        chk_svr = systems[1].check_servers[0]
+        self.assertEqual((chk_svr.id, chk_svr.parent_id, chk_svr.port, chk_svr.status_condition_value_data),
+                         (20, 2, '8080', {'status_code': 200}))
+
+    def test_credentials_encrypted(self):
+        export_snapshot(self.systems, DRIVE_CHECK_TABLE, self.snapshot_path)
+        with open(self.snapshot_path) as sf:
+            raw = sf.read()
+        self.assertNotIn('secret', raw)
+        self.assertNotIn('"su"', raw)
+        self.assertEqual(len(json.loads(raw)['systems']), 2)
+
+    def test_unsupported_version(self):
+        with open(self.snapshot_path, 'w') as sf:
+            json.dump(dict(version=0, systems=[], drive_check_table={}), sf)
+        with self.assertRaises(ValueError):
+            load_snapshot(self.snapshot_path)
+
+    def test_database_available(self):
+        self.assertTrue(database_available())
+
+    def test_fallback_to_snapshot(self):
+        export_snapshot(self.systems, DRIVE_CHECK_TABLE, self.snapshot_path)
+        with mock.patch('models.fleet_snapshot.database_available', return_value=False):
+            systems, drive_check_table, from_database = load_fleet({}, self.snapshot_path)
+        self.assertFalse(from_database)
+        self.assertEqual([stm.hostname for stm in systems], ['host1', 'host2'])
+        self.assertEqual(drive_check_table, DRIVE_CHECK_TABLE)
+
+    def test_no_database_and_no_snapshot(self):
+        with mock.patch('models.fleet_snapshot.database_available', return_value=False):
+            self.assertEqual(load_fleet(DRIVE_CHECK_TABLE, self.snapshot_path), ([], DRIVE_CHECK_TABLE, False))
+
+    def test_reconciler_refreshes_and_calls_back(self):
+        reconciled = threading.Event()
+        with mock.patch('models.fleet_snapshot.load_systems_from_database', return_value=self.systems):
+            reconciler = SnapshotReconciler(DRIVE_CHECK_TABLE, on_reconciled=lambda systems: reconciled.set(),
+                                            retry_seconds=0.01, file_path=self.snapshot_path)
+            reconciler.start()
+            self.assertTrue(reconciled.wait(5))
+            reconciler.join(5)
+        self.assertEqual(len(load_snapshot(self.snapshot_path)[0]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
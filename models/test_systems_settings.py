@@ -0,0 +1,40 @@
+import unittest
+
+import sqlalchemy
+from sqlalchemy.pool import StaticPool
+
+from models.check_server_table import CheckServer
+from models.sqla_instance import Base, engine, Session
+from models.systems_settings import SystemModel
+
+local_engine = sqlalchemy.create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+
+
+class TestFleetRows(unittest.TestCase):
+    def setUp(self):
+        Session.remove()
+        Session.configure(bind=local_engine)
+        Base.metadata.create_all(local_engine)
+        for id_ in (1, 2):
+            SystemModel.apply_config(dict(id=id_, hostname=f'host{id_}', nickname=f'HOST{id_}', username='su',
+                                          password=f'host{id_} secret'))
+            CheckServer.apply_config(id_, [dict(port='8080', address_suffix='status',
+                                                status_condition_type='status_code',
+                                                status_condition_value_data={'status_code': 200})])
+
+    def tearDown(self):
+        Session.remove()
+        Base.metadata.drop_all(local_engine)
+        Session.configure(bind=engine)
+
+    def test_fleet_rows(self):
+        SystemModel.retire(2)
+        rows = SystemModel.fleet_rows()
+        self.assertEqual([row['hostname'] for row in rows], ['host1'])  # the retired system is left out
+        self.assertNotIn('password', rows[0])
+        self.assertNotIn('username', rows[0])
+        self.assertEqual(rows[0]['check_servers'][0]['status_condition_value_data'], {'status_code': 200})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,228 @@
+"""Collector mode: a script on the host writes its status to one small file that the monitor fetches over SFTP.
+
+On the older HMIs every exec_command starts cmd, wmic or powershell, which is slow on their hardware. With the
+collector deployed, ssm_collector.ps1 runs as a scheduled task on the host and writes disk, time, boot and service
+state to a status file of key=value lines, so a poll is a single small SFTP read.
+
+The status file looks like:
+    version=1
+    written=2024-05-01T12:00:00.123
+    boot=2024-04-28T06:10:00
+    drive.C.free=123456789
+    drive.C.total=255000000000
+    service.W32Time=Running
+    clock.offset=+00.0123456
+"""
+import datetime
+import io
+import os
+import re
+import time
+from typing import Dict, Iterable, Tuple, Union
+
+import paramiko
+
+from log_setup import lg
+
+COLLECTOR_DIR = 'C:/ProgramData/SystemsStatusMonitor'
+SCRIPT_NAME = 'ssm_collector.ps1'
+WRAPPER_NAME = 'ssm_collector.cmd'
+STATUS_FILE_NAME = 'ssm_status.txt'
+TASK_NAME = 'SystemsStatusMonitorCollector'
+STATUS_VERSION = 1
+STALE_AFTER_SECS = 300  # a status file unchanged for longer than this is not used, the task may have stopped
+
+LOCAL_SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), SCRIPT_NAME)
+
+# service names and the time reference go on the scheduled task's command line
+safe_argument_ptn = re.compile(r'^[\w .\-]+$', re.ASCII)
+single_letter_ptn = re.compile('^[a-zA-Z]$')
+
+
+def sftp_path(windows_path: str) -> str:
+    """Get the path for the Windows OpenSSH SFTP server, C:/dir becomes /C:/dir."""
+
+    return '/' + windows_path.replace('\\', '/').lstrip('/')
+
+
+def cmd_path(windows_path: str) -> str:
+    return windows_path.replace('/', '\\')
+
+
+class CollectorStatus:
+    """The host status read from a collector status file.
+
+    :param written: datetime.datetime, when the collector wrote the file, host clock.
+    :param boot_time: datetime.datetime, host clock.
+    :param drives: dict, {drive letter: (free bytes, total bytes)}
+    :param services: dict, {service name: state}
+    :param clock_offset_secs: float, the reference clock minus the host clock, or None if not measured.
+    """
+
+    def __init__(self, written: datetime.datetime, boot_time: datetime.datetime = None,
+                 drives: Dict[str, Tuple[int, int]] = None, services: Dict[str, str] = None,
+                 clock_offset_secs: float = None):
+        self.written = written
+        self.boot_time = boot_time
+        self.drives = drives or {}
+        self.services = services or {}
+        self.clock_offset_secs = clock_offset_secs
+        self.age_secs = None  # set when read, see StatusAges
+
+    def free_space(self, drive_letter: str) -> Union[int, None]:
+        drive = self.drives.get(drive_letter.upper())
+        return drive[0] if drive else None
+
+    @property
+    def clock_drift_secs(self) -> Union[float, None]:
+        """The seconds the host clock is ahead of the reference, like poller.check_clock."""
+
+        return None if self.clock_offset_secs is None else -self.clock_offset_secs
+
+    def stopped_services(self):
+        return [name for name, state in self.services.items() if state != 'Running']
+
+
+def parse_status(text: str) -> CollectorStatus:
+    """Parse the contents of a status file.
+
+    :param text: str
+    :return: CollectorStatus
+    """
+
+    values = {}
+    for line in text.splitlines():
+        key, sep, value = line.strip().partition('=')
+        if sep:
+            values[key] = value
+
+    if int(values.get('version', 0)) != STATUS_VERSION:
+        raise ValueError(f'Unsupported collector status version: {values.get("version")}')
+
+    drives = {}
+    services = {}
+    for key, value in values.items():
+        if key.startswith('drive.') and key.endswith('.free'):
+            letter = key.split('.')[1].upper()
+            drives[letter] = (int(value), int(values.get(f'drive.{letter}.total', 0)))
+        elif key.startswith('service.'):
+            services[key[len('service.'):]] = value
+
+    offset = values.get('clock.offset')
+    return CollectorStatus(written=datetime.datetime.fromisoformat(values['written']),
+                           boot_time=datetime.datetime.fromisoformat(values['boot']) if 'boot' in values else None,
+                           drives=drives,
+                           services=services,
+                           clock_offset_secs=float(offset.replace(',', '.')) if offset else None)
+
+
+def read_status(sftp, remote_path: str = None) -> CollectorStatus:
+    """Fetch and parse the status file.
+
+    :param sftp: paramiko.SFTPClient, open to the host.
+    :param remote_path: str, the SFTP path of the status file.
+    :return: CollectorStatus
+    """
+
+    remote_path = remote_path or sftp_path(f'{COLLECTOR_DIR}/{STATUS_FILE_NAME}')
+    with sftp.open(remote_path, 'rb') as sf:
+        return parse_status(sf.read().decode('utf-8-sig'))
+
+
+class StatusAges:
+    """How long each host's status has gone unchanged, timed by the monitor's clock.
+
+    The host clock can be off by any amount, so neither the written time nor the file mtime is compared with the
+    monitor's clock. A status is as old as the time since the monitor first read its written time, a status that is
+    first read counts as new.
+    """
+
+    def __init__(self):
+        self.first_seen = {}  # {host: (written, time.monotonic() when first read)}
+
+    def age_secs(self, host: str, written: datetime.datetime, now: float = None) -> float:
+        now = time.monotonic() if now is None else now
+        seen = self.first_seen.get(host)
+        if seen is None or seen[0] != written:
+            self.first_seen[host] = (written, now)
+            return 0.0
+        return now - seen[1]
+
+
+status_ages = StatusAges()
+
+
+def _collector_command(drives: Iterable[str], services: Iterable[str], time_reference: str = None) -> str:
+    for drive in drives:
+        if not single_letter_ptn.match(drive):
+            raise ValueError(f'Drive letter must be a single letter. {drive}')
+    for argument in list(services) + ([time_reference] if time_reference else []):
+        if not safe_argument_ptn.match(argument):
+            raise ValueError(f'Unsafe collector argument: {argument}')
+
+    command = (f'powershell -NoProfile -NonInteractive -ExecutionPolicy Bypass '
+               f'-File "{cmd_path(f"{COLLECTOR_DIR}/{SCRIPT_NAME}")}" -Drives {",".join(drives)}')
+    if services:
+        command += f' -Services "{",".join(services)}"'
+    if time_reference:
+        command += f' -TimeReference {time_reference}'
+    return command
+
+
+def deploy_collector(ssc, drives: Iterable[str] = ('C',), services: Iterable[str] = (), time_reference: str = None,
+                     every_minutes: int = 1):
+    """Copy the collector to the host and schedule it, then run it once so there is a status file right away.
+
+    :param ssc: SystemConnection, connected to the host.
+    :param drives: iterable, the drive letters to report.
+    :param services: iterable, the service names to report.
+    :param time_reference: str, a host for the collector to measure the clock offset against, or None.
+    :param every_minutes: int, how often the scheduled task runs.
+    """
+
+    drives, services = list(drives), list(services)
+    command = _collector_command(drives, services, time_reference)
+
+    with ssc.ssh.open_sftp() as sftp:
+        try:
+            sftp.mkdir(sftp_path(COLLECTOR_DIR))
+        except IOError:
+            pass  # already there
+        sftp.put(LOCAL_SCRIPT_PATH, sftp_path(f'{COLLECTOR_DIR}/{SCRIPT_NAME}'))
+        # the task runs a wrapper so the schtasks command line stays under its length limit
+        sftp.putfo(io.BytesIO(f'@echo off\r\n{command}\r\n'.encode('ascii')),
+                   sftp_path(f'{COLLECTOR_DIR}/{WRAPPER_NAME}'))
+
+    wrapper = cmd_path(f'{COLLECTOR_DIR}/{WRAPPER_NAME}')
+    for task_command in (f'schtasks /Create /F /TN {TASK_NAME} /SC MINUTE /MO {int(every_minutes)} /RU SYSTEM '
+                         f'/TR {wrapper}',
+                         f'schtasks /Run /TN {TASK_NAME}'):
+        ssh_stdin, ssh_stdout, ssh_stderr = ssc.ssh.exec_command(task_command, timeout=15)
+        if ssh_stdout.channel.recv_exit_status() != 0:
+            raise paramiko.SSHException(f'Could not set up the collector task on {ssc.host}: '
+                                        f'{ssh_stderr.read().decode("utf8", errors="replace").strip()}')
+    lg.info('Deployed the collector to %s, it runs every %s minute(s).', ssc.host, every_minutes)
+
+
+def read_collector_status(ssc, ages: StatusAges = None) -> Union[CollectorStatus, None]:
+    """Get the status from the host's collector.
+
+    :param ssc: SystemConnection, connected to the host.
+    :param ages: StatusAges, the written times seen so far, the module's status_ages by default.
+    :return: CollectorStatus, or None if there is no status file yet or it is stale.
+    """
+
+    with ssc.ssh.open_sftp() as sftp:
+        try:
+            status = read_status(sftp)
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError) as parse_err:
+            lg.warning('Could not parse the collector status on %s: %s', ssc.host, parse_err)
+            return None
+    status.age_secs = (ages or status_ages).age_secs(ssc.host, status.written)
+    if status.age_secs > STALE_AFTER_SECS:
+        lg.warning('The collector status on %s has not changed for %.0f seconds, the task may have stopped.', ssc.host,
+                   status.age_secs)
+        return None
+    return status
@@ -0,0 +1,48 @@
+# Systems status monitor collector, deployed by the monitor and run on the host as a scheduled task.
+# Writes the host status to one small file so the monitor only has to fetch that file instead of running commands.
+# Written for PowerShell 2 so it runs on the older HMIs.
+param(
+    [string[]]$Drives = @('C'),
+    [string[]]$Services = @(),
+    [string]$TimeReference = '',
+    [string]$StatusPath = ''
+)
+
+# with -File the lists arrive as single comma separated strings
+$Drives = @($Drives | ForEach-Object { $_ -split ',' } | Where-Object { $_ })
+$Services = @($Services | ForEach-Object { $_ -split ',' } | Where-Object { $_ })
+
+if (-not $StatusPath) {
+    $StatusPath = Join-Path (Split-Path -Parent $MyInvocation.MyCommand.Definition) 'ssm_status.txt'
+}
+
+$os = Get-WmiObject Win32_OperatingSystem
+$lines = @('version=1')
+$lines += 'written=' + (Get-Date).ToString('yyyy-MM-ddTHH:mm:ss.fff')
+$lines += 'boot=' + $os.ConvertToDateTime($os.LastBootUpTime).ToString('yyyy-MM-ddTHH:mm:ss')
+
+foreach ($drive in $Drives) {
+    $disk = Get-WmiObject Win32_LogicalDisk -Filter "DeviceID='$($drive):'"
+    if ($disk) {
+        $lines += "drive.$drive.free=$($disk.FreeSpace)"
+        $lines += "drive.$drive.total=$($disk.Size)"
+    }
+}
+
+foreach ($name in $Services) {
+    $service = Get-Service -Name $name -ErrorAction SilentlyContinue
+    if ($service) { $state = $service.Status } else { $state = 'Missing' }
+    $lines += "service.$name=$state"
+}
+
+if ($TimeReference) {
+    # the offset of the reference clock from this one, the last sample line looks like: 12:00:00, +00.0123456s
+    $sample = w32tm /stripchart /computer:$TimeReference /samples:1 /dataonly |
+        Select-String -Pattern '([+-]\d+[.,]\d+)s' | Select-Object -Last 1
+    if ($sample) { $lines += 'clock.offset=' + $sample.Matches[0].Groups[1].Value }
+}
+
+# write next to the status file then swap it in so the monitor never reads a half written file
+$tempPath = "$StatusPath.tmp"
+[System.IO.File]::WriteAllLines($tempPath, [string[]]$lines)
+Move-Item -Force $tempPath $StatusPath
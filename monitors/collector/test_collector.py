@@ -0,0 +1,135 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from monitors.collector.collector import _collector_command, COLLECTOR_DIR, read_collector_status, sftp_path, \
+    STALE_AFTER_SECS, STATUS_FILE_NAME, StatusAges
+from monitors.poller import check_collector
+
+
+def write_local_status(status_path, drives=('C',), services=None, clock_offset='+00.0120000', skew_secs=0):
+    """A local stand-in for ssm_collector.ps1, writes the same status file for this machine.
+
+    skew_secs sets the host clock ahead of this machine's, the written time and the file mtime follow it.
+    """
+
+    total, _, free = shutil.disk_usage(tempfile.gettempdir())
+    now = datetime.datetime.now() + datetime.timedelta(seconds=skew_secs)
+    lines = ['version=1',
+             f'written={now.isoformat(timespec="milliseconds")}',
+             f'boot={(now - datetime.timedelta(hours=5)).isoformat(timespec="seconds")}']
+    for drive in drives:
+        lines += [f'drive.{drive}.free={free}', f'drive.{drive}.total={total}']
+    for name, state in (services or {}).items():
+        lines.append(f'service.{name}={state}')
+    if clock_offset:
+        lines.append(f'clock.offset={clock_offset}')
+    with open(status_path, 'w', encoding='utf-8-sig', newline='\r\n') as sf:
+        sf.write('\n'.join(lines) + '\n')
+    if skew_secs:
+        os.utime(status_path, (now.timestamp(), now.timestamp()))
+    return free
+
+
+class LocalSFTP:
+    """Stands in for paramiko.SFTPClient, the collector's status file path is mapped to a local file."""
+
+    def __init__(self, status_path):
+        self.paths = {sftp_path(f'{COLLECTOR_DIR}/{STATUS_FILE_NAME}'): status_path}
+
+    def open(self, path, mode='rb'):
+        if not os.path.exists(self.paths[path]):
+            raise FileNotFoundError(path)
+        return open(self.paths[path], mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class LocalConnection:
+    """Stands in for SystemConnection."""
+
+    host = 'local'
+
+    def __init__(self, status_path):
+        class SSH:
+            @staticmethod
+            def open_sftp():
+                return LocalSFTP(status_path)
+
+        self.ssh = SSH()
+
+
+class System:
+    nickname = 'local'
+
+
+class TestCollector(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.status_path = os.path.join(self.tmp_dir.name, STATUS_FILE_NAME)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_read_status(self):
+        free = write_local_status(self.status_path, drives=('C', 'D'), services={'W32Time': 'Stopped'})
+        status = read_collector_status(LocalConnection(self.status_path))
+        self.assertEqual(status.free_space('c'), free)
+        self.assertEqual(set(status.drives), {'C', 'D'})
+        self.assertEqual(status.stopped_services(), ['W32Time'])
+        self.assertAlmostEqual(status.clock_drift_secs, -0.012)
+        self.assertLess(status.age_secs, 60)
+
+    def test_stale_status(self):
+        write_local_status(self.status_path)
+        ages = StatusAges()
+        with mock.patch('monitors.collector.collector.time.monotonic', return_value=1_000.0):
+            self.assertIsNotNone(read_collector_status(LocalConnection(self.status_path), ages))
+        # the task stopped, the same status is read again later
+        with mock.patch('monitors.collector.collector.time.monotonic', return_value=1_001.0 + STALE_AFTER_SECS):
+            self.assertIsNone(read_collector_status(LocalConnection(self.status_path), ages))
+        write_local_status(self.status_path, skew_secs=60)  # the task runs again a minute later
+        with mock.patch('monitors.collector.collector.time.monotonic', return_value=1_002.0 + STALE_AFTER_SECS):
+            self.assertEqual(read_collector_status(LocalConnection(self.status_path), ages).age_secs, 0)
+
+    def test_skewed_host_clock(self):
+        # the host clock is an hour behind, then a day ahead, the status is current both times
+        ages = StatusAges()
+        for skew_secs in (-3600, 86_400):
+            write_local_status(self.status_path, clock_offset=f'{-skew_secs:+.7f}', skew_secs=skew_secs)
+            status = read_collector_status(LocalConnection(self.status_path), ages)
+            self.assertIsNotNone(status)
+            self.assertLess(status.age_secs, 60)
+
+    def test_check_collector_metrics(self):
+        free = write_local_status(self.status_path)
+        drive_check = dict(drive_letter='C', alert_low_bytes=[1_000_000], collector=True)
+        metrics = check_collector(System(), LocalConnection(self.status_path), drive_check)
+        self.assertEqual(metrics['free_space_bytes'], free)
+        self.assertAlmostEqual(metrics['clock_drift_secs'], -0.012)
+        self.assertAlmostEqual(metrics['uptime_secs'], 5 * 3600, delta=60)
+
+    def test_unsafe_settings_do_not_raise(self):
+        drive_check = dict(drive_letter='C', alert_low_bytes=[1_000_000], collector=True,
+                           services=['bad" & del *'])
+        with self.assertLogs(level='ERROR'):
+            self.assertIsNone(check_collector(System(), LocalConnection(self.status_path), drive_check))
+
+    def test_command_arguments_checked(self):
+        self.assertIn('-Services "W32Time,Spooler"', _collector_command(['C'], ['W32Time', 'Spooler']))
+        with self.assertRaises(ValueError):
+            _collector_command(['C'], ['bad" & del *'])
+        with self.assertRaises(ValueError):
+            _collector_command(['CD'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
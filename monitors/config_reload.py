@@ -0,0 +1,160 @@
+"""Hot reload of the fleet configuration in untracked_config.system_dicts, without restarting the monitor.
+
+The ConfigWatcher checks the modification time and size of the configuration module, reloads it when it changes, and
+diffs the new definitions against the old ones. Only the systems, check servers, and drive thresholds in the diff are
+applied to the running poller, see PollingDaemon.apply_config, so the other hosts keep their connections and their
+polling intervals.
+"""
+import copy
+import importlib
+import importlib.util
+import os
+from typing import Dict, Tuple, Union
+
+from helpers.dev_common import exception_one_line
+from log_setup import lg
+
+CONFIG_MODULE = 'untracked_config.system_dicts'
+
+
+def system_key(system_dict: dict):
+    """The key a system is known by in the configuration, its id if it has one, otherwise its hostname."""
+
+    return system_dict['id'] if system_dict.get('id') is not None else system_dict['hostname']
+
+
+def check_server_key(server_dict: dict) -> tuple:
+    """Check servers are unique on the system by their port and address suffix."""
+
+    return str(server_dict.get('port')), server_dict.get('address_suffix')
+
+
+class FleetConfig:
+    """The fleet definitions from the configuration module, keyed for diffing.
+
+    :param sysdicts: list, of system dicts.
+    :param check_server_lists_dict: dict, {system id: list of check server dicts}
+    :param drive_check_table: dict, {system id: drive check settings}
+    """
+
+    def __init__(self, sysdicts, check_server_lists_dict: dict, drive_check_table: dict):
+        # copied, so changes made to the module in place still show up in the next diff
+        self.systems = {system_key(system_dict): copy.deepcopy(system_dict) for system_dict in sysdicts}
+        self.check_servers = {system_id: {check_server_key(server_dict): copy.deepcopy(server_dict)
+                                          for server_dict in server_dicts}
+                              for system_id, server_dicts in check_server_lists_dict.items()}
+        self.drive_checks = copy.deepcopy(drive_check_table)
+
+    @classmethod
+    def from_module(cls, module):
+        return cls(module.sysdicts, module.check_server_lists_dict, module.drive_check_table)
+
+
+def _changed_keys(old: dict, new: dict):
+    """Get the (added, removed, changed) keys between two dicts."""
+
+    added = new.keys() - old.keys()
+    removed = old.keys() - new.keys()
+    changed = {key for key in old.keys() & new.keys() if old[key] != new[key]}
+    return added, removed, changed
+
+
+class ConfigDiff:
+    """What changed between two FleetConfigs.
+
+    The systems are by their key (see system_key), the check servers and drive checks by system id.
+    """
+
+    def __init__(self, old: FleetConfig, new: FleetConfig):
+        self.config = new
+        self.systems_added, self.systems_removed, self.systems_changed = _changed_keys(old.systems, new.systems)
+        self.check_servers_changed = set().union(*_changed_keys(old.check_servers, new.check_servers))
+        self.drive_checks_changed = set().union(*_changed_keys(old.drive_checks, new.drive_checks))
+
+    def __bool__(self):
+        return bool(self.systems_added or self.systems_removed or self.systems_changed or
+                    self.check_servers_changed or self.drive_checks_changed)
+
+    def __str__(self):
+        return (f'systems added {sorted(map(str, self.systems_added))}, '
+                f'removed {sorted(map(str, self.systems_removed))}, '
+                f'changed {sorted(map(str, self.systems_changed))}; '
+                f'check servers changed for {sorted(self.check_servers_changed)}; '
+                f'drive checks changed for {sorted(self.drive_checks_changed)}')
+
+
+class ConfigWatcher:
+    """Reloads the configuration module when its file changes.
+
+    :param module_name: str, the configuration module.
+    """
+
+    def __init__(self, module_name: str = CONFIG_MODULE):
+        self.module = importlib.import_module(module_name)
+        self.stamp = self._stamp()
+        self.config = FleetConfig.from_module(self.module)
+
+    def _stamp(self) -> Union[Tuple[int, int], None]:
+        """The modification time and size of the file, or None if it can't be read."""
+
+        try:
+            file_stat = os.stat(self.module.__file__)
+        except OSError:
+            return None
+        return file_stat.st_mtime_ns, file_stat.st_size
+
+    def _drop_bytecode(self):
+        """Remove the cached bytecode, it only records the mtime to the second so an edit within the same second and
+        of the same size would reload the old configuration from it."""
+
+        importlib.invalidate_caches()
+        try:
+            os.remove(importlib.util.cache_from_source(self.module.__file__))
+        except (OSError, NotImplementedError):
+            pass  # not cached, or no cache for this interpreter
+
+    def check(self) -> Union[ConfigDiff, None]:
+        """Reload the configuration if the file changed.
+
+        A configuration that can't be loaded is logged and skipped, the last good one stays in use.
+
+        :return: ConfigDiff, or None if nothing changed.
+        """
+
+        stamp = self._stamp()
+        if stamp is None or stamp == self.stamp:
+            return None
+        self.stamp = stamp
+        try:
+            self._drop_bytecode()
+            self.module = importlib.reload(self.module)
+            new_config = FleetConfig.from_module(self.module)
+        except Exception as reload_err:
+            lg.error('Could not reload the fleet configuration, keeping the last one: %s',
+                     exception_one_line(reload_err))
+            return None
+
+        diff = ConfigDiff(self.config, new_config)
+        self.config = new_config
+        if diff:
+            lg.info('Fleet configuration reloaded: %s', diff)
+        return diff or None
+
+
+def find_system(systems, key) -> Union[object, None]:
+    """Find a running system by its configuration key."""
+
+    for stm in systems:
+        if stm.id == key or stm.hostname == key:
+            return stm
+    return None
+
+
+def apply_drive_checks(drive_check_table: Dict[int, dict], config: FleetConfig, system_ids):
+    """Update the running drive_check_table in place for the systems, removing the ones no longer configured."""
+
+    for system_id in system_ids:
+        if system_id in config.drive_checks:
+            drive_check_table[system_id] = copy.deepcopy(config.drive_checks[system_id])
+        else:
+            drive_check_table.pop(system_id, None)
@@ -0,0 +1,262 @@
+"""Runs the poller in a background thread for as long as the monitor is up, keeping its memory use bounded.
+
+The fleet is loaded once and detached from the database session. Each cycle gets a fresh session, removed when the
+cycle ends so the identity map can't grow. The SSH connections are kept in a bounded pool and closed when idle. The
+availability timeline is pruned after it is saved.
+
+Changes to the fleet configuration are picked up while it runs, see monitors.config_reload. If the fleet was loaded
+from the snapshot, the daemon switches to the database once it is back, see use_database.
+"""
+import copy
+import threading
+
+from helpers.dev_common import exception_one_line
+from helpers.memory_debug import MemoryTracker
+from log_setup import lg
+from models.availability_interval import AvailabilityInterval
+from models.check_server_table import CheckServer
+from models.fleet_snapshot import DEFAULT_SNAPSHOT_PATH, export_snapshot, load_fleet, load_systems_from_database, \
+    SnapshotReconciler
+from models.sqla_instance import Session
+from models.systems_settings import SystemModel
+from monitors.config_reload import apply_drive_checks, ConfigDiff, ConfigWatcher, find_system
+from monitors.ftp.connection_pool import ConnectionPool
+from monitors.history.ingest import MetricIngest
+from monitors.poller import poll_adaptively
+from monitors.scheduling.adaptive import AdaptiveScheduler
+
+
+class PollingDaemon(threading.Thread):
+    """Polls the fleet on the adaptive intervals until stopped.
+
+    :param drive_check_table: dict, {system id: drive check settings}
+    :param uplink_devices: dict, the network devices the hosts depend on, see DependencyGraph.for_fleet.
+    :param system_uplinks: dict, {system id: uplink device name}
+    :param memory_tracker: MemoryTracker, to snapshot the memory after each cycle, or None.
+    :param max_connections: int, the most SSH connections to keep open.
+    :param idle_secs: float, SSH connections unused for this long are closed.
+    :param sessions_per_minute: int, the SSH session budget for the AdaptiveScheduler.
+    :param watch_config: bool, whether to apply changes to the fleet configuration while running.
+    :param config_check_secs: float, how often to check the configuration for changes.
+    :param database_up: bool, whether the database was available when the monitor started, or None to check.
+    :param snapshot_path: str, the fleet snapshot file.
+    """
+
+    def __init__(self, drive_check_table: dict, uplink_devices: dict = None, system_uplinks: dict = None,
+                 memory_tracker: MemoryTracker = None, max_connections: int = 32, idle_secs: float = 300.0,
+                 sessions_per_minute: int = 30, watch_config: bool = True, config_check_secs: float = 10.0,
+                 database_up: bool = None, snapshot_path: str = DEFAULT_SNAPSHOT_PATH):
+        super().__init__(name='PollingDaemon', daemon=True)
+        self.drive_check_table = drive_check_table
+        self.database_up = database_up
+        self.snapshot_path = snapshot_path
+        self.uplink_devices = uplink_devices
+        self.system_uplinks = system_uplinks
+        self.memory_tracker = memory_tracker
+        self.sessions_per_minute = sessions_per_minute
+        self.config_watcher = ConfigWatcher() if watch_config else None
+        self.config_check_secs = config_check_secs if watch_config else None
+        self.stop_event = threading.Event()
+        self.restart_event = threading.Event()  # stops the polling loop so it restarts with the database
+        self.reconciler = None
+        self.reconciled_systems = None
+        self.snapshot_config = None  # the configuration when the fleet was loaded from the snapshot
+        self.pool = ConnectionPool(max_connections, idle_secs)
+        self.systems = []
+        self.drive_checks = {}
+        self.scheduler = None
+        self.ingest = None
+        self.timeline = None
+        self.from_database = False
+
+    def load(self):
+        """Load the fleet, and the metric history and availability state if it came from the database."""
+
+        try:
+            self.systems, self.drive_checks, self.from_database = load_fleet(self.drive_check_table, self.snapshot_path,
+                                                                             self.database_up)
+            if self.from_database:
+                self.ingest = MetricIngest()
+                self.timeline = AvailabilityInterval.resume_timeline()
+            else:
+                if self.config_watcher is not None:
+                    self.snapshot_config = self.config_watcher.config
+                self.reconciler = SnapshotReconciler(self.drive_check_table, on_reconciled=self.database_back,
+                                                     file_path=self.snapshot_path)
+                self.reconciler.start()
+        finally:
+            Session.remove()  # the systems are kept detached, with their check servers already loaded
+        self.scheduler = AdaptiveScheduler(self.drive_checks, self.sessions_per_minute)
+
+    def run(self):
+        self.load()
+        if self.memory_tracker is not None:
+            self.memory_tracker.start()
+        lg.info('Polling daemon started for %s systems.', len(self.systems))
+        try:
+            while not self.stop_event.is_set():
+                self.restart_event.clear()
+                poll_adaptively(self.systems, self.drive_checks, self.scheduler, ingest=self.ingest,
+                                stop_event=self.restart_event, uplink_devices=self.uplink_devices,
+                                system_uplinks=self.system_uplinks, timeline=self.timeline, on_cycle=self.end_cycle,
+                                pool=self.pool, on_wake=self.reload_config, max_sleep_secs=self.config_check_secs)
+                if self.reconciled_systems is not None:
+                    self.use_database(self.reconciled_systems)
+        finally:
+            if self.reconciler is not None:
+                self.reconciler.stop()
+            try:
+                if self.ingest is not None:
+                    self.ingest.flush()
+                if self.timeline is not None:
+                    AvailabilityInterval.save_timeline(self.timeline)
+            finally:
+                Session.remove()
+                self.pool.close_all()
+            lg.info('Polling daemon stopped.')
+
+    def database_back(self, systems):
+        """Called by the SnapshotReconciler thread, the switch to the database is made on the polling thread."""
+
+        self.reconciled_systems = systems
+        self.restart_event.set()
+
+    def use_database(self, systems):
+        """Switch from the snapshot to the database, polling the systems from it and keeping the history again.
+
+        The configuration changes made while running from the snapshot are applied to the database then, they could
+        only be applied to the drive thresholds before.
+
+        :param systems: list of SystemModel, from the database.
+        """
+
+        self.reconciled_systems = None
+        try:
+            for stm in self.systems:
+                if find_system(systems, stm.id) is None:
+                    self.forget_system(stm.id)
+            self.systems = systems
+            # the current thresholds, including any reloaded while running from the snapshot
+            current = self.config_watcher.config.drive_checks if self.config_watcher else self.drive_check_table
+            drive_checks = copy.deepcopy(current)
+            self.drive_checks.clear()  # the scheduler has the running table, it is updated in place
+            self.drive_checks.update(drive_checks)
+            for stm in self.systems:
+                self.scheduler.refresh_bounds(stm.id)
+            self.ingest = MetricIngest()
+            self.timeline = AvailabilityInterval.resume_timeline()
+            self.from_database = True
+            lg.info('The database is back, polling %s systems from it.', len(self.systems))
+
+            pending = ConfigDiff(self.snapshot_config, self.config_watcher.config) if self.snapshot_config else None
+            self.snapshot_config = None
+            if pending:
+                lg.info('Applying the configuration changes made while the database was down: %s', pending)
+                self.apply_config(pending)
+            else:
+                export_snapshot(self.systems, self.drive_checks, self.snapshot_path)
+        except OSError as os_err:
+            lg.warning('Could not write the fleet snapshot: %s', os_err)
+        finally:
+            Session.remove()
+
+    def end_cycle(self):
+        """Save what the cycle changed and release what it no longer needs."""
+
+        try:
+            if self.timeline is not None:
+                AvailabilityInterval.save_timeline(self.timeline)
+        finally:
+            Session.remove()
+        self.pool.close_idle()
+        if self.memory_tracker is not None:
+            self.memory_tracker.cycle()
+
+    def reload_config(self):
+        """Apply the changes to the fleet configuration, if there are any."""
+
+        if self.config_watcher is None:
+            return
+        try:
+            diff = self.config_watcher.check()
+            if diff:
+                self.apply_config(diff)
+        except Exception as apply_err:  # keep polling with what was applied
+            lg.error('Could not apply the fleet configuration changes: %s', exception_one_line(apply_err))
+        finally:
+            Session.remove()
+
+    def forget_system(self, system_id: int):
+        """Drop everything held for a system that is no longer polled."""
+
+        self.scheduler.forget(system_id)
+        self.pool.evict(system_id)
+        if self.ingest is not None:
+            self.ingest.forget(system_id)
+
+    def apply_config(self, diff: ConfigDiff):
+        """Apply a configuration diff to the running fleet, the systems not in it are left as they are.
+
+        Removed systems are retired and stop being polled. Added and changed systems and check servers are saved to the
+        database and reloaded from it, the SSH connection to a changed system is closed so the next one uses its new
+        settings. Changed drive thresholds and interval bounds take effect on the next poll of the system.
+
+        :param diff: ConfigDiff
+        """
+
+        config = diff.config
+        for key in diff.systems_removed:
+            stm = find_system(self.systems, key)
+            if stm is None:
+                continue
+            self.systems.remove(stm)
+            self.forget_system(stm.id)
+            if self.from_database:
+                SystemModel.retire(stm.id)
+            lg.info('System %s was removed from the configuration, it is no longer polled.', stm.nickname)
+
+        if self.from_database:
+            changed_ids, reload_ids = set(), set()
+            for key in diff.systems_added | diff.systems_changed:
+                system_id = SystemModel.apply_config(config.systems[key])
+                if system_id is not None:
+                    reload_ids.add(system_id)
+                    if key in diff.systems_changed:
+                        changed_ids.add(system_id)
+            for system_id in diff.check_servers_changed:
+                CheckServer.apply_config(system_id, config.check_servers.get(system_id, {}).values())
+                reload_ids.add(system_id)
+
+            for stm in load_systems_from_database(reload_ids):
+                if stm.id not in self.drive_checks and stm.id not in config.drive_checks:
+                    # the drive_check_table is by id, a system added without one can't have an entry yet
+                    lg.warning('System %s (id %s) has no drive_check_table entry, only its web servers are checked. '
+                               'Give it an id in the configuration and add its drive checks under it.',
+                               stm.nickname, stm.id)
+                running = find_system(self.systems, stm.id)
+                if running is None:
+                    self.systems.append(stm)
+                else:
+                    self.systems[self.systems.index(running)] = stm
+                if stm.id in changed_ids:
+                    self.pool.evict(stm.id)
+        elif diff.systems_added or diff.systems_changed or diff.check_servers_changed:
+            lg.warning('The fleet was loaded from the snapshot, the system and check server changes will be applied '
+                       'once the database is available.')
+
+        apply_drive_checks(self.drive_checks, config, diff.drive_checks_changed)
+        for system_id in diff.drive_checks_changed:
+            self.scheduler.refresh_bounds(system_id)
+
+        if self.from_database:
+            try:
+                export_snapshot(self.systems, self.drive_checks, self.snapshot_path)
+            except OSError as os_err:
+                lg.warning('Could not write the fleet snapshot: %s', os_err)
+
+    def stop(self, timeout: float = None):
+        """Stop polling after the current cycle and wait for the thread to finish."""
+
+        self.stop_event.set()
+        self.restart_event.set()
+        self.join(timeout)
@@ -0,0 +1,245 @@
+"""Bulk SFTP retrieval of files from many hosts at once, used to pull logs and recipe files off of the HMIs.
+
+Each host gets a few SFTP channels on its existing SSH transport and the files are spread over them, all of the hosts
+are transferred at the same time. Files are downloaded to a partial file next to the destination and only moved into
+place once they are complete (and verified if asked to), so a dropped link can be resumed from where it left off.
+"""
+import glob
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Tuple, Union
+
+import paramiko
+
+from helpers.helpers import format_storage_bytes
+from log_setup import lg
+
+# SFTP channel tuning for the slow plant network, a bigger window keeps more data in flight on high latency links
+SFTP_WINDOW_SIZE = 8 * 1024 * 1024
+SFTP_MAX_PACKET_SIZE = 32 * 1024
+PREFETCH_MAX_REQUESTS = 64
+READ_CHUNK_SIZE = 256 * 1024
+
+# the result of transferring a file
+TRANSFERRED, SKIPPED, FAILED = 'transferred', 'skipped', 'failed'
+
+windows_drive_path_ptn = re.compile(r'^/?(?P<drive>[a-zA-Z]):(?P<rest>.*)$')
+hex_digest_ptn = re.compile(r'^[0-9a-fA-F ]+$')
+unsafe_path_chars_ptn = re.compile(r'["&|<>^%!\r\n]')
+
+
+class HostTransferReport:
+    """Totals for the files transferred from a host."""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.transferred = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes_transferred = 0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def add(self, result: str, bytes_transferred: int, started: float, finished: float):
+        with self._lock:
+            setattr(self, result, getattr(self, result) + 1)
+            self.bytes_transferred += bytes_transferred
+            self.started = started if self.started is None else min(self.started, started)
+            self.finished = finished if self.finished is None else max(self.finished, finished)
+
+    @property
+    def seconds(self) -> float:
+        if self.started is None:
+            return 0.0
+        return self.finished - self.started
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes_transferred / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f'{self.host}: {self.transferred} transferred, {self.skipped} skipped, {self.failed} failed, '
+                f'{format_storage_bytes(self.bytes_transferred, binary_system=False)} in {self.seconds:.2f} s '
+                f'({format_storage_bytes(int(self.bytes_per_second), binary_system=False)}/s)')
+
+
+def part_path_for(local_path: str, remote_mtime) -> str:
+    """Get the partial file path, the remote mtime is part of the name so a changed remote file is not resumed."""
+
+    return f'{local_path}.{int(remote_mtime)}.part'
+
+
+def is_unchanged(local_path: str, remote_stat) -> bool:
+    """Whether the local file has the same size and mtime as the remote file."""
+
+    try:
+        local_stat = os.stat(local_path)
+    except FileNotFoundError:
+        return False
+    return local_stat.st_size == remote_stat.st_size and int(local_stat.st_mtime) == int(remote_stat.st_mtime)
+
+
+def local_checksum(file_path: str, hash_algorithm: str) -> str:
+    hasher = hashlib.new(hash_algorithm)
+    with open(file_path, 'rb') as lf:
+        for chunk in iter(lambda: lf.read(READ_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def remote_checksum(ssh: paramiko.SSHClient, sftp, remote_path: str, hash_algorithm: str) -> Union[str, None]:
+    """Get the hex digest of the remote file.
+
+    Tries the SFTP check-file extension first, then falls back to running certutil on the (Windows) host.
+
+    :return: str, the hex digest, or None if the host can't provide one.
+    """
+
+    try:
+        with sftp.open(remote_path, 'rb') as rf:
+            return rf.check(hash_algorithm).hex()
+    except (IOError, paramiko.SSHException):
+        pass  # the extension is not supported by most servers
+
+    if ssh is None:
+        return None
+    drive_match = windows_drive_path_ptn.match(remote_path)
+    windows_path = (f'{drive_match["drive"]}:{drive_match["rest"]}' if drive_match else remote_path).replace('/', '\\')
+    if unsafe_path_chars_ptn.search(windows_path):
+        # the path goes in a cmd command line, these could end the quoted path and run something else
+        lg.warning('Not running certutil for %s, the path has characters that are unsafe in a command.', remote_path)
+        return None
+    ssh_stdin, ssh_stdout, ssh_stderr = ssh.exec_command(
+        f'certutil -hashfile "{windows_path}" {hash_algorithm.upper()}', timeout=30)
+    for line in ssh_stdout.read().decode('utf8', errors='replace').splitlines():
+        line = line.strip()
+        if line and hex_digest_ptn.match(line):
+            return line.replace(' ', '').lower()
+    return None
+
+
+def fetch_file(sftp, remote_path: str, local_path: str, verify: str = None, ssh: paramiko.SSHClient = None):
+    """Get a single file, skipping it if unchanged and resuming a partial download if there is one.
+
+    :param sftp: paramiko.SFTPClient
+    :param remote_path: str, the path on the host.
+    :param local_path: str, the destination path.
+    :param verify: str, a hashlib algorithm name to check the file with after the transfer, or None.
+    :param ssh: paramiko.SSHClient, used to get the remote checksum when the SFTP server can't.
+    :return: tuple, (result, bytes transferred)
+    """
+
+    remote_stat = sftp.stat(remote_path)
+    if is_unchanged(local_path, remote_stat):
+        return SKIPPED, 0
+
+    part_path = part_path_for(local_path, remote_stat.st_mtime)
+    for stale_part in glob.glob(f'{glob.escape(local_path)}.*.part'):
+        if stale_part != part_path:
+            os.remove(stale_part)  # the remote file changed since this was started
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if offset > remote_stat.st_size:
+        offset = 0
+        os.remove(part_path)
+
+    bytes_transferred = 0
+    try:
+        with sftp.open(remote_path, 'rb') as rf, open(part_path, 'ab') as lf:
+            if offset:
+                lg.debug('Resuming %s at %s of %s bytes.', remote_path, offset, remote_stat.st_size)
+            rf.seek(offset)
+            # prefetch reads from the current position up to file_size, the end of the file rather than a length
+            rf.prefetch(remote_stat.st_size, PREFETCH_MAX_REQUESTS)
+            for chunk in iter(lambda: rf.read(READ_CHUNK_SIZE), b''):
+                lf.write(chunk)
+                bytes_transferred += len(chunk)
+    except FileNotFoundError:
+        raise
+    except (IOError, paramiko.SSHException, EOFError) as transfer_err:
+        # what was written is kept in the partial file, so the bytes count
+        lg.warning('Transfer of %s stopped after %s bytes, it can be resumed: %s', remote_path, bytes_transferred,
+                   transfer_err)
+        return FAILED, bytes_transferred
+
+    if verify:
+        remote_digest = remote_checksum(ssh, sftp, remote_path, verify)
+        if remote_digest is None:
+            lg.warning('Could not get a %s checksum for %s, it is unverified.', verify, remote_path)
+        elif remote_digest != local_checksum(part_path, verify):
+            lg.warning('Checksum mismatch for %s, the partial file is removed.', remote_path)
+            os.remove(part_path)
+            return FAILED, bytes_transferred
+
+    os.replace(part_path, local_path)
+    os.utime(local_path, (remote_stat.st_atime or remote_stat.st_mtime, remote_stat.st_mtime))
+    return TRANSFERRED, bytes_transferred
+
+
+def _open_sftp(ssh: paramiko.SSHClient):
+    transport = ssh.get_transport() if ssh else None
+    if transport is None or not transport.is_active():
+        raise paramiko.SSHException('Not connected.')
+    return paramiko.SFTPClient.from_transport(transport, window_size=SFTP_WINDOW_SIZE,
+                                              max_packet_size=SFTP_MAX_PACKET_SIZE)
+
+
+def _transfer_files(client, jobs: List[Tuple[str, str]], report: HostTransferReport, verify: str = None):
+    """Transfer the jobs in order over one SFTP channel."""
+
+    try:
+        sftp = _open_sftp(client.ssh)
+    except (paramiko.SSHException, EOFError, OSError) as channel_err:
+        lg.warning('Could not open an SFTP channel to %s: %s', client.host, channel_err)
+        now = time.monotonic()
+        for _ in jobs:
+            report.add(FAILED, 0, now, now)
+        return
+
+    with sftp:
+        for remote_path, local_path in jobs:
+            started = time.monotonic()
+            try:
+                result, bytes_transferred = fetch_file(sftp, remote_path, local_path, verify, client.ssh)
+            except FileNotFoundError:
+                lg.exception('File not found on host: %s at filepath: %s', client.host, remote_path)
+                result, bytes_transferred = FAILED, 0
+            except (IOError, paramiko.SSHException, EOFError) as transfer_err:
+                # before any bytes were read, e.g. the stat or the checksum, fetch_file reports the ones after
+                lg.warning('Transfer of %s from %s stopped, it can be resumed: %s', remote_path, client.host,
+                           transfer_err)
+                result, bytes_transferred = FAILED, 0
+            report.add(result, bytes_transferred, started, time.monotonic())
+
+
+def bulk_get(host_jobs: Dict[object, Iterable[Tuple[str, str]]], channels_per_host: int = 2,
+             max_workers: int = 16, verify: str = None) -> Dict[str, HostTransferReport]:
+    """Get files from many hosts at once.
+
+    :param host_jobs: dict, {connected SSHClientBase: iterable of (remote path, local path)}
+    :param channels_per_host: int, the number of SFTP channels (and files in flight) for each host.
+    :param max_workers: int, the total number of channels across all hosts.
+    :param verify: str, a hashlib algorithm name to verify each file with, or None.
+    :return: dict, {host: HostTransferReport}
+    """
+
+    reports = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for client, jobs in host_jobs.items():
+            jobs = list(jobs)
+            reports[client.host] = report = HostTransferReport(client.host)
+            # deal the files out over the channels so big and small files are mixed
+            for channel_number in range(min(channels_per_host, len(jobs))):
+                futures.append(executor.submit(_transfer_files, client, jobs[channel_number::channels_per_host],
+                                               report, verify))
+        for future in futures:
+            future.result()
+
+    for report in reports.values():
+        lg.info('Bulk transfer %s', report)
+    return reports
@@ -0,0 +1,90 @@
+"""Keeps the SSH connections to the systems open between cycles, with a limit on how many and for how long."""
+import contextlib
+import threading
+import time
+from collections import OrderedDict
+
+from log_setup import lg
+from monitors.ftp.drive_free_space import SystemConnection
+
+
+class ConnectionPool:
+    """The open SystemConnections by system id, the least recently used are closed first.
+
+    :param max_connections: int, the most connections to keep open, the least recently used is closed past this.
+    :param idle_secs: float, connections not used for this long are closed by close_idle.
+    :param connection_class: the class to connect with, SystemConnection.
+    """
+
+    def __init__(self, max_connections: int = 32, idle_secs: float = 300.0, connection_class=SystemConnection):
+        self.max_connections = max_connections
+        self.idle_secs = idle_secs
+        self.connection_class = connection_class
+        self.connections = OrderedDict()  # system id: (connection, time.monotonic() last used)
+        self.lock = threading.Lock()
+
+    def _checkout(self, stm, retry: int):
+        with self.lock:
+            ssc, _ = self.connections.pop(stm.id, (None, None))
+        if ssc is not None:
+            if ssc.connected:
+                return ssc
+            ssc.close()
+        return self.connection_class(stm, retry=retry)
+
+    def _checkin(self, stm, ssc):
+        if not ssc.connected:
+            ssc.close()
+            return
+        with self.lock:
+            self.connections[stm.id] = (ssc, time.monotonic())
+            while len(self.connections) > self.max_connections:
+                _, (oldest, _) = self.connections.popitem(last=False)
+                oldest.close()
+
+    @contextlib.contextmanager
+    def connection(self, stm, retry: int = 0):
+        """Use an open connection to the system, connecting if there isn't one.
+
+        The connection is returned to the pool afterward, unless an exception got out, then it is closed since it
+        may be in a bad state.
+
+        :param stm: SystemModel
+        :param retry: int, the number of times to retry connecting.
+        """
+
+        ssc = self._checkout(stm, retry)
+        try:
+            yield ssc
+        except BaseException:
+            ssc.close()
+            raise
+        self._checkin(stm, ssc)
+
+    def evict(self, system_id: int):
+        """Close the connection to a system, e.g. because its settings changed."""
+
+        with self.lock:
+            ssc, _ = self.connections.pop(system_id, (None, None))
+        if ssc is not None:
+            ssc.close()
+
+    def close_idle(self):
+        """Close the connections that haven't been used for idle_secs."""
+
+        cutoff = time.monotonic() - self.idle_secs
+        with self.lock:
+            idle = [system_id for system_id, (_, last_used) in self.connections.items() if last_used < cutoff]
+        for system_id in idle:
+            self.evict(system_id)
+        if idle:
+            lg.debug('Closed %s idle SSH connections, %s still open.', len(idle), len(self.connections))
+
+    def close_all(self):
+        with self.lock:
+            connections, self.connections = list(self.connections.values()), OrderedDict()
+        for ssc, _ in connections:
+            ssc.close()
+
+    def __len__(self):
+        return len(self.connections)
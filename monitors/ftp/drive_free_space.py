@@ -7,6 +7,9 @@ import paramiko
 
 from log_setup import lg
 from models.systems_settings import SystemModel
+from monitors.ftp.bulk_transfer import bulk_get
+from monitors.ftp.remote_tail import OffsetStore, RemoteTail
+from monitors.ftp.ssh_profile import default_store, HostSettingsStore
 
 # pattern to grab only a continuous series of numerical characters from between non-numerical characters
 byte_int_regex_ptn = re.compile('(?:\D*)(\d*)(?:\D*)')
@@ -28,11 +31,13 @@ local_date_time_ptn = re.compile(  # to extract date-time info from wmic LocalDa
 class SSHClientBase:
     """Base SSH class for basic SSH operations like connecting and transferring files."""
 
-    def __init__(self, settings_dict: dict, retry=0):
-        self._settings_dict = settings_dict
+    def __init__(self, settings_dict: dict, retry=0, host_settings: HostSettingsStore = None):
+        # the host's known keys, preferred algorithms, and agent/key lookup settings, see ssh_profile
+        host_settings = default_store() if host_settings is None else host_settings
+        self._settings_dict = host_settings.connect_kwargs(settings_dict['hostname']) | settings_dict
+        self.ssh = paramiko.SSHClient()
+        host_settings.prepare_client(self.ssh, settings_dict['hostname'], settings_dict.get('port', 22))
         try:
-            self.ssh = paramiko.SSHClient()
-            self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
             self.connect(retry=retry)
         except TimeoutError:
             lg.info("Could not connect to remote file host.")
@@ -48,13 +53,25 @@ class SSHClientBase:
             except TimeoutError as to_er:
                 timeout_er = to_er
                 lg.warning('Could not connect to remote host.')
+                self.ssh.close()  # a failed connect can leave the socket and the transport thread behind
+            except Exception:
+                self.ssh.close()
+                raise
             finally:
                 retry -= 1
         if timeout_er:
             raise timeout_er
 
+    @property
+    def connected(self) -> bool:
+        """Whether the SSH transport is open."""
+
+        transport = self.ssh.get_transport() if self.ssh else None
+        return transport is not None and transport.is_active()
+
     def close(self):
-        self.ssh.close()
+        if self.ssh:
+            self.ssh.close()
 
     def get_files(self, file_paths, destination):
         if isinstance(destination, str):
@@ -68,6 +85,36 @@ class SSHClientBase:
                 except FileNotFoundError:
                     lg.exception('File not found on host: %s at filepath: %s', self._settings_dict['hostname'], fp)
 
+    def get_files_bulk(self, file_paths, destination, channels_per_host=2, verify=None):
+        """Get the files over several SFTP channels, resuming partial downloads and skipping unchanged files.
+
+        :param file_paths: list, the remote file paths.
+        :param destination: str, a directory for the files, or a list of destination file paths.
+        :param channels_per_host: int, the number of files to transfer at the same time.
+        :param verify: str, a hashlib algorithm name to verify the files with, or None.
+        :return: HostTransferReport
+        """
+
+        if isinstance(destination, str):
+            destination_paths = [f'{destination}/{os.path.basename(fp)}' for fp in file_paths]
+        else:
+            destination_paths = destination
+        reports = bulk_get({self: zip(file_paths, destination_paths)}, channels_per_host=channels_per_host,
+                           verify=verify)
+        return reports[self.host]
+
+    def tail_file(self, remote_path, offset_store: OffsetStore, parse=None, encoding='utf8'):
+        """Generate the lines appended to the remote file since it was last read.
+
+        :param remote_path: str, the path on the host.
+        :param offset_store: OffsetStore, the saved read positions.
+        :param parse: callable, called with each line, its return value is yielded (None skips the line).
+        :param encoding: str, the encoding of the file.
+        """
+
+        with self.ssh.open_sftp() as sftp:
+            yield from RemoteTail(sftp, self.host, offset_store).lines(remote_path, parse, encoding)
+
     @property
     def host(self):
         return self._settings_dict['hostname']
@@ -85,12 +132,12 @@ class SSHClientBase:
 class SystemConnection(SSHClientBase):
     """Extended SSH class for additional functionalities like checking system time, changing system time, etc."""
 
-    def __init__(self, system: SystemModel, retry=0):
+    def __init__(self, system: SystemModel, retry=0, host_settings: HostSettingsStore = None):
         hostname = system.hostname if not system.static_ip else system.static_ip
         username = system.username
         password = system.password
         settings_dict = dict(hostname=hostname, username=username, password=password)
-        super().__init__(settings_dict, retry)
+        super().__init__(settings_dict, retry, host_settings)
 
         self.ldt_ptn: re.Pattern = local_date_time_ptn
         self._shell_type = None
@@ -0,0 +1,139 @@
+"""Incremental reading of remote log files over SFTP, only the bytes appended since the last read are fetched.
+
+The byte offset for each remote file is kept in a local JSON file along with a fingerprint of the file: its size,
+mtime, and a hash of the first bytes of the file. SFTP does not give an inode, so the hash of the head of the file
+stands in for it: when a log is rotated the new file starts with different bytes and is read from the beginning. A
+file that is smaller than the saved offset, or that was modified without growing, has been truncated and rewritten and
+is also read from the beginning.
+"""
+import hashlib
+import json
+import os
+from typing import Callable, Iterator
+
+from log_setup import lg
+
+FINGERPRINT_BYTES = 256  # how much of the start of the file is hashed to recognize it
+READ_CHUNK_SIZE = 256 * 1024
+DEFAULT_OFFSETS_PATH = 'last_position.json'
+
+
+class OffsetStore:
+    """The saved read positions and fingerprints for the remote files, kept in a JSON file."""
+
+    def __init__(self, file_path: str = DEFAULT_OFFSETS_PATH):
+        self.file_path = file_path
+        try:
+            with open(file_path) as of:
+                self._positions = json.load(of)
+        except FileNotFoundError:
+            self._positions = {}
+        except json.JSONDecodeError:
+            lg.warning('Could not read the offsets file %s, all files will be read from the start.', file_path)
+            self._positions = {}
+
+    @staticmethod
+    def key(host: str, remote_path: str) -> str:
+        return f'{host}:{remote_path}'
+
+    def get(self, host: str, remote_path: str) -> dict:
+        return self._positions.get(self.key(host, remote_path))
+
+    def set(self, host: str, remote_path: str, position: dict):
+        self._positions[self.key(host, remote_path)] = position
+
+    def save(self):
+        """Write the positions to a temporary file and swap it in so a crash can't leave a half written file."""
+
+        temp_path = f'{self.file_path}.tmp'
+        with open(temp_path, 'w') as of:
+            json.dump(self._positions, of)
+        os.replace(temp_path, self.file_path)
+
+
+def head_hash(rf, length: int) -> str:
+    """Get the hash of the first length bytes of the open remote file."""
+
+    rf.seek(0)
+    return hashlib.sha1(rf.read(length)).hexdigest()
+
+
+class RemoteTail:
+    """Reads the newly appended lines of remote files.
+
+    :param sftp: paramiko.SFTPClient, open to the host.
+    :param host: str, the host name, part of the key for the saved offsets.
+    :param offset_store: OffsetStore
+    """
+
+    def __init__(self, sftp, host: str, offset_store: OffsetStore):
+        self.sftp = sftp
+        self.host = host
+        self.offset_store = offset_store
+
+    def _start_offset(self, rf, remote_path: str, remote_stat) -> int:
+        """Get where to start reading, 0 if the file is new, was truncated, or was rotated."""
+
+        position = self.offset_store.get(self.host, remote_path)
+        if position is None:
+            return 0
+        if remote_stat.st_size < position['offset'] or (
+                remote_stat.st_size <= position['size'] and int(remote_stat.st_mtime) > position['mtime']):
+            lg.info('%s on %s was truncated, reading from the start.', remote_path, self.host)
+            return 0
+        if head_hash(rf, position['head_length']) != position['head_hash']:
+            lg.info('%s on %s was rotated, reading from the start.', remote_path, self.host)
+            return 0
+        return position['offset']
+
+    def lines(self, remote_path: str, parse: Callable = None, encoding: str = 'utf8') -> Iterator:
+        """Generate the complete lines appended to the remote file since the last read.
+
+        A trailing line without a newline is left for the next read since it may still be being written. The offset
+        is advanced as each line is handed out and saved when the generator finishes or is closed.
+
+        :param remote_path: str, the path on the host.
+        :param parse: callable, called with each line (str), its return value is yielded. Lines it returns None for
+            are skipped.
+        :param encoding: str, the encoding of the log file.
+        """
+
+        remote_stat = self.sftp.stat(remote_path)
+        with self.sftp.open(remote_path, 'rb') as rf:
+            offset = self._start_offset(rf, remote_path, remote_stat)
+            head_length = min(FINGERPRINT_BYTES, remote_stat.st_size)
+            position = dict(offset=offset, size=remote_stat.st_size, mtime=int(remote_stat.st_mtime),
+                            head_length=head_length, head_hash=head_hash(rf, head_length))
+
+            try:
+                rf.seek(offset)
+                if hasattr(rf, 'prefetch'):
+                    rf.prefetch(remote_stat.st_size)  # up to this position, not this many bytes
+                remainder = b''
+                for chunk in iter(lambda: rf.read(READ_CHUNK_SIZE), b''):
+                    *complete_lines, remainder = (remainder + chunk).split(b'\n')
+                    for raw_line in complete_lines:
+                        position['offset'] += len(raw_line) + 1
+                        line = raw_line.decode(encoding, errors='replace').rstrip('\r')
+                        parsed = parse(line) if parse else line
+                        if parsed is not None:
+                            yield parsed
+            finally:
+                self.offset_store.set(self.host, remote_path, position)
+                self.offset_store.save()
+
+    def into(self, remote_path: str, sink: Callable, parse: Callable = None, encoding: str = 'utf8') -> int:
+        """Send the newly appended lines to the sink.
+
+        :param remote_path: str, the path on the host.
+        :param sink: callable, called with each parsed line.
+        :param parse: callable, see lines.
+        :param encoding: str, the encoding of the log file.
+        :return: int, the number of lines sent to the sink.
+        """
+
+        count = 0
+        for parsed in self.lines(remote_path, parse, encoding):
+            sink(parsed)
+            count += 1
+        return count
@@ -0,0 +1,408 @@
+"""SSH handshake profiling and the per-host connection settings learned from it.
+
+A profile times each phase of a connection by driving the paramiko Transport by hand, around its public start_client
+and auth_password calls: the TCP connect, the key exchange (which includes agreeing on the cipher and MAC), and the
+password authentication. The algorithms each host offers are ranked by their cost and saved as its preferred ones, so
+later connections agree on the cheapest, e.g. an elliptic curve key exchange rather than a Diffie-Hellman group
+exchange. Agent and key file lookups are off by default, since the fleet uses password authentication and each lookup
+costs an authentication attempt before the password is tried. Compression is off by default, the commands and files
+are small and on a local network.
+
+The host keys seen are kept in a known_hosts file, a host whose key changes is refused rather than silently trusted
+again. The settings and the last profile for each host are kept in a JSON file, both in untracked_config.
+"""
+import concurrent.futures
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Union
+
+import paramiko
+
+from log_setup import lg
+
+UNTRACKED_CONFIG_DIR = os.path.join(Path(__file__).parent.parent.parent.resolve(), 'untracked_config')
+DEFAULT_SETTINGS_PATH = os.path.join(UNTRACKED_CONFIG_DIR, 'ssh_host_settings.json')
+DEFAULT_KNOWN_HOSTS_PATH = os.path.join(UNTRACKED_CONFIG_DIR, 'known_hosts')
+SLOW_HANDSHAKE_SECS = 2.0
+
+DEFAULT_HOST_SETTINGS = dict(allow_agent=False, look_for_keys=False, compress=False)
+
+# the SecurityOptions attribute for each kind of algorithm, and the profile field the agreed one is in
+ALGORITHM_KINDS = (('kex', 'kex'), ('ciphers', 'cipher'), ('digests', 'mac'), ('key_types', 'host_key_type'))
+
+# the cheapest algorithms of each kind first, by a part of their name, anything SHA-1 or MD5 is left for last even
+# where it is cheaper. The host key type is not ranked, a host offering a new type would not match its known key.
+ALGORITHM_COSTS = {
+    'kex': ('curve25519', 'ecdh-sha2-nistp256', 'ecdh-sha2-nistp384', 'ecdh-sha2-nistp521',
+            'diffie-hellman-group14-sha256', 'diffie-hellman-group16-sha512', 'diffie-hellman-group-exchange-sha256',
+            'sha1'),
+    'ciphers': ('gcm', 'aes128-ctr', 'aes192-ctr', 'aes256-ctr', 'cbc'),
+    'digests': ('hmac-sha2-256-etm', 'hmac-sha2-256', 'hmac-sha2-512-etm', 'hmac-sha2-512', 'hmac-sha1', 'hmac-md5'),
+}
+
+# the lines of the transport's debug log with the algorithms the server offered, and their SecurityOptions attribute
+OFFERED_LOG_PREFIXES = {'kex algos: ': 'kex', 'client encrypt: ': 'ciphers', 'client mac: ': 'digests'}
+
+
+class HandshakeProfile:
+    """The time taken by each phase of an SSH connection to a host and the algorithms agreed on.
+
+    :param host: str
+    :param tcp_secs: float, the TCP connect.
+    :param kex_secs: float, the version exchange and the key exchange, including agreeing on the cipher and MAC.
+    :param auth_secs: float, the password authentication.
+    :param server_algorithms: dict, {SecurityOptions attribute: list of the algorithms the server offered}
+    :param error: str, what went wrong if the handshake didn't finish, the times up to it are kept.
+    """
+
+    FIELDS = ('host', 'tcp_secs', 'kex_secs', 'auth_secs', 'kex', 'cipher', 'mac', 'host_key_type',
+              'server_version', 'server_algorithms', 'profiled', 'error')
+
+    def __init__(self, host: str, tcp_secs: float = None, kex_secs: float = None, auth_secs: float = None,
+                 kex: str = None, cipher: str = None, mac: str = None, host_key_type: str = None,
+                 server_version: str = None, server_algorithms: Dict[str, List[str]] = None, profiled: float = None,
+                 error: str = None):
+        self.host = host
+        self.tcp_secs = tcp_secs
+        self.kex_secs = kex_secs
+        self.auth_secs = auth_secs
+        self.kex = kex
+        self.cipher = cipher
+        self.mac = mac
+        self.host_key_type = host_key_type
+        self.server_version = server_version
+        self.server_algorithms = server_algorithms
+        self.profiled = time.time() if profiled is None else profiled
+        self.error = error
+
+    @property
+    def total_secs(self) -> float:
+        return sum(secs for secs in (self.tcp_secs, self.kex_secs, self.auth_secs) if secs is not None)
+
+    def slowest_phase(self) -> Union[str, None]:
+        phases = {'tcp': self.tcp_secs, 'kex': self.kex_secs, 'auth': self.auth_secs}
+        phases = {phase: secs for phase, secs in phases.items() if secs is not None}
+        return max(phases, key=phases.get) if phases else None
+
+    def reason(self) -> str:
+        """A short explanation of where the handshake time went."""
+
+        if self.error:
+            return f'failed: {self.error}'
+        phase = self.slowest_phase()
+        if phase == 'tcp':
+            return 'network latency, the TCP connect is the slowest part'
+        if phase == 'kex':
+            if self.kex and 'group-exchange' in self.kex:
+                return f'key exchange, {self.kex} needs an extra round trip and a large prime from the server'
+            return f'key exchange ({self.kex}), the host is slow at the key agreement'
+        if phase == 'auth':
+            return 'authentication, the server is slow to check the password (e.g. reverse DNS or domain lookups)'
+        return 'not profiled'
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, profile_dict: dict):
+        return cls(**{field: profile_dict.get(field) for field in cls.FIELDS})
+
+
+def host_key_name(hostname: str, port: int = 22) -> str:
+    """The name the host's keys are kept under, as in a known_hosts file."""
+
+    return hostname if port == 22 else f'[{hostname}]:{port}'
+
+
+def rank_algorithms(kind: str, names: Iterable[str]) -> List[str]:
+    """Sort the algorithms of a kind from the cheapest to the most expensive, see ALGORITHM_COSTS.
+
+    :param kind: str, the SecurityOptions attribute, e.g. 'kex'.
+    :param names: iterable, the algorithm names, those that aren't ranked keep their order after the ranked ones.
+    :return: list
+    """
+
+    costs = ALGORITHM_COSTS.get(kind, ())
+
+    def cost(name):
+        return next((rank for rank, part in enumerate(costs) if part in name), len(costs))
+
+    return sorted(names, key=cost)
+
+
+# the log channel of the profiled transports, only read for the algorithms, not logged
+_profile_log = logging.getLogger('paramiko.transport.profile')
+_profile_log.setLevel(logging.DEBUG)
+_profile_log.propagate = False
+
+
+class KexLogHandler(logging.Handler):
+    """Picks the algorithms the server offered and the agreed key exchange out of a transport's debug log, paramiko
+    drops them once the exchange is done and has no public attribute for them. They stay empty if the log lines aren't
+    there.
+
+    The profiled transports share a log channel, the records are told apart by the transport's thread, which runs the
+    key exchange.
+
+    :param transport: paramiko.Transport, before the handshake is started.
+    """
+
+    def __init__(self, transport: paramiko.Transport):
+        super().__init__(logging.DEBUG)
+        self.transport = transport
+        self.kex = None
+        self.offered: Dict[str, List[str]] = {}
+
+    def emit(self, record):
+        if record.thread != self.transport.ident:
+            return
+        message = record.getMessage()
+        if message.startswith('Kex: '):
+            self.kex = message[len('Kex: '):]
+            return
+        for prefix, kind in OFFERED_LOG_PREFIXES.items():
+            if message.startswith(prefix):
+                # without the pseudo algorithms for extension negotiation, e.g. ext-info-s
+                self.offered[kind] = [name for name in message[len(prefix):].split(', ')
+                                      if not name.startswith(('ext-info-', 'kex-strict-'))]
+
+
+def apply_preferences(transport: paramiko.Transport, settings: dict):
+    """Offer the host's preferred algorithms first, the rest are still offered after them in case the host changes.
+
+    :param transport: paramiko.Transport, before the handshake is started.
+    :param settings: dict, the host settings, see HostSettingsStore.settings.
+    """
+
+    options = transport.get_security_options()
+    for kind, _ in ALGORITHM_KINDS:
+        preferred = settings.get(kind)
+        if not preferred:
+            continue
+        available = list(getattr(options, kind))
+        setattr(options, kind, [name for name in preferred if name in available] +
+                [name for name in available if name not in preferred])
+    transport.use_compression(bool(settings.get('compress')))
+
+
+def profile_handshake(hostname: str, username: str, password: str, port: int = 22, timeout: float = 10.0,
+                      settings: dict = None, host_keys: paramiko.HostKeys = None) -> HandshakeProfile:
+    """Connect to the host with a Transport driven by hand, timing each phase.
+
+    :param hostname: str
+    :param username: str
+    :param password: str
+    :param port: int
+    :param timeout: float, seconds for each phase.
+    :param settings: dict, the host settings to connect with, see HostSettingsStore.settings.
+    :param host_keys: paramiko.HostKeys, the known host keys, a host presenting a different key is not authenticated
+        to.
+    :return: HandshakeProfile, with the error set if a phase failed.
+    """
+
+    profile = HandshakeProfile(hostname)
+    transport = kex_log = None
+    phase_start = time.perf_counter()
+    try:
+        sock = socket.create_connection((hostname, port), timeout=timeout)
+        profile.tcp_secs = time.perf_counter() - phase_start
+
+        transport = paramiko.Transport(sock)
+        transport.set_log_channel(_profile_log.name)
+        kex_log = KexLogHandler(transport)
+        _profile_log.addHandler(kex_log)
+        apply_preferences(transport, settings or {})
+        phase_start = time.perf_counter()
+        transport.start_client(timeout=timeout)
+        profile.kex_secs = time.perf_counter() - phase_start
+        profile.kex = kex_log.kex
+        profile.server_algorithms = kex_log.offered or None
+        profile.cipher = transport.local_cipher
+        profile.mac = transport.local_mac
+        profile.host_key_type = transport.host_key_type
+        profile.server_version = transport.remote_version
+
+        server_key = transport.get_remote_server_key()
+        key_name = host_key_name(hostname, port)
+        known_keys = host_keys.lookup(key_name) if host_keys is not None else None
+        if known_keys and not host_keys.check(key_name, server_key):
+            raise paramiko.BadHostKeyException(hostname, server_key, next(iter(known_keys.values())))
+
+        phase_start = time.perf_counter()
+        transport.auth_password(username, password)
+        profile.auth_secs = time.perf_counter() - phase_start
+    except (OSError, paramiko.SSHException) as handshake_err:
+        profile.error = f'{type(handshake_err).__name__}: {handshake_err}'
+    finally:
+        if transport is not None:
+            transport.close()
+        if kex_log is not None:
+            _profile_log.removeHandler(kex_log)
+    return profile
+
+
+class CachingHostKeyPolicy(paramiko.MissingHostKeyPolicy):
+    """Trusts a host's key the first time it is seen and saves it to the HostSettingsStore's known_hosts."""
+
+    def __init__(self, store: 'HostSettingsStore'):
+        self.store = store
+
+    def missing_host_key(self, client, hostname, key):
+        client.get_host_keys().add(hostname, key.get_name(), key)
+        self.store.remember_host_key(hostname, key)
+        lg.info('Saved the new %s host key for %s.', key.get_name(), hostname)
+
+
+class HostSettingsStore:
+    """The per-host SSH settings, the last handshake profiles, and the known host keys, saved to files.
+
+    :param file_path: str, the JSON file with the settings and profiles.
+    :param known_hosts_path: str, the known_hosts file.
+    """
+
+    def __init__(self, file_path: str = DEFAULT_SETTINGS_PATH, known_hosts_path: str = DEFAULT_KNOWN_HOSTS_PATH):
+        self.file_path = file_path
+        self.known_hosts_path = known_hosts_path
+        self.lock = threading.Lock()
+        try:
+            with open(file_path) as sf:
+                self.hosts: Dict[str, dict] = json.load(sf)
+        except FileNotFoundError:
+            self.hosts = {}
+        except json.JSONDecodeError:
+            lg.warning('Could not read the SSH host settings %s, the defaults will be used.', file_path)
+            self.hosts = {}
+        self.host_keys = paramiko.HostKeys()
+        if os.path.exists(known_hosts_path):
+            self.host_keys.load(known_hosts_path)
+
+    def settings(self, host: str) -> dict:
+        """Get the host's settings, the defaults with what was set or learned for the host over them."""
+
+        return DEFAULT_HOST_SETTINGS | self.hosts.get(host, {}).get('settings', {})
+
+    def connect_kwargs(self, host: str) -> dict:
+        """Get the SSHClient.connect keyword arguments for the host's settings."""
+
+        settings = self.settings(host)
+
+        def transport_factory(sock, **transport_kwargs):
+            transport = paramiko.Transport(sock, **transport_kwargs)
+            apply_preferences(transport, settings)
+            return transport
+
+        return dict(allow_agent=settings['allow_agent'], look_for_keys=settings['look_for_keys'],
+                    compress=settings['compress'], transport_factory=transport_factory)
+
+    def prepare_client(self, client: paramiko.SSHClient, host: str, port: int = 22):
+        """Give the client the host's known keys and the policy to save new ones."""
+
+        key_name = host_key_name(host, port)
+        with self.lock:
+            known = self.host_keys.lookup(key_name)
+            for key_type, key in (known or {}).items():
+                client.get_host_keys().add(key_name, key_type, key)
+        client.set_missing_host_key_policy(CachingHostKeyPolicy(self))
+
+    def remember_host_key(self, host: str, key: paramiko.PKey):
+        with self.lock:
+            self.host_keys.add(host, key.get_name(), key)
+            self._save_known_hosts()
+
+    def _save_known_hosts(self):
+        temp_path = f'{self.known_hosts_path}.tmp'
+        self.host_keys.save(temp_path)
+        os.replace(temp_path, self.known_hosts_path)
+
+    def learn(self, profile: HandshakeProfile):
+        """Keep the profile and make the algorithms the host offered, the cheapest first, its preferred ones.
+
+        Storing only the agreed algorithms would repeat the same negotiation, e.g. a group exchange the host offers
+        alongside a cheaper key exchange. The host key type is kept as the agreed one, see ALGORITHM_COSTS.
+        """
+
+        with self.lock:
+            host = self.hosts.setdefault(profile.host, {})
+            host['profile'] = profile.to_dict()
+            if profile.error is None:
+                settings = host.setdefault('settings', {})
+                for kind, field in ALGORITHM_KINDS:
+                    offered = (profile.server_algorithms or {}).get(kind)
+                    if offered:
+                        settings[kind] = rank_algorithms(kind, offered)
+                    elif getattr(profile, field):
+                        settings[kind] = [getattr(profile, field)]
+
+    def profiles(self) -> List[HandshakeProfile]:
+        with self.lock:
+            return [HandshakeProfile.from_dict(host['profile']) for host in self.hosts.values() if 'profile' in host]
+
+    def slow_hosts(self, slow_secs: float = SLOW_HANDSHAKE_SECS) -> List[dict]:
+        """Get the hosts whose last handshake was slow or failed, the slowest first, with why.
+
+        :param slow_secs: float, a handshake taking at least this long is slow.
+        :return: list, of dicts of the profile with the total_secs and the reason.
+        """
+
+        slow = [profile for profile in self.profiles() if profile.error or profile.total_secs >= slow_secs]
+        slow.sort(key=lambda profile: (profile.error is None, -profile.total_secs))
+        return [profile.to_dict() | dict(total_secs=profile.total_secs, reason=profile.reason())
+                for profile in slow]
+
+    def save(self):
+        """Write the settings to a temporary file and swap it in so a crash can't leave a half written file."""
+
+        with self.lock:
+            temp_path = f'{self.file_path}.tmp'
+            with open(temp_path, 'w') as sf:
+                json.dump(self.hosts, sf, indent=1)
+            os.replace(temp_path, self.file_path)
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def default_store() -> HostSettingsStore:
+    """Get the HostSettingsStore for the files in untracked_config, shared by all of the connections."""
+
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = HostSettingsStore()
+        return _default_store
+
+
+def profile_fleet(systems: Iterable, store: HostSettingsStore = None, timeout: float = 10.0,
+                  max_workers: int = 8) -> List[HandshakeProfile]:
+    """Profile the handshake to each system, learn the preferred algorithms, and log the slow ones.
+
+    :param systems: iterable of SystemModel
+    :param store: HostSettingsStore, defaults to the shared one.
+    :param timeout: float, seconds for each phase.
+    :param max_workers: int, the number of hosts to profile at the same time.
+    :return: list of HandshakeProfile
+    """
+
+    store = default_store() if store is None else store
+
+    def profile_system(stm):
+        # the host's current settings are used so the profile shows what the connections will see
+        return profile_handshake(stm.web_address, stm.username, stm.password, timeout=timeout,
+                                 settings=store.settings(stm.web_address), host_keys=store.host_keys)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        profiles = list(executor.map(profile_system, systems))
+    for profile in profiles:
+        store.learn(profile)
+    store.save()
+
+    for slow in store.slow_hosts():
+        lg.warning('Slow SSH handshake to %s: %.2f seconds (tcp %s, kex %s, auth %s), %s', slow['host'],
+                   slow['total_secs'], slow['tcp_secs'], slow['kex_secs'], slow['auth_secs'], slow['reason'])
+    return profiles
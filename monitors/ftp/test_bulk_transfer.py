@@ -0,0 +1,187 @@
+import hashlib
+import os
+import tempfile
+import threading
+import unittest
+
+import mock
+import paramiko
+
+from monitors.ftp.bulk_transfer import bulk_get, FAILED, fetch_file, part_path_for, remote_checksum, SKIPPED, \
+    TRANSFERRED
+
+
+class LocalSFTPFile:
+    """Stands in for paramiko.SFTPFile over a local file, counting the bytes read and prefetched."""
+
+    def __init__(self, path, counter, fail_after=None):
+        self._file = open(path, 'rb')
+        self._counter = counter
+        self._fail_after = fail_after
+
+    def seek(self, offset):
+        self._file.seek(offset)
+
+    def prefetch(self, file_size=None, max_concurrent_requests=None):
+        # as paramiko, file_size is the end position, the requests are from the current position up to it
+        if file_size is None:
+            file_size = os.fstat(self._file.fileno()).st_size
+        self._counter['prefetched'] += max(file_size - self._file.tell(), 0)
+
+    def read(self, size):
+        if self._fail_after is not None and self._file.tell() >= self._fail_after:
+            raise EOFError('The link dropped.')
+        data = self._file.read(size)
+        self._counter['read'] += len(data)
+        return data
+
+    def check(self, hash_algorithm):
+        self._file.seek(0)
+        return hashlib.new(hash_algorithm, self._file.read()).digest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._file.close()
+
+
+class LocalSFTP:
+    """Stands in for paramiko.SFTPClient over the local file system.
+
+    :param barrier: threading.Barrier, each open waits on it, to check the channels are used at the same time.
+    :param fail_after: int, reads past this position raise EOFError, as if the link dropped.
+    """
+
+    def __init__(self, barrier=None, fail_after=None):
+        self.counter = {'read': 0, 'prefetched': 0}
+        self.barrier = barrier
+        self.fail_after = fail_after
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def open(self, path, mode='rb'):
+        if self.barrier is not None:
+            self.barrier.wait(5)
+        return LocalSFTPFile(path, self.counter, self.fail_after)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class Client:
+    """Stands in for a connected SSHClientBase."""
+
+    def __init__(self, host):
+        self.host = host
+        self.ssh = host  # handed to the patched _open_sftp to pick the host's LocalSFTP
+
+
+class TestFetchFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.remote_path = os.path.join(self.tmp_dir.name, 'remote.log')
+        self.local_path = os.path.join(self.tmp_dir.name, 'local.log')
+        self.data = os.urandom(100_000)
+        with open(self.remote_path, 'wb') as rf:
+            rf.write(self.data)
+        self.sftp = LocalSFTP()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_local(self):
+        with open(self.local_path, 'rb') as lf:
+            return lf.read()
+
+    def test_transfer_then_skip_unchanged(self):
+        self.assertEqual(fetch_file(self.sftp, self.remote_path, self.local_path, verify='sha256'),
+                         (TRANSFERRED, len(self.data)))
+        self.assertEqual(self.read_local(), self.data)
+        self.assertEqual(fetch_file(self.sftp, self.remote_path, self.local_path), (SKIPPED, 0))
+
+    def test_resume_partial(self):
+        remote_mtime = os.stat(self.remote_path).st_mtime
+        with open(part_path_for(self.local_path, remote_mtime), 'wb') as pf:
+            pf.write(self.data[:60_000])
+
+        result = fetch_file(self.sftp, self.remote_path, self.local_path, verify='sha256')
+        self.assertEqual(result, (TRANSFERRED, 40_000))
+        self.assertEqual(self.sftp.counter['read'], 40_000)
+        self.assertEqual(self.read_local(), self.data)
+        self.assertFalse(os.path.exists(part_path_for(self.local_path, remote_mtime)))
+
+    def test_resume_from_large_offset_prefetches_the_rest(self):
+        remote_mtime = os.stat(self.remote_path).st_mtime
+        with open(part_path_for(self.local_path, remote_mtime), 'wb') as pf:
+            pf.write(self.data[:90_000])
+
+        self.assertEqual(fetch_file(self.sftp, self.remote_path, self.local_path), (TRANSFERRED, 10_000))
+        self.assertEqual(self.sftp.counter['prefetched'], 10_000)
+        self.assertEqual(self.read_local(), self.data)
+
+    def test_stale_partial_is_not_resumed(self):
+        stale_part = part_path_for(self.local_path, 1)
+        with open(stale_part, 'wb') as pf:
+            pf.write(b'old contents')
+
+        fetch_file(self.sftp, self.remote_path, self.local_path)
+        self.assertEqual(self.read_local(), self.data)
+        self.assertFalse(os.path.exists(stale_part))
+
+    def test_dropped_link_reports_partial_bytes(self):
+        self.sftp.fail_after = 30_000
+        with mock.patch('monitors.ftp.bulk_transfer.READ_CHUNK_SIZE', 10_000):
+            self.assertEqual(fetch_file(self.sftp, self.remote_path, self.local_path), (FAILED, 30_000))
+        remote_mtime = os.stat(self.remote_path).st_mtime
+        self.assertEqual(os.path.getsize(part_path_for(self.local_path, remote_mtime)), 30_000)
+
+    def test_unsafe_checksum_path_not_run(self):
+        ssh = mock.Mock()
+        self.assertIsNone(remote_checksum(ssh, LocalSFTP(), '/C:/logs/a" & del C:\\*.log', 'sha256'))
+        ssh.exec_command.assert_not_called()
+
+
+class TestBulkGet(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.jobs = {}
+        for host in ('hmi1', 'hmi2'):
+            self.jobs[host] = []
+            for number in range(4):
+                remote_path = os.path.join(self.tmp_dir.name, f'{host}_{number}.log')
+                with open(remote_path, 'wb') as rf:
+                    rf.write(os.urandom(1_000))
+                self.jobs[host].append((remote_path, os.path.join(self.tmp_dir.name, f'{host}_{number}.local')))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_hosts_and_channels_at_the_same_time(self):
+        barrier = threading.Barrier(4)  # two channels on each of the two hosts, only passes if all four are open
+        with mock.patch('monitors.ftp.bulk_transfer._open_sftp', lambda host: LocalSFTP(barrier)):
+            reports = bulk_get({Client(host): jobs for host, jobs in self.jobs.items()}, channels_per_host=2)
+        self.assertEqual({host: (report.transferred, report.failed, report.bytes_transferred)
+                          for host, report in reports.items()},
+                         {'hmi1': (4, 0, 4_000), 'hmi2': (4, 0, 4_000)})
+
+    def test_errors_reported_per_host(self):
+        def open_sftp(host):
+            if host == 'hmi1':
+                raise paramiko.SSHException('Not connected.')
+            return LocalSFTP(fail_after=600)
+
+        with mock.patch('monitors.ftp.bulk_transfer._open_sftp', open_sftp), \
+                mock.patch('monitors.ftp.bulk_transfer.READ_CHUNK_SIZE', 200):
+            reports = bulk_get({Client(host): jobs for host, jobs in self.jobs.items()}, channels_per_host=2)
+        self.assertEqual((reports['hmi1'].failed, reports['hmi1'].bytes_transferred), (4, 0))
+        # each of hmi2's files stopped after three chunks, the partial bytes still count
+        self.assertEqual((reports['hmi2'].failed, reports['hmi2'].bytes_transferred), (4, 2_400))
+
+
+if __name__ == '__main__':
+    unittest.main()
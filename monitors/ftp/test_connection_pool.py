@@ -0,0 +1,69 @@
+import unittest
+
+from monitors.ftp.connection_pool import ConnectionPool
+
+
+class FakeConnection:
+    """Stands in for SystemConnection, 'down' systems fail to connect."""
+
+    opened = []
+
+    def __init__(self, system, retry=0):
+        self.system = system
+        self.connected = system.hostname != 'down'
+        self.opened.append(self)
+
+    def close(self):
+        self.connected = False
+
+
+class System:
+    def __init__(self, id_, hostname='host'):
+        self.id = id_
+        self.hostname = hostname
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        FakeConnection.opened = []
+        self.pool = ConnectionPool(max_connections=2, idle_secs=300, connection_class=FakeConnection)
+
+    def test_reuse(self):
+        system = System(1)
+        with self.pool.connection(system) as first:
+            pass
+        with self.pool.connection(system) as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_least_recently_used_closed(self):
+        for id_ in (1, 2, 1, 3):
+            with self.pool.connection(System(id_)):
+                pass
+        self.assertEqual(list(self.pool.connections), [1, 3])
+        self.assertFalse(FakeConnection.opened[1].connected)
+
+    def test_failed_and_broken_not_kept(self):
+        with self.pool.connection(System(1, 'down')) as ssc:
+            self.assertFalse(ssc.connected)
+        with self.assertRaises(RuntimeError):
+            with self.pool.connection(System(2)) as ssc:
+                raise RuntimeError('broken channel')
+        self.assertFalse(ssc.connected)
+        self.assertEqual(len(self.pool), 0)
+
+    def test_idle_and_evict(self):
+        for id_ in (1, 2):
+            with self.pool.connection(System(id_)):
+                pass
+        self.pool.evict(1)
+        self.assertEqual(list(self.pool.connections), [2])
+        self.pool.idle_secs = -1
+        self.pool.close_idle()
+        self.assertEqual(len(self.pool), 0)
+        self.assertFalse(any(ssc.connected for ssc in FakeConnection.opened))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+from monitors.ftp.remote_tail import OffsetStore, RemoteTail
+
+
+class LocalSFTP:
+    """Stands in for paramiko.SFTPClient over the local file system."""
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def open(self, path, mode='rb'):
+        return open(path, mode)
+
+
+class TestRemoteTail(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.tmp_dir.name, 'hmi.log')
+        self.offsets_path = os.path.join(self.tmp_dir.name, 'last_position.json')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, text, mode='a'):
+        with open(self.log_path, mode + 'b') as lf:
+            lf.write(text.encode('utf8'))
+
+    def read_new(self, parse=None):
+        # a new tail and store each time, as if it were the next cycle
+        tail = RemoteTail(LocalSFTP(), 'hmi1', OffsetStore(self.offsets_path))
+        return list(tail.lines(self.log_path, parse))
+
+    def test_only_appended_lines(self):
+        self.write('one\r\ntwo\n', mode='w')
+        self.assertEqual(self.read_new(), ['one', 'two'])
+        self.assertEqual(self.read_new(), [])
+        self.write('three\nfou')
+        self.assertEqual(self.read_new(), ['three'])  # the partial line waits for its newline
+        self.write('r\n')
+        self.assertEqual(self.read_new(), ['four'])
+
+    def test_truncated(self):
+        self.write('a long first line\nsecond line\n', mode='w')
+        self.read_new()
+        self.write('new\n', mode='w')
+        self.assertEqual(self.read_new(), ['new'])
+
+    def test_rewritten_in_place(self):
+        header = 'x' * 300 + '\n'  # the same first bytes, so only the mtime shows the change
+        self.write(header + 'line a\n', mode='w')
+        self.read_new()
+        self.write(header + 'line b\n', mode='w')
+        stat = os.stat(self.log_path)
+        os.utime(self.log_path, (stat.st_atime, stat.st_mtime + 5))
+        self.assertEqual(self.read_new(), [header.rstrip('\n'), 'line b'])
+
+    def test_rotated(self):
+        self.write('first log line\n', mode='w')
+        self.read_new()
+        self.write('other log file\nwith more lines\n', mode='w')
+        self.assertEqual(self.read_new(), ['other log file', 'with more lines'])
+
+    def test_parse_and_early_close(self):
+        self.write('1\nskip\n2\n3\n', mode='w')
+        lines = RemoteTail(LocalSFTP(), 'hmi1', OffsetStore(self.offsets_path)).lines(
+            self.log_path, parse=lambda line: int(line) if line.isdigit() else None)
+        self.assertEqual(next(lines), 1)
+        self.assertEqual(next(lines), 2)
+        lines.close()  # stopping early keeps the position of the lines handed out
+        self.assertEqual(self.read_new(), ['3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import logging
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+import paramiko
+
+from monitors.ftp.drive_free_space import SSHClientBase
+from monitors.ftp.ssh_profile import HandshakeProfile, HostSettingsStore, KexLogHandler, profile_handshake
+
+HOST_KEY = paramiko.RSAKey.generate(2048)
+
+# the 2048 bit MODP group from RFC 3526, a safe prime, for the server's group exchange
+MODULI_LINE = ('20240101000000 2 6 100 2047 2 '
+               'FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74020BBEA63B139B22514A08798E3404DD'
+               'EF9519B3CD3A431B302B0A6DF25F14374FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED'
+               'EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF0598DA48361C55D39A69163FA8FD24CF5F'
+               '83655D23DCA3AD961C62F356208552BB9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B'
+               'E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF6955817183995497CEA956AE515D2261898FA0510'
+               '15728E5A8AACAA68FFFFFFFFFFFFFFFF\n')
+
+
+class PasswordServer(paramiko.ServerInterface):
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL if (username, password) == ('su', 'pw') else paramiko.AUTH_FAILED
+
+
+class LocalSSHServer:
+    """A paramiko server on localhost that only does the handshake and password authentication."""
+
+    def __init__(self, host_key=HOST_KEY, port=0, kex=None):
+        self.host_key = host_key
+        self.kex = kex  # the key exchanges offered, paramiko's by default
+        self.listener = socket.create_server(('127.0.0.1', port))
+        self.port = self.listener.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self.host_key)
+            if self.kex is not None:
+                transport.get_security_options().kex = self.kex
+            try:
+                transport.start_server(server=PasswordServer())
+            except (paramiko.SSHException, EOFError):  # EOFError when the client disconnects mid handshake
+                transport.close()
+
+    def close(self):
+        try:
+            self.listener.shutdown(socket.SHUT_RDWR)  # wakes up the accept
+        except OSError:
+            pass
+        self.listener.close()
+
+
+class TestSSHProfile(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = HostSettingsStore(os.path.join(self.tmp_dir.name, 'settings.json'),
+                                       os.path.join(self.tmp_dir.name, 'known_hosts'))
+        self.server = LocalSSHServer()
+
+    def tearDown(self):
+        self.server.close()
+        self.tmp_dir.cleanup()
+
+    def test_profile_and_learn(self):
+        profile = profile_handshake('127.0.0.1', 'su', 'pw', port=self.server.port)
+        self.assertIsNone(profile.error)
+        self.assertTrue(all(secs > 0 for secs in (profile.tcp_secs, profile.kex_secs, profile.auth_secs)))
+        self.assertIn(profile.kex, paramiko.Transport._preferred_kex)
+        self.assertEqual(profile.host_key_type, 'rsa-sha2-512')
+
+        # the handshake's log handler is detached, and no logger is left behind for the host
+        self.assertFalse(any(isinstance(handler, KexLogHandler)
+                             for handler in logging.getLogger('paramiko.transport.profile').handlers))
+        self.assertFalse([name for name in logging.Logger.manager.loggerDict if '127.0.0.1' in name])
+
+        self.store.learn(profile)
+        self.store.save()
+        reloaded = HostSettingsStore(self.store.file_path, self.store.known_hosts_path)
+        ciphers = reloaded.settings('127.0.0.1')['ciphers']
+        self.assertEqual(ciphers[0], 'aes128-ctr')
+        self.assertLess(ciphers.index('aes256-ctr'), ciphers.index('aes128-cbc'))
+        self.assertEqual(reloaded.settings('127.0.0.1')['key_types'], [profile.host_key_type])
+        self.assertEqual(reloaded.slow_hosts(slow_secs=0)[0]['host'], '127.0.0.1')
+        self.assertEqual(reloaded.slow_hosts(slow_secs=60), [])
+
+    def test_preferred_algorithms_used(self):
+        self.store.hosts['127.0.0.1'] = {'settings': {'ciphers': ['aes256-ctr'], 'kex': ['ecdh-sha2-nistp256']}}
+        profile = profile_handshake('127.0.0.1', 'su', 'pw', port=self.server.port,
+                                    settings=self.store.settings('127.0.0.1'))
+        self.assertEqual((profile.cipher, profile.kex), ('aes256-ctr', 'ecdh-sha2-nistp256'))
+
+    def test_learned_preference_avoids_group_exchange(self):
+        moduli_path = os.path.join(self.tmp_dir.name, 'moduli')
+        with open(moduli_path, 'w') as mf:
+            mf.write(MODULI_LINE)
+        self.assertTrue(paramiko.Transport.load_server_moduli(moduli_path))
+        self.addCleanup(setattr, paramiko.Transport, '_modulus_pack', None)
+        self.server.close()
+        # paramiko's own order agrees on the group exchange with this host
+        self.server = LocalSSHServer(kex=['diffie-hellman-group-exchange-sha256', 'diffie-hellman-group14-sha256'])
+
+        profile = profile_handshake('127.0.0.1', 'su', 'pw', port=self.server.port,
+                                    settings=self.store.settings('127.0.0.1'))
+        self.assertIsNone(profile.error)
+        self.assertEqual(profile.kex, 'diffie-hellman-group-exchange-sha256')
+
+        self.store.learn(profile)
+        self.assertEqual(self.store.settings('127.0.0.1')['kex'],
+                         ['diffie-hellman-group14-sha256', 'diffie-hellman-group-exchange-sha256'])
+        profile = profile_handshake('127.0.0.1', 'su', 'pw', port=self.server.port,
+                                    settings=self.store.settings('127.0.0.1'))
+        self.assertEqual(profile.kex, 'diffie-hellman-group14-sha256')
+
+    def test_failures(self):
+        self.assertIn('AuthenticationException', profile_handshake('127.0.0.1', 'su', 'bad', port=self.server.port)
+                      .error)
+        self.server.close()
+        self.assertIsNotNone(profile_handshake('127.0.0.1', 'su', 'pw', port=self.server.port, timeout=1).error)
+        self.assertTrue(HandshakeProfile('host', error='refused').reason().startswith('failed'))
+
+    def test_host_key_cached_and_checked(self):
+        settings_dict = dict(hostname='127.0.0.1', port=self.server.port, username='su', password='pw')
+        with SSHClientBase(settings_dict, host_settings=self.store) as client:
+            self.assertTrue(client.connected)
+        self.assertTrue(os.path.exists(self.store.known_hosts_path))
+
+        self.server.close()
+        self.server = LocalSSHServer(paramiko.RSAKey.generate(2048), self.server.port)  # the host was replaced
+        store = HostSettingsStore(self.store.file_path, self.store.known_hosts_path)
+        with self.assertRaises(paramiko.BadHostKeyException):
+            SSHClientBase(settings_dict, host_settings=store)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+"""Availability timelines for the hosts and CheckServers, kept as intervals of the same status instead of samples.
+
+Each poll result either extends the check's current interval or closes it and opens a new one, so the timeline only
+grows when the status changes. Availability, MTBF and MTTR over a window are found by bisecting the interval starts
+and walking the intervals in the window, so they take time proportional to the number of transitions in the window.
+
+Checks are keyed by strings like 'host:3' and 'check:12' (the SystemModel and CheckServer ids).
+"""
+import bisect
+from typing import Dict, List, Union
+
+UP = 'up'
+DEFAULT_MAX_GAP = 3600.0  # a gap in the results longer than this is unknown, not the status on either side of it
+
+
+def host_key(system_id: int) -> str:
+    return f'host:{system_id}'
+
+
+def check_key(check_server_id: int) -> str:
+    return f'check:{check_server_id}'
+
+
+class Interval:
+    """A closed interval [start, end] (epoch seconds) that a check had the same status for.
+
+    :param id_: int, the AvailabilityInterval id once it has been saved, or None.
+    """
+
+    __slots__ = 'start', 'end', 'status', 'id'
+
+    def __init__(self, start: float, end: float, status: str, id_: int = None):
+        self.start = start
+        self.end = end
+        self.status = status
+        self.id = id_
+
+    def __repr__(self):
+        return f'Interval({self.start}, {self.end}, {self.status!r})'
+
+
+class CheckTimeline:
+    """The intervals for one check, in time order, with their starts kept for bisecting."""
+
+    def __init__(self):
+        self.intervals: List[Interval] = []
+        self.starts: List[float] = []
+
+    def append(self, interval: Interval):
+        self.intervals.append(interval)
+        self.starts.append(interval.start)
+
+    def record(self, status: str, ts: float, max_gap: float = DEFAULT_MAX_GAP) -> List[Interval]:
+        """Add a result, returns the intervals that were changed or added."""
+
+        last = self.intervals[-1] if self.intervals else None
+        if last is not None and ts < last.end:
+            return []  # out of order, the timeline only moves forward
+        changed = []
+        if last is not None and ts - last.end <= max_gap:
+            last.end = ts  # if the status changed it was somewhere since the last result, call it now
+            if last.status == status:
+                return [last]
+            changed.append(last)
+        new_interval = Interval(ts, ts, status)
+        self.append(new_interval)
+        changed.append(new_interval)
+        return changed
+
+    def overlapping(self, start: float, end: float):
+        """Generate the intervals overlapping [start, end], clipped to it."""
+
+        for index in range(max(bisect.bisect_right(self.starts, start) - 1, 0), len(self.intervals)):
+            interval = self.intervals[index]
+            if interval.start > end:
+                break
+            if interval.end < start:
+                continue
+            yield max(interval.start, start), min(interval.end, end), interval.status
+
+    def summary(self, start: float, end: float) -> dict:
+        """Get the availability, MTBF and MTTR for the window.
+
+        :param start: float, epoch seconds.
+        :param end: float, epoch seconds.
+        :return: dict, times in seconds, the means are None if there was nothing to average.
+        """
+
+        up_secs = down_secs = 0.0
+        failures = outages = 0
+        previous_status = None
+        for clip_start, clip_end, status in self.overlapping(start, end):
+            if status == UP:
+                up_secs += clip_end - clip_start
+            else:
+                down_secs += clip_end - clip_start
+                if previous_status == UP:
+                    failures += 1
+                if previous_status is None or previous_status == UP:
+                    outages += 1  # including one that was already going when the window started
+            previous_status = status
+
+        known_secs = up_secs + down_secs
+        return dict(availability=up_secs / known_secs if known_secs else None,
+                    up_secs=up_secs,
+                    down_secs=down_secs,
+                    unknown_secs=(end - start) - known_secs,
+                    failures=failures,
+                    mtbf_secs=up_secs / failures if failures else None,
+                    mttr_secs=down_secs / outages if outages else None)
+
+    def prune(self, before: float):
+        """Drop the intervals that ended before the time."""
+
+        index = 0
+        while index < len(self.intervals) - 1 and self.intervals[index].end < before:
+            index += 1
+        del self.intervals[:index]
+        del self.starts[:index]
+
+
+class AvailabilityTimeline:
+    """The timelines for all of the checks, merged incrementally as the results come in.
+
+    :param max_gap: float, seconds between results after which the time between them is unknown.
+    """
+
+    def __init__(self, max_gap: float = DEFAULT_MAX_GAP):
+        self.max_gap = max_gap
+        self.checks: Dict[str, CheckTimeline] = {}
+        self.dirty: Dict[int, tuple] = {}  # id(interval): (key, interval) changed since the last save
+
+    def record(self, key: str, status: str, ts: float):
+        """Add a result for a check.
+
+        :param key: str, the check key, see host_key and check_key.
+        :param status: str, 'up' or any down status.
+        :param ts: float, epoch seconds.
+        """
+
+        timeline = self.checks.get(key)
+        if timeline is None:
+            timeline = self.checks[key] = CheckTimeline()
+        for changed in timeline.record(status, ts, self.max_gap):
+            self.dirty[id(changed)] = (key, changed)
+
+    def load(self, key: str, intervals: List[Interval]):
+        """Add saved intervals for a check, in time order, before any new results are recorded for it."""
+
+        timeline = self.checks.setdefault(key, CheckTimeline())
+        for interval in intervals:
+            timeline.append(interval)
+
+    def summary(self, key: str, start: float, end: float) -> Union[dict, None]:
+        timeline = self.checks.get(key)
+        return None if timeline is None else timeline.summary(start, end)
+
+    def summaries(self, start: float, end: float) -> Dict[str, dict]:
+        return {key: timeline.summary(start, end) for key, timeline in self.checks.items()}
+
+    def take_dirty(self):
+        """Get the (key, interval) changed since the last call, to be saved."""
+
+        dirty, self.dirty = list(self.dirty.values()), {}
+        return dirty
+
+    def prune(self, before: float):
+        """Drop the intervals that ended before the time, to keep the memory used bounded."""
+
+        for timeline in self.checks.values():
+            timeline.prune(before)
@@ -0,0 +1,197 @@
+"""Compression of the metric series on ingest, like a plant historian only the points needed to rebuild the series
+within a tolerance are kept.
+
+Two methods are used:
+ * deadband: a point is kept when it is more than the tolerance from the last kept point, the series is rebuilt as
+   steps (each kept value holds until the next kept point).
+ * swinging door: a point is kept when no straight line from the last kept point can pass within the tolerance of
+   every point since, the series is rebuilt by linear interpolation between the kept points.
+
+Both also keep a point when max_gap seconds have passed since the last kept point, so a flat series still shows up.
+Points are (timestamp, value) tuples with the timestamp as epoch seconds.
+"""
+import bisect
+import math
+from typing import List, Tuple, Union
+
+Point = Tuple[float, float]
+
+DEADBAND, SWINGING_DOOR = 'deadband', 'swinging_door'
+
+# per metric: (compression method, tolerance in the metric's units)
+METRIC_COMPRESSION = {
+    'free_space_bytes': (SWINGING_DOOR, 100_000_000),  # 100 MB
+    'clock_drift_secs': (SWINGING_DOOR, 0.05),  # 50 ms
+    'uptime_secs': (SWINGING_DOOR, 1.0),  # a straight line until a reboot
+}
+DEFAULT_MAX_GAP = 3600.0
+
+
+class DeadbandCompressor:
+    """Keeps a point when the value moves more than the tolerance from the last kept value.
+
+    The sample just before a kept point is also kept, so the step happens at the right time when rebuilt.
+
+    :param tolerance: float, in the units of the metric.
+    :param max_gap: float, seconds after which a point is kept regardless.
+    """
+
+    method = DEADBAND
+
+    def __init__(self, tolerance: float, max_gap: float = DEFAULT_MAX_GAP):
+        self.tolerance = tolerance
+        self.max_gap = max_gap
+        self.last_kept: Union[Point, None] = None
+        self.held: Union[Point, None] = None  # the last point seen that was not kept
+
+    def add(self, ts: float, value: float) -> List[Point]:
+        """Add a sample, returns the points to store."""
+
+        point = (ts, value)
+        if self.last_kept is None:
+            self.last_kept = point
+            return [point]
+
+        if abs(value - self.last_kept[1]) > self.tolerance:
+            kept = [self.held, point] if self.held is not None else [point]
+            self.last_kept, self.held = point, None
+            return kept
+        if ts - self.last_kept[0] >= self.max_gap:
+            self.last_kept, self.held = point, None
+            return [point]
+
+        self.held = point
+        return []
+
+    def flush(self) -> List[Point]:
+        """Get the last point seen if it was not kept, to store when the series is ending."""
+
+        held, self.held = self.held, None
+        if held is not None:
+            self.last_kept = held
+            return [held]
+        return []
+
+
+class SwingingDoorCompressor:
+    """Keeps a point when the points since the last kept one can no longer be covered by one line within tolerance.
+
+    The slope range of lines from the last kept point that pass within the tolerance of every point since is narrowed
+    with each point. When it is empty the point before is kept, moved onto a line within that range if it needs to be,
+    so the series rebuilt by linear interpolation is always within the tolerance of every sample.
+
+    :param tolerance: float, in the units of the metric.
+    :param max_gap: float, seconds after which a point is kept regardless.
+    """
+
+    method = SWINGING_DOOR
+
+    def __init__(self, tolerance: float, max_gap: float = DEFAULT_MAX_GAP):
+        self.tolerance = tolerance
+        self.max_gap = max_gap
+        self.last_kept: Union[Point, None] = None
+        self.held: Union[Point, None] = None
+        self._slope_low = -math.inf
+        self._slope_high = math.inf
+
+    def _narrow(self, point: Point):
+        """Narrow the slope range (the doors) to also cover the point, returns whether the range is still open."""
+
+        dt = point[0] - self.last_kept[0]
+        if dt <= 0:
+            return abs(point[1] - self.last_kept[1]) <= self.tolerance
+        self._slope_low = max(self._slope_low, (point[1] - self.tolerance - self.last_kept[1]) / dt)
+        self._slope_high = min(self._slope_high, (point[1] + self.tolerance - self.last_kept[1]) / dt)
+        return self._slope_low <= self._slope_high
+
+    def _keep_held(self) -> Point:
+        """Keep the held point, on the closest line in the slope range to its actual value."""
+
+        ts, value = self.held
+        dt = ts - self.last_kept[0]
+        if dt > 0:
+            slope = min(max((value - self.last_kept[1]) / dt, self._slope_low), self._slope_high)
+            value = self.last_kept[1] + slope * dt
+        kept = (ts, value)
+        self.last_kept, self.held = kept, None
+        self._slope_low, self._slope_high = -math.inf, math.inf
+        return kept
+
+    def add(self, ts: float, value: float) -> List[Point]:
+        """Add a sample, returns the points to store."""
+
+        point = (ts, value)
+        if self.last_kept is None:
+            self.last_kept = point
+            return [point]
+
+        gap_reached = ts - self.last_kept[0] >= self.max_gap
+        slope_range = self._slope_low, self._slope_high
+        if self._narrow(point):
+            self.held = point
+            return [self._keep_held()] if gap_reached else []
+
+        # the doors opened past parallel, keep the held point and start over from it
+        self._slope_low, self._slope_high = slope_range
+        kept = [self._keep_held()] if self.held is not None else []
+        self.held = point
+        if not self._narrow(point) or ts - self.last_kept[0] >= self.max_gap:
+            kept.append(self._keep_held())
+        return kept
+
+    def flush(self) -> List[Point]:
+        """Get the held point, to store when the series is ending."""
+
+        if self.held is None:
+            return []
+        return [self._keep_held()]
+
+
+def new_compressor(metric: str):
+    """Get a compressor with the configured method and tolerance for the metric."""
+
+    method, tolerance = METRIC_COMPRESSION[metric]
+    if method == DEADBAND:
+        return DeadbandCompressor(tolerance)
+    return SwingingDoorCompressor(tolerance)
+
+
+def interpolate(points: List[Point], ts: float, method: str = SWINGING_DOOR) -> Union[float, None]:
+    """Get the value of a compressed series at any timestamp.
+
+    :param points: list, the kept (timestamp, value) points in time order.
+    :param ts: float, the timestamp.
+    :param method: str, the compression method, deadband series are rebuilt as steps and swinging door as lines.
+    :return: float, or None before the first point.
+    """
+
+    index = bisect.bisect_right(points, ts, key=lambda pt: pt[0])
+    if index == 0:
+        return None
+    ts0, value0 = points[index - 1]
+    if index == len(points) or method == DEADBAND or ts == ts0:
+        return value0
+    ts1, value1 = points[index]
+    return value0 + (value1 - value0) * (ts - ts0) / (ts1 - ts0)
+
+
+class CompressedSeries:
+    """Reads a compressed series back at any timestamps.
+
+    :param points: list, the kept (timestamp, value) points in time order.
+    :param method: str, the compression method used.
+    """
+
+    def __init__(self, points: List[Point], method: str = SWINGING_DOOR):
+        self.points = points
+        self.method = method
+
+    @classmethod
+    def for_metric(cls, metric: str, points: List[Point]):
+        return cls(points, METRIC_COMPRESSION[metric][0])
+
+    def value_at(self, ts: float) -> Union[float, None]:
+        return interpolate(self.points, ts, self.method)
+
+    def values_at(self, timestamps) -> list:
+        return [self.value_at(ts) for ts in timestamps]
@@ -0,0 +1,122 @@
+"""Export of the metric history to pandas and CSV in chunks, so exports of any size run in constant memory.
+
+The points are read with a server-side cursor (stream_results) and fetched chunk_size rows at a time, each chunk is
+turned into a DataFrame with compact dtypes: the system ids and metric names are categoricals with the same categories
+in every chunk, so the chunks can be concatenated without the categoricals turning back into objects.
+"""
+import datetime
+import io
+from typing import Iterable, Iterator, Union
+
+import pandas as pd
+from sqlalchemy import select
+
+from models.check_server_table import CheckServer
+from models.metric_history import MetricPoint
+from models.sqla_instance import Session
+from models.systems_settings import SystemModel
+from monitors.history.compression import METRIC_COMPRESSION
+
+DEFAULT_CHUNK_SIZE = 50_000
+COLUMNS = 'system_id', 'metric', 'ts', 'value'
+
+
+def _new_session():
+    # not the scoped session, a streamed export can be iterated from several threads (e.g. a StreamingResponse)
+    return Session.session_factory()
+
+
+def history_chunks(system_ids: Iterable[int] = None, metrics: Iterable[str] = None,
+                   start: datetime.datetime = None, end: datetime.datetime = None,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE, session=None) -> Iterator[pd.DataFrame]:
+    """Generate the metric history as DataFrames of up to chunk_size rows, ordered by system, metric, and time.
+
+    :param system_ids: iterable, of the SystemModel ids to export, or None for all of them.
+    :param metrics: iterable, of the metric names to export, or None for all of them.
+    :param start: datetime.datetime, the earliest point, or None.
+    :param end: datetime.datetime, the latest point, or None.
+    :param chunk_size: int, the rows fetched from the cursor and put in each DataFrame.
+    :param session: sqlalchemy.orm.Session, defaults to a new session that is closed when the generator finishes.
+    :return: generator of pandas.DataFrame, with columns system_id (category), metric (category), ts
+        (datetime64[ns, UTC]), and value (float64).
+    """
+
+    own_session = session is None
+    session = _new_session() if own_session else session
+    try:
+        query = select(MetricPoint.system_id, MetricPoint.metric, MetricPoint.ts, MetricPoint.value)
+        if system_ids is not None:
+            system_ids = sorted(set(system_ids))
+            query = query.where(MetricPoint.system_id.in_(system_ids))
+        else:
+            _ = CheckServer  # needed for the relationship
+            system_ids = list(session.scalars(select(SystemModel.id).order_by(SystemModel.id)))
+        if metrics is not None:
+            metrics = sorted(set(metrics))
+            query = query.where(MetricPoint.metric.in_(metrics))
+        else:
+            metrics = sorted(METRIC_COMPRESSION)  # only these are historized, see MetricIngest
+        if start is not None:
+            query = query.where(MetricPoint.ts >= start)
+        if end is not None:
+            query = query.where(MetricPoint.ts <= end)
+        query = query.order_by(MetricPoint.system_id, MetricPoint.metric, MetricPoint.ts)
+
+        dtypes = dict(system_id=pd.CategoricalDtype(system_ids), metric=pd.CategoricalDtype(metrics))
+        result = session.execute(query.execution_options(stream_results=True, yield_per=chunk_size))
+        for rows in result.partitions(chunk_size):
+            chunk = pd.DataFrame.from_records(rows, columns=COLUMNS)
+            chunk['system_id'] = chunk['system_id'].astype(dtypes['system_id'])
+            chunk['metric'] = chunk['metric'].astype(dtypes['metric'])
+            chunk['ts'] = pd.to_datetime(chunk['ts'], utc=True)  # naive times from the database are UTC
+            chunk['value'] = chunk['value'].astype('float64')
+            yield chunk
+    finally:
+        if own_session:
+            session.close()
+
+
+def history_frame(**kwargs) -> pd.DataFrame:
+    """Get the metric history as one DataFrame, for exports that fit in memory. See history_chunks for the kwargs."""
+
+    chunks = list(history_chunks(**kwargs))
+    if not chunks:
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in
+                             zip(COLUMNS, ('category', 'category', 'datetime64[ns, UTC]', 'float64'))})
+    return pd.concat(chunks, ignore_index=True)
+
+
+def csv_chunks(chunks: Iterable[pd.DataFrame]) -> Iterator[str]:
+    """Generate the CSV text for each chunk, the header is only in the first."""
+
+    header = True
+    for chunk in chunks:
+        buffer = io.StringIO()
+        chunk.to_csv(buffer, index=False, header=header, date_format='%Y-%m-%dT%H:%M:%S.%f%z')
+        header = False
+        yield buffer.getvalue()
+    if header:  # there were no rows
+        yield ','.join(COLUMNS) + '\n'
+
+
+def write_csv(file: Union[str, io.TextIOBase], **kwargs) -> int:
+    """Write the metric history to a CSV file a chunk at a time. See history_chunks for the kwargs.
+
+    :param file: str, the file path, or an open text file.
+    :return: int, the number of rows written.
+    """
+
+    rows = 0
+
+    def counted(chunks):
+        nonlocal rows
+        for chunk in chunks:
+            rows += len(chunk)
+            yield chunk
+
+    if isinstance(file, str):
+        with open(file, 'w', newline='') as cf:
+            cf.writelines(csv_chunks(counted(history_chunks(**kwargs))))
+    else:
+        file.writelines(csv_chunks(counted(history_chunks(**kwargs))))
+    return rows
@@ -0,0 +1,52 @@
+"""Compresses the metrics from each cycle and saves the kept points to the metric history."""
+import time
+
+from log_setup import lg
+from monitors.history.compression import METRIC_COMPRESSION, new_compressor
+
+
+class MetricIngest:
+    """Holds a compressor for each (system, metric) series and saves the points they keep.
+
+    :param save_points: callable, called with (system_id, metric, points) for the kept points, defaults to
+        MetricPoint.add_points.
+    """
+
+    def __init__(self, save_points=None):
+        if save_points is None:
+            from models.metric_history import MetricPoint
+            save_points = MetricPoint.add_points
+        self.save_points = save_points
+        self.compressors = {}
+
+    def record(self, system_id: int, metrics: dict, ts: float = None):
+        """Add the metric values measured for a system.
+
+        :param system_id: int, the SystemModel id.
+        :param metrics: dict, {metric name: value}, None values are skipped.
+        :param ts: float, epoch seconds, defaults to now.
+        """
+
+        ts = time.time() if ts is None else ts
+        for metric, value in metrics.items():
+            if value is None:
+                continue
+            if metric not in METRIC_COMPRESSION:
+                lg.debug('No compression is configured for metric %s, it is not historized.', metric)
+                continue
+            compressor = self.compressors.get((system_id, metric))
+            if compressor is None:
+                compressor = self.compressors[(system_id, metric)] = new_compressor(metric)
+            self.save_points(system_id, metric, compressor.add(ts, float(value)))
+
+    def flush(self):
+        """Save the points held by the compressors, for when the monitor is stopping."""
+
+        for (system_id, metric), compressor in self.compressors.items():
+            self.save_points(system_id, metric, compressor.flush())
+
+    def forget(self, system_id: int):
+        """Save the points held for a system and drop its compressors, when it is removed from the fleet."""
+
+        for system_metric in [key for key in self.compressors if key[0] == system_id]:
+            self.save_points(system_id, system_metric[1], self.compressors.pop(system_metric).flush())
@@ -0,0 +1,68 @@
+import unittest
+
+from monitors.history.availability import AvailabilityTimeline, CheckTimeline, host_key, UP
+
+
+class TestCheckTimeline(unittest.TestCase):
+    def test_merges_same_status(self):
+        timeline = CheckTimeline()
+        for ts in range(0, 600, 60):
+            timeline.record(UP, ts)
+        self.assertEqual(len(timeline.intervals), 1)
+        self.assertEqual((timeline.intervals[0].start, timeline.intervals[0].end), (0, 540))
+
+    def test_transitions_and_gaps(self):
+        timeline = CheckTimeline()
+        timeline.record(UP, 0)
+        timeline.record(UP, 100)
+        timeline.record('down', 200)
+        timeline.record('down', 300)
+        timeline.record(UP, 10_000, max_gap=3600)  # after a long gap, the time between is unknown
+        self.assertEqual([(i.start, i.end, i.status) for i in timeline.intervals],
+                         [(0, 200, UP), (200, 300, 'down'), (10_000, 10_000, UP)])
+        self.assertEqual(timeline.record(UP, 50), [])  # out of order results are ignored
+
+    def test_summary(self):
+        timeline = CheckTimeline()
+        # up 0-900, down 900-1000, up 1000-1900, down 1900-2000, up 2000-3000
+        for ts, status in ((0, UP), (900, 'down'), (1000, UP), (1900, 'down'), (2000, UP), (3000, UP)):
+            timeline.record(status, ts)
+        summary = timeline.summary(0, 3000)
+        self.assertAlmostEqual(summary['availability'], 2800 / 3000)
+        self.assertEqual(summary['failures'], 2)
+        self.assertEqual(summary['mtbf_secs'], 1400)
+        self.assertEqual(summary['mttr_secs'], 100)
+        self.assertEqual(summary['unknown_secs'], 0)
+
+        clipped = timeline.summary(950, 1500)  # starts in an outage
+        self.assertEqual(clipped['down_secs'], 50)
+        self.assertEqual(clipped['failures'], 0)
+        self.assertEqual(clipped['mttr_secs'], 50)
+        self.assertEqual(timeline.summary(5000, 6000)['availability'], None)
+
+    def test_prune(self):
+        timeline = CheckTimeline()
+        for ts, status in ((0, UP), (100, 'down'), (200, UP), (300, UP)):
+            timeline.record(status, ts)
+        timeline.prune(150)
+        self.assertEqual([i.start for i in timeline.intervals], [100, 200])
+        self.assertEqual(timeline.starts, [100, 200])
+
+
+class TestAvailabilityTimeline(unittest.TestCase):
+    def test_dirty_intervals(self):
+        timeline = AvailabilityTimeline()
+        timeline.record(host_key(1), UP, 0)
+        timeline.record(host_key(1), UP, 60)
+        dirty = timeline.take_dirty()
+        self.assertEqual(len(dirty), 1)
+        dirty[0][1].id = 7  # saved
+        timeline.record(host_key(1), 'down', 120)
+        statuses = sorted((interval.id is None, interval.status) for _, interval in timeline.take_dirty())
+        self.assertEqual(statuses, [(False, UP), (True, 'down')])
+        self.assertEqual(timeline.take_dirty(), [])
+        self.assertEqual(set(timeline.summaries(0, 120)), {'host:1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
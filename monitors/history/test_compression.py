@@ -0,0 +1,57 @@
+import math
+import random
+import unittest
+
+from monitors.history.compression import CompressedSeries, DEADBAND, DeadbandCompressor, interpolate, \
+    SwingingDoorCompressor
+
+
+def compress(compressor, samples):
+    kept = []
+    for ts, value in samples:
+        kept.extend(compressor.add(ts, value))
+    kept.extend(compressor.flush())
+    return kept
+
+
+class TestSwingingDoor(unittest.TestCase):
+    def test_line_keeps_only_ends(self):
+        samples = [(ts, 1000 - 3 * ts) for ts in range(0, 600, 10)]
+        kept = compress(SwingingDoorCompressor(tolerance=1), samples)
+        self.assertEqual(kept, [samples[0], samples[-1]])
+
+    def test_rebuilt_within_tolerance(self):
+        rnd = random.Random(4)
+        tolerance = 0.05
+        samples = [(ts, math.sin(ts / 300) + rnd.uniform(-0.02, 0.02)) for ts in range(0, 3000, 5)]
+        kept = compress(SwingingDoorCompressor(tolerance), samples)
+        self.assertLess(len(kept), len(samples) / 4)
+        for ts, value in samples:
+            self.assertLessEqual(abs(interpolate(kept, ts) - value), tolerance + 1e-9)
+
+    def test_max_gap(self):
+        kept = compress(SwingingDoorCompressor(tolerance=1, max_gap=100), [(ts, 5.0) for ts in range(0, 301, 10)])
+        self.assertEqual([ts for ts, _ in kept], [0, 100, 200, 300])
+
+
+class TestDeadband(unittest.TestCase):
+    def test_step(self):
+        samples = [(0, 10.0), (10, 10.4), (20, 10.2), (30, 12.0), (40, 12.1)]
+        kept = compress(DeadbandCompressor(tolerance=0.5), samples)
+        self.assertEqual(kept, [(0, 10.0), (20, 10.2), (30, 12.0), (40, 12.1)])
+        series = CompressedSeries(kept, DEADBAND)
+        for ts, value in samples:
+            self.assertLessEqual(abs(series.value_at(ts) - value), 0.5)
+        self.assertEqual(series.value_at(25), 10.2)
+
+
+class TestInterpolate(unittest.TestCase):
+    def test_bounds(self):
+        points = [(10, 1.0), (20, 3.0)]
+        self.assertIsNone(interpolate(points, 5))
+        self.assertEqual(interpolate(points, 15), 2.0)
+        self.assertEqual(interpolate(points, 25), 3.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
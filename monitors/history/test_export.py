@@ -0,0 +1,66 @@
+import datetime
+import io
+import unittest
+
+import pandas as pd
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+
+from models.metric_history import MetricPoint
+from models.systems_settings import SystemModel
+from monitors.history.export import csv_chunks, history_chunks, history_frame, write_csv
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class TestHistoryExport(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        engine = sqlalchemy.create_engine('sqlite:///:memory:')
+        SystemModel.__table__.create(engine)
+        MetricPoint.__table__.create(engine)
+        cls.session = sessionmaker(bind=engine)()
+        for system_id in (1, 2, 3):
+            cls.session.add(SystemModel(id=system_id, hostname=f'host{system_id}', username='su', password='pw'))
+        for system_id in (1, 2):
+            for minute in range(50):
+                for metric, value in (('free_space_bytes', 1e12 - minute), ('clock_drift_secs', minute / 100)):
+                    cls.session.add(MetricPoint(system_id=system_id, metric=metric, value=value,
+                                                ts=START + datetime.timedelta(minutes=minute)))
+        cls.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.close()
+
+    def test_chunks(self):
+        chunks = list(history_chunks(chunk_size=30, session=self.session))
+        self.assertEqual([len(chunk) for chunk in chunks], [30, 30, 30, 30, 30, 30, 20])
+        frame = pd.concat(chunks, ignore_index=True)
+        self.assertEqual(frame['system_id'].dtype, pd.CategoricalDtype([1, 2, 3]))
+        self.assertEqual(str(frame['metric'].dtype), 'category')
+        self.assertEqual(str(frame['ts'].dtype), 'datetime64[ns, UTC]')
+        self.assertEqual(frame['ts'].iloc[0], pd.Timestamp(START))
+        self.assertEqual(frame['value'].max(), 1e12)
+
+    def test_filters(self):
+        frame = history_frame(system_ids=[2], metrics=['clock_drift_secs'],
+                              start=START + datetime.timedelta(minutes=40), session=self.session)
+        self.assertEqual(len(frame), 10)
+        self.assertEqual(set(frame['system_id']), {2})
+        self.assertEqual(len(history_frame(system_ids=[3], session=self.session)), 0)
+
+    def test_csv(self):
+        text = ''.join(csv_chunks(history_chunks(system_ids=[1], chunk_size=7, session=self.session)))
+        lines = text.splitlines()
+        self.assertEqual(lines[0], 'system_id,metric,ts,value')
+        self.assertEqual(len(lines), 101)
+        self.assertEqual(pd.read_csv(io.StringIO(text))['value'].max(), 1e12)
+
+        buffer = io.StringIO()
+        self.assertEqual(write_csv(buffer, metrics=['uptime_secs'], session=self.session), 0)
+        self.assertEqual(buffer.getvalue(), 'system_id,metric,ts,value\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,319 @@
+"""The checks run against each system, one pass over the fleet is a cycle."""
+import datetime
+import threading
+import time
+
+import paramiko
+import requests
+
+from helpers.dev_common import exception_one_line
+from helpers.helpers import format_storage_bytes
+from log_setup import lg
+from monitors.collector.collector import deploy_collector, read_collector_status
+from monitors.ftp.connection_pool import ConnectionPool
+from monitors.ftp.drive_free_space import SystemConnection
+from monitors.ftp.ssh_profile import default_store
+from monitors.history.availability import AvailabilityTimeline, check_key, host_key
+from monitors.history.ingest import MetricIngest
+from monitors.scheduling.adaptive import AdaptiveScheduler
+from monitors.server_status.dependency_graph import DOWN, PARENT_DOWN, sweep_fleet, UP
+from monitors.server_status.reachability import FleetReachability
+from monitors.time_check.time_check import seconds_between
+
+
+def check_drive_space(stm, ssc: SystemConnection, drive_check: dict):
+    """Check the free space on the configured drive and warn when it is below the limit.
+
+    :param stm: SystemModel
+    :param ssc: SystemConnection, connected to the system.
+    :param drive_check: dict, the drive_check_table entry for the system.
+    :return: int, the free bytes.
+    """
+
+    free_space_bytes: int = ssc.get_free_space(drive_check['drive_letter'])
+    report_free_space(stm, free_space_bytes, drive_check)
+    return free_space_bytes
+
+
+def report_free_space(stm, free_space_bytes: int, drive_check: dict):
+    """Log the free space, warning when it is below the limit.
+
+    :param stm: SystemModel
+    :param free_space_bytes: int
+    :param drive_check: dict, the drive_check_table entry for the system.
+    """
+
+    check_drive_letter: str = drive_check['drive_letter']
+    free_space: str = format_storage_bytes(free_space_bytes, binary_system=False)
+    lg.info('System %s has %s remaining free on the %s drive.',
+            stm.nickname, free_space, check_drive_letter)
+    warning_bytes = drive_check['alert_low_bytes'][0]
+    warning_bytes_formatted: str = format_storage_bytes(warning_bytes, binary_system=False)
+    if warning_bytes >= free_space_bytes:
+        lg.warning('BELOW WARNING LIMIT: %s for System %s has %s remaining free on the %s drive.',
+                   warning_bytes_formatted, stm.nickname, free_space, check_drive_letter)
+
+
+def check_clock(stm, ssc: SystemConnection):
+    """Check the clock drift of the system, nudging it closer if it is off by more than 10 seconds.
+
+    :param stm: SystemModel
+    :param ssc: SystemConnection, connected to the system.
+    :return: tuple, (float seconds the remote clock is off from the local clock, datetime.timedelta system up time)
+    """
+
+    system_up_since = ssc.get_windows_boot_time()
+    system_up_time = datetime.datetime.now() - system_up_since
+    uptime_str = f' System up for {str(system_up_time)} since {system_up_since}'
+
+    remote_system_time = ssc.get_system_time()
+    time_diff_secs: float = seconds_between(datetime.datetime.now(), remote_system_time)
+
+    # if the time is off enough, start pushing it a little closer
+    if abs(time_diff_secs) > 10:
+        fixing_str = ' The time will be nudged ~300 milliseconds closer.'  # leading space for below
+    else:
+        fixing_str = ''
+
+    lg.info(
+        f'The time for the remote system {stm.nickname} is {remote_system_time}, off from local system '
+        f'time by {time_diff_secs:.2f} seconds.{fixing_str}'
+        f'{uptime_str}')
+    if fixing_str:
+        ssc.nudge_system_time('+' if time_diff_secs < 0 else '-')
+    return time_diff_secs, system_up_time
+
+
+def check_collector(stm, ssc: SystemConnection, drive_check: dict):
+    """Get the metrics from the collector's status file on the host, deploying the collector if it isn't there.
+
+    The clock drift comes from the status file when the collector has a time reference, otherwise it is checked with
+    a single command.
+
+    :param stm: SystemModel
+    :param ssc: SystemConnection, connected to the system.
+    :param drive_check: dict, the drive_check_table entry for the system, with 'collector': True.
+    :return: dict, {metric name: value}, or None if there is no usable status yet.
+    """
+
+    status = read_collector_status(ssc)
+    if status is None:
+        lg.info('No current collector status on %s, deploying the collector.', stm.nickname)
+        try:
+            deploy_collector(ssc, drives=[drive_check['drive_letter']], services=drive_check.get('services', ()),
+                             time_reference=drive_check.get('time_reference'))
+        except ValueError as config_err:
+            lg.error('The collector settings for %s in the drive_check_table are not valid: %s', stm.nickname,
+                     config_err)
+        except (paramiko.SSHException, IOError) as deploy_err:
+            lg.warning('Could not deploy the collector to %s: %s', stm.nickname, deploy_err)
+        return None
+
+    metrics = {}
+    free_space_bytes = status.free_space(drive_check['drive_letter'])
+    if free_space_bytes is not None:
+        report_free_space(stm, free_space_bytes, drive_check)
+        metrics['free_space_bytes'] = free_space_bytes
+    if status.boot_time is not None:
+        # both from the host clock, so the drift doesn't matter
+        metrics['uptime_secs'] = (status.written - status.boot_time).total_seconds() + status.age_secs
+
+    drift_secs = status.clock_drift_secs
+    if drift_secs is None:
+        drift_secs = seconds_between(datetime.datetime.now(), ssc.get_system_time())
+    lg.info('The time for the remote system %s is off from local system time by %.2f seconds.', stm.nickname,
+            drift_secs)
+    if abs(drift_secs) > 10:
+        ssc.nudge_system_time('+' if drift_secs < 0 else '-')
+    metrics['clock_drift_secs'] = drift_secs
+
+    for service in status.stopped_services():
+        lg.warning('Service %s on %s is %s.', service, stm.nickname, status.services[service])
+    return metrics
+
+
+def check_web_servers(stm, reachability: FleetReachability = None):
+    """Check the CheckServers for the system, those whose port did not answer the sweep are marked down right away.
+
+    :param stm: SystemModel
+    :param reachability: FleetReachability, from the sweep at the start of the cycle.
+    :return: dict, {CheckServer.id: bool server is up}
+    """
+
+    results = {}
+    for chk_svr in stm.check_servers:
+        if chk_svr.status_condition_type != 'status_code':
+            continue
+        server_address = f'http://{stm.web_address}:{chk_svr.port}/{chk_svr.address_suffix}'
+        if reachability is not None and not reachability.port_up(stm.web_address, chk_svr.port, stm.id):
+            # the sweep already raised the alert for the root cause
+            lg.info('Server %s %s', server_address,
+                    'unreachable (parent down)'
+                    if reachability.behind_down_parent(stm.web_address, chk_svr.port, stm.id) else 'port not reachable')
+            results[chk_svr.id] = False
+            continue
+        try:
+            response = requests.get(server_address, timeout=5)
+            results[chk_svr.id] = response.status_code == chk_svr.status_condition_value_data['status_code']
+            if results[chk_svr.id]:
+                lg.info('Server active at: %s', server_address)
+            else:
+                lg.warning('Server failure %s at %s', response.status_code, server_address)
+        except requests.exceptions.ReadTimeout:
+            lg.warning('Server timeout at %s', server_address)
+            results[chk_svr.id] = False
+        except requests.exceptions.ConnectionError as cerr:
+            lg.warning('Server connection failure: %s', cerr)
+            results[chk_svr.id] = False
+    return results
+
+
+def check_system(stm, drive_check_table: dict, reachability: FleetReachability = None, retry=2,
+                 pool: ConnectionPool = None):
+    """Run the SSH checks and then the web server checks for a system.
+
+    :param stm: SystemModel
+    :param drive_check_table: dict, {system id: drive check settings}, systems without an entry only get the web
+        server checks.
+    :param reachability: FleetReachability, hosts that did not answer on port 22 are skipped.
+    :param retry: int, the number of times to retry the SSH connection.
+    :param pool: ConnectionPool, to reuse the SSH connection from the last cycle, or None to connect and close.
+    :return: tuple, (dict {metric name: value} of the metrics measured, dict {CheckServer.id: bool server is up})
+    """
+
+    metrics = {}
+    drive_check = drive_check_table.get(stm.id)
+    if drive_check is None:
+        lg.warning('System %s has no drive_check_table entry, skipping the SSH checks.', stm.nickname)
+        return metrics, check_web_servers(stm, reachability)
+    if reachability is not None and not reachability.host_up(stm.web_address, stm.id):
+        # the sweep already raised the alert for the root cause
+        lg.info('System %s (%s) is %s, skipping the SSH checks.', stm.nickname, stm.web_address,
+                'unreachable (parent down)' if reachability.behind_down_parent(stm.web_address, system_id=stm.id)
+                else 'down')
+        return metrics, check_web_servers(stm, reachability)
+
+    try:
+        with pool.connection(stm, retry) if pool is not None else SystemConnection(stm, retry=retry) as ssc:
+            collector_metrics = check_collector(stm, ssc, drive_check) if drive_check.get('collector') else None
+            if collector_metrics is not None:
+                metrics.update(collector_metrics)
+            else:
+                metrics['free_space_bytes'] = check_drive_space(stm, ssc, drive_check)
+                metrics['clock_drift_secs'], system_up_time = check_clock(stm, ssc)
+                metrics['uptime_secs'] = system_up_time.total_seconds()
+    except paramiko.BadHostKeyException as key_err:
+        lg.error('HOST KEY CHANGED: System %s (%s) presented the %s key %s instead of the known %s, not connecting. If '
+                 'the host was re-imaged, remove it from %s.', stm.nickname, key_err.hostname, key_err.key.get_name(),
+                 key_err.key.fingerprint, key_err.expected_key.fingerprint, default_store().known_hosts_path)
+    except AttributeError as atter:
+        if '''NoneType' object has no attribute 'open_session''' in str(atter):
+            lg.warning('''Couldn't connect to %s''', stm.hostname)
+        else:
+            raise atter
+    return metrics, check_web_servers(stm, reachability)
+
+
+def record_availability(timeline: AvailabilityTimeline, stm, reachability: FleetReachability, web_results: dict,
+                        ts: float = None):
+    """Add the host and CheckServer statuses from a cycle to the availability timeline.
+
+    :param timeline: AvailabilityTimeline
+    :param stm: SystemModel
+    :param reachability: FleetReachability, from the sweep at the start of the cycle.
+    :param web_results: dict, {CheckServer.id: bool server is up} from check_web_servers.
+    :param ts: float, epoch seconds, defaults to now.
+    """
+
+    ts = time.time() if ts is None else ts
+    if reachability.host_up(stm.web_address, stm.id):
+        host_status = UP
+    else:
+        host_status = PARENT_DOWN if reachability.behind_down_parent(stm.web_address, system_id=stm.id) else DOWN
+    timeline.record(host_key(stm.id), host_status, ts)
+
+    ports = {chk_svr.id: chk_svr.port for chk_svr in stm.check_servers}
+    for chk_svr_id, server_up in web_results.items():
+        if server_up:
+            status = UP
+        else:
+            behind = reachability.behind_down_parent(stm.web_address, ports.get(chk_svr_id), stm.id)
+            status = PARENT_DOWN if behind else DOWN
+        timeline.record(check_key(chk_svr_id), status, ts)
+
+
+def poll_cycle(systems, drive_check_table: dict, sweep_timeout: float = 1.5, ingest: MetricIngest = None,
+               scheduler: AdaptiveScheduler = None, uplink_devices: dict = None, system_uplinks: dict = None,
+               timeline: AvailabilityTimeline = None, pool: ConnectionPool = None):
+    """Run one cycle of checks over the systems, sweeping the fleet for reachability first.
+
+    The sweep follows the dependencies, so the hosts behind a down uplink device and the CheckServers on a down host
+    are skipped. An error checking a system is logged against it and the cycle goes on with the next one, the failed
+    attempt is still recorded so the system backs off instead of staying the most overdue.
+
+    :param systems: list of SystemModel
+    :param drive_check_table: dict, {system id: drive check settings}
+    :param sweep_timeout: float, seconds to wait for each batch of the TCP reachability sweep.
+    :param ingest: MetricIngest, to historize the metrics measured, or None.
+    :param scheduler: AdaptiveScheduler, to update with the metrics measured, or None.
+    :param uplink_devices: dict, the network devices the hosts depend on, see DependencyGraph.for_fleet.
+    :param system_uplinks: dict, {system id: uplink device name}
+    :param timeline: AvailabilityTimeline, to add the host and CheckServer statuses to, or None.
+    :param pool: ConnectionPool, to keep the SSH connections open between cycles, or None.
+    :return: FleetReachability
+    """
+
+    systems = list(systems)
+    reachability = sweep_fleet(systems, uplink_devices, system_uplinks, timeout=sweep_timeout)
+    for stm in systems:
+        try:
+            metrics, web_results = check_system(stm, drive_check_table, reachability, pool=pool)
+        except Exception as system_err:  # one host failing must not stop the others from being polled
+            lg.error('Could not check system %s: %s', stm.nickname, exception_one_line(system_err))
+            metrics, web_results = {}, {}
+        if timeline is not None:
+            record_availability(timeline, stm, reachability, web_results)
+        if ingest is not None:
+            ingest.record(stm.id, metrics)
+        if scheduler is not None:
+            scheduler.record(stm.id, metrics)
+    return reachability
+
+
+def poll_adaptively(systems, drive_check_table: dict, scheduler: AdaptiveScheduler, ingest: MetricIngest = None,
+                    stop_event: threading.Event = None, uplink_devices: dict = None, system_uplinks: dict = None,
+                    timeline: AvailabilityTimeline = None, on_cycle=None, pool: ConnectionPool = None,
+                    on_wake=None, max_sleep_secs: float = None):
+    """Keep polling the systems as they come due on their adaptive intervals.
+
+    :param systems: list of SystemModel
+    :param drive_check_table: dict, {system id: drive check settings}
+    :param scheduler: AdaptiveScheduler
+    :param ingest: MetricIngest, to historize the metrics measured, or None.
+    :param stop_event: threading.Event, set it to stop polling.
+    :param uplink_devices: dict, the network devices the hosts depend on, see DependencyGraph.for_fleet.
+    :param system_uplinks: dict, {system id: uplink device name}
+    :param timeline: AvailabilityTimeline, to add the host and CheckServer statuses to, or None.
+    :param on_cycle: callable, called with no arguments after each cycle, e.g. to save the timeline.
+    :param pool: ConnectionPool, to keep the SSH connections open between cycles, or None.
+    :param on_wake: callable, called with no arguments each time before the due systems are found, e.g. to apply
+        configuration changes to the systems list.
+    :param max_sleep_secs: float, the longest to wait between calls to on_wake, or None to wait until the next system
+        is due.
+    """
+
+    stop_event = threading.Event() if stop_event is None else stop_event
+    while not stop_event.is_set():
+        if on_wake is not None:
+            on_wake()
+        due_systems = scheduler.due(systems)
+        if due_systems:
+            try:
+                poll_cycle(due_systems, drive_check_table, ingest=ingest, scheduler=scheduler,
+                           uplink_devices=uplink_devices, system_uplinks=system_uplinks, timeline=timeline, pool=pool)
+            except Exception as cycle_err:  # keep polling, the next cycle may work
+                lg.error('Poll cycle failed: %s', exception_one_line(cycle_err))
+            if on_cycle is not None:
+                on_cycle()
+        sleep_secs = max(scheduler.next_wakeup() - time.time(), 1.0)
+        stop_event.wait(sleep_secs if max_sleep_secs is None else min(sleep_secs, max_sleep_secs))
@@ -0,0 +1,225 @@
+"""Adaptive polling intervals for each host, driven by how fast its metrics are changing.
+
+A host whose drive is filling toward its alert_low_bytes, or whose clock drift is growing toward the point where it
+gets nudged, is polled more often so there are several polls before the limit is crossed. A host whose values stay
+flat is polled less and less often. Each host's interval stays within its min and max bounds, and a global budget
+limits how many SSH sessions are started per minute.
+
+The bounds can be set per host in the drive_check_table entry with 'min_interval_secs' and 'max_interval_secs'.
+"""
+import collections
+import math
+import time
+from typing import Dict, Union
+
+from log_setup import lg
+
+DEFAULT_MIN_INTERVAL = 60.0
+DEFAULT_MAX_INTERVAL = 3600.0
+DEFAULT_SESSIONS_PER_MINUTE = 30
+BACKOFF_FACTOR = 1.5  # how much the interval grows each poll while values are flat
+POLLS_BEFORE_LIMIT = 10  # how many polls there should be before a limit is reached at the current rate
+DRIFT_LIMIT_SECS = 10.0  # the clock is nudged past this, see poller.check_clock
+VELOCITY_SAMPLES = 8
+
+
+class MetricVelocity:
+    """The recent samples of a metric and their rate of change."""
+
+    def __init__(self, max_samples: int = VELOCITY_SAMPLES):
+        self.samples = collections.deque(maxlen=max_samples)
+
+    def add(self, ts: float, value: float):
+        self.samples.append((ts, value))
+
+    @property
+    def latest(self) -> Union[float, None]:
+        return self.samples[-1][1] if self.samples else None
+
+    def slope(self) -> Union[float, None]:
+        """Get the least squares rate of change per second, None until there are two samples."""
+
+        if len(self.samples) < 2:
+            return None
+        mean_ts = sum(ts for ts, _ in self.samples) / len(self.samples)
+        mean_value = sum(value for _, value in self.samples) / len(self.samples)
+        ts_variance = sum((ts - mean_ts) ** 2 for ts, _ in self.samples)
+        if ts_variance == 0:
+            return None
+        return sum((ts - mean_ts) * (value - mean_value) for ts, value in self.samples) / ts_variance
+
+
+def seconds_to_limit(current: float, slope: float, limit: float) -> float:
+    """Get the seconds until the value moving at the slope crosses the limit, inf if it is moving away from it."""
+
+    if slope is None or slope == 0:
+        return math.inf
+    remaining = (limit - current) / slope
+    return remaining if remaining >= 0 else math.inf
+
+
+class HostInterval:
+    """The adaptive polling interval for a host.
+
+    :param min_interval: float, seconds.
+    :param max_interval: float, seconds.
+    """
+
+    def __init__(self, min_interval: float = DEFAULT_MIN_INTERVAL, max_interval: float = DEFAULT_MAX_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.next_due = 0.0  # due right away
+        self.velocities: Dict[str, MetricVelocity] = collections.defaultdict(MetricVelocity)
+
+    def urgent_interval(self, alert_low_bytes: float = None) -> float:
+        """Get the interval that leaves POLLS_BEFORE_LIMIT polls before a limit is reached, inf if none is near."""
+
+        seconds_left = math.inf
+        free_space = self.velocities.get('free_space_bytes')
+        if free_space is not None and free_space.latest is not None and alert_low_bytes is not None:
+            if free_space.latest <= alert_low_bytes:
+                seconds_left = 0.0
+            else:
+                seconds_left = seconds_to_limit(free_space.latest, free_space.slope(), alert_low_bytes)
+
+        drift = self.velocities.get('clock_drift_secs')
+        if drift is not None and drift.latest is not None:
+            if abs(drift.latest) >= DRIFT_LIMIT_SECS:
+                seconds_left = 0.0
+            else:
+                # the rate the drift is moving away from zero, in either direction
+                drift_slope = drift.slope()
+                away_slope = None if drift_slope is None else drift_slope * (1 if drift.latest >= 0 else -1)
+                seconds_left = min(seconds_left, seconds_to_limit(abs(drift.latest), away_slope, DRIFT_LIMIT_SECS))
+
+        return seconds_left / POLLS_BEFORE_LIMIT
+
+    def record(self, metrics: dict, ts: float, alert_low_bytes: float = None) -> float:
+        """Add the metrics from a poll and work out the interval to the next poll.
+
+        :param metrics: dict, {metric name: value}, empty if the host could not be polled.
+        :param ts: float, epoch seconds of the poll.
+        :param alert_low_bytes: float, the free space warning limit for the host.
+        :return: float, the new interval in seconds.
+        """
+
+        for metric, value in metrics.items():
+            if value is not None:
+                self.velocities[metric].add(ts, float(value))
+
+        if metrics:
+            new_interval = min(self.urgent_interval(alert_low_bytes), self.interval * BACKOFF_FACTOR)
+            self.interval = min(max(new_interval, self.min_interval), self.max_interval)
+        self.next_due = ts + self.interval
+        return self.interval
+
+
+class SessionBudget:
+    """Limits the number of SSH sessions started in any minute.
+
+    :param sessions_per_minute: int
+    """
+
+    def __init__(self, sessions_per_minute: int = DEFAULT_SESSIONS_PER_MINUTE):
+        self.sessions_per_minute = sessions_per_minute
+        self._started = collections.deque()
+
+    def _expire(self, now: float):
+        while self._started and now - self._started[0] >= 60:
+            self._started.popleft()
+
+    def try_acquire(self, now: float = None) -> bool:
+        """Take a session from the budget, returns False if the budget for the last minute is spent."""
+
+        now = time.time() if now is None else now
+        self._expire(now)
+        if len(self._started) >= self.sessions_per_minute:
+            return False
+        self._started.append(now)
+        return True
+
+    def next_available(self, now: float) -> float:
+        """Get when the next session will be in the budget."""
+
+        self._expire(now)
+        if len(self._started) < self.sessions_per_minute:
+            return now
+        return self._started[0] + 60
+
+
+class AdaptiveScheduler:
+    """Decides which hosts are due to be polled.
+
+    :param drive_check_table: dict, {system id: drive check settings}, also has the optional interval bounds.
+    :param sessions_per_minute: int, the global budget of SSH sessions.
+    """
+
+    def __init__(self, drive_check_table: dict, sessions_per_minute: int = DEFAULT_SESSIONS_PER_MINUTE):
+        self.drive_check_table = drive_check_table
+        self.budget = SessionBudget(sessions_per_minute)
+        self.hosts: Dict[int, HostInterval] = {}
+
+    def host(self, system_id: int) -> HostInterval:
+        host_interval = self.hosts.get(system_id)
+        if host_interval is None:
+            drive_check = self.drive_check_table.get(system_id, {})
+            host_interval = self.hosts[system_id] = HostInterval(
+                drive_check.get('min_interval_secs', DEFAULT_MIN_INTERVAL),
+                drive_check.get('max_interval_secs', DEFAULT_MAX_INTERVAL))
+        return host_interval
+
+    def due(self, systems, now: float = None) -> list:
+        """Get the systems due to be polled, the most overdue (relative to their interval) first.
+
+        Systems that are due but don't fit in the session budget wait for the next call.
+
+        :param systems: iterable of SystemModel
+        :param now: float, epoch seconds.
+        :return: list of SystemModel
+        """
+
+        now = time.time() if now is None else now
+        overdue = [(stm, (now - self.host(stm.id).next_due) / self.host(stm.id).interval) for stm in systems
+                   if self.host(stm.id).next_due <= now]
+        overdue.sort(key=lambda stm_lateness: stm_lateness[1], reverse=True)
+        due_systems = []
+        for stm, _ in overdue:
+            if not self.budget.try_acquire(now):
+                lg.debug('The session budget is spent, %s systems will wait.', len(overdue) - len(due_systems))
+                break
+            due_systems.append(stm)
+        return due_systems
+
+    def record(self, system_id: int, metrics: dict, now: float = None):
+        """Update the system's interval from the metrics it was just polled for."""
+
+        now = time.time() if now is None else now
+        alert_low_bytes = self.drive_check_table.get(system_id, {}).get('alert_low_bytes', [None])[0]
+        interval = self.host(system_id).record(metrics, now, alert_low_bytes)
+        lg.debug('System %s will be polled again in %.0f seconds.', system_id, interval)
+
+    def next_wakeup(self, now: float = None) -> float:
+        """Get when the next system will be due (and fit in the budget)."""
+
+        now = time.time() if now is None else now
+        next_due = min((host_interval.next_due for host_interval in self.hosts.values()), default=now)
+        return max(next_due, self.budget.next_available(now))
+
+    def refresh_bounds(self, system_id: int):
+        """Apply changed interval bounds from the drive_check_table, keeping what was learned about the system."""
+
+        host_interval = self.hosts.get(system_id)
+        if host_interval is None:
+            return
+        drive_check = self.drive_check_table.get(system_id, {})
+        host_interval.min_interval = drive_check.get('min_interval_secs', DEFAULT_MIN_INTERVAL)
+        host_interval.max_interval = drive_check.get('max_interval_secs', DEFAULT_MAX_INTERVAL)
+        new_interval = min(max(host_interval.interval, host_interval.min_interval), host_interval.max_interval)
+        host_interval.next_due += new_interval - host_interval.interval
+        host_interval.interval = new_interval
+
+    def forget(self, system_id: int):
+        """Drop the system, when it is removed from the fleet."""
+
+        self.hosts.pop(system_id, None)
@@ -0,0 +1,73 @@
+import unittest
+
+from monitors.scheduling.adaptive import AdaptiveScheduler, HostInterval, SessionBudget
+
+GB = 1_000_000_000
+
+
+class System:
+    def __init__(self, id_):
+        self.id = id_
+
+
+class TestHostInterval(unittest.TestCase):
+    def test_flat_backs_off_to_max(self):
+        host = HostInterval(min_interval=60, max_interval=600)
+        ts = 0
+        for _ in range(20):
+            ts += host.interval
+            host.record({'free_space_bytes': 50 * GB, 'clock_drift_secs': 0.1}, ts, alert_low_bytes=10 * GB)
+        self.assertEqual(host.interval, 600)
+
+    def test_filling_drive_shortens(self):
+        host = HostInterval(min_interval=60, max_interval=3600)
+        host.interval = 3600
+        free = 20 * GB
+        for ts in range(0, 4 * 3600, 3600):
+            host.record({'free_space_bytes': free}, ts, alert_low_bytes=10 * GB)
+            free -= 2 * GB  # the alert limit is ~5 hours away
+        self.assertLess(host.interval, 3600)
+        self.assertGreaterEqual(host.interval, 60)
+
+    def test_growing_drift_shortens(self):
+        host = HostInterval(min_interval=30, max_interval=3600)
+        host.interval = 3600
+        for ts, drift in ((0, -1.0), (600, -3.0), (1200, -5.0)):
+            host.record({'clock_drift_secs': drift}, ts)
+        self.assertLess(host.interval, 600)
+
+    def test_no_metrics_keeps_interval(self):
+        host = HostInterval(min_interval=60, max_interval=3600)
+        host.interval = 120
+        self.assertEqual(host.record({}, 1000), 120)
+        self.assertEqual(host.next_due, 1120)
+
+
+class TestBudget(unittest.TestCase):
+    def test_budget(self):
+        budget = SessionBudget(sessions_per_minute=2)
+        self.assertTrue(budget.try_acquire(0))
+        self.assertTrue(budget.try_acquire(10))
+        self.assertFalse(budget.try_acquire(20))
+        self.assertEqual(budget.next_available(20), 60)
+        self.assertTrue(budget.try_acquire(60))
+
+    def test_scheduler_respects_budget(self):
+        scheduler = AdaptiveScheduler({}, sessions_per_minute=3)
+        systems = [System(n) for n in range(5)]
+        self.assertEqual(len(scheduler.due(systems, now=0)), 3)
+        self.assertEqual(scheduler.next_wakeup(now=1), 60)  # two are still due, waiting on the budget
+        self.assertEqual(len(scheduler.due(systems, now=1)), 0)
+        self.assertEqual(len(scheduler.due(systems, now=60)), 3)
+
+    def test_refresh_bounds_keeps_timing(self):
+        table = {1: dict(alert_low_bytes=[0], min_interval_secs=60, max_interval_secs=3600)}
+        scheduler = AdaptiveScheduler(table)
+        scheduler.host(1).interval, scheduler.host(1).next_due = 1800, 2800
+        table[1] = dict(alert_low_bytes=[0], min_interval_secs=60, max_interval_secs=600)
+        scheduler.refresh_bounds(1)
+        self.assertEqual((scheduler.host(1).interval, scheduler.host(1).next_due), (600, 1600))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+"""Dependencies between the things that are probed, so a down switch or host doesn't cost a timeout for everything
+behind it.
+
+A host depends on its uplink device (a switch, router, etc.), devices can depend on other devices, and a CheckServer
+depends on its host being reachable. A host is reachable if any of its ports answers (SSH or a CheckServer port), so
+an sshd outage doesn't hide the web servers that are still up. The probes are run in topological order, each batch of
+nodes whose parents are known at the same time, and the children of a node that is down are not probed but marked
+unreachable (parent down). One root cause alert is logged for each down node whose parents are up.
+
+The nodes are keyed by system id, not address, so systems sharing an address each get their own status, e.g. when
+they sit behind different uplink devices. An address and port is probed once however many nodes share it.
+
+The devices and which systems they uplink are optional configuration in untracked_config.system_dicts:
+    uplink_devices = {'line1_switch': {'address': '10.1.1.2', 'port': 22, 'parent': 'core_switch'},
+                      'core_switch': {'address': '10.1.0.1', 'port': 443}}
+    system_uplinks = {system_id: 'line1_switch'}
+"""
+import graphlib
+from typing import Dict, Hashable, Iterable, Tuple, Union
+
+from log_setup import lg
+from monitors.server_status.reachability import FleetReachability, SSH_PORT, sweep
+
+UP, DOWN, PARENT_DOWN = 'up', 'down', 'unreachable (parent down)'
+
+
+def probe_ports(probe: Tuple[str, Union[int, Iterable[int]]]) -> Tuple[int, ...]:
+    """Get the ports of a probe, which has a single port or several."""
+
+    return (probe[1],) if isinstance(probe[1], int) else tuple(probe[1])
+
+
+class DependencyGraph:
+    """The probe for each node and the node it depends on."""
+
+    def __init__(self):
+        self.parents: Dict[Hashable, Union[Hashable, None]] = {}
+        self.probes: Dict[Hashable, Union[Tuple[str, Union[int, Tuple[int, ...]]], None]] = {}
+        self.port_results: Dict[Tuple[str, int], bool] = {}  # from the last sweep
+
+    def add(self, node: Hashable, probe: Union[Tuple[str, Union[int, Tuple[int, ...]]], None], parent: Hashable = None):
+        """Add a node.
+
+        :param node: hashable, the node key.
+        :param probe: tuple, the (address, port) to try a TCP connection to, or (address, tuple of ports) for a node
+            that is up if any of them answers, or None to take the parent's status.
+        :param parent: hashable, the node this one depends on, or None.
+        """
+
+        self.parents[node] = parent
+        self.probes[node] = probe
+
+    @classmethod
+    def for_fleet(cls, systems, uplink_devices: dict = None, system_uplinks: dict = None):
+        """Build the graph of uplink devices, hosts, and CheckServers.
+
+        :param systems: iterable of SystemModel
+        :param uplink_devices: dict, {device name: {'address': str, 'port': int, 'parent': device name or None}}
+        :param system_uplinks: dict, {system id: device name}
+        :return: DependencyGraph
+        """
+
+        graph = cls()
+        uplink_devices = uplink_devices or {}
+        system_uplinks = system_uplinks or {}
+        for name, device in uplink_devices.items():
+            parent = device.get('parent')
+            graph.add(('device', name), (device['address'], int(device.get('port', SSH_PORT))),
+                      ('device', parent) if parent else None)
+
+        for stm in systems:
+            uplink = system_uplinks.get(stm.id)
+            if uplink is not None and uplink not in uplink_devices:
+                lg.warning('System %s has an unknown uplink device %s, it is ignored.', stm.nickname, uplink)
+                uplink = None
+            check_probes = {}
+            for chk_svr in stm.check_servers:
+                try:
+                    check_probes[chk_svr.id] = (stm.web_address, int(chk_svr.port))
+                except (TypeError, ValueError):
+                    check_probes[chk_svr.id] = None  # left for the HTTP check to report
+            host_ports = [SSH_PORT] + [probe[1] for probe in check_probes.values() if probe and probe[1] != SSH_PORT]
+            graph.add(('host', stm.id), (stm.web_address, tuple(dict.fromkeys(host_ports))),
+                      ('device', uplink) if uplink else None)
+            for chk_svr_id, probe in check_probes.items():
+                graph.add(('check', chk_svr_id), probe, ('host', stm.id))
+        return graph
+
+    def sorter(self) -> graphlib.TopologicalSorter:
+        sorter = graphlib.TopologicalSorter()
+        for node, parent in self.parents.items():
+            if parent is not None and parent not in self.parents:
+                raise ValueError(f'{node} depends on {parent} which is not in the graph.')
+            sorter.add(node, *([parent] if parent is not None else []))
+        return sorter
+
+    def sweep(self, timeout: float = 1.5) -> Dict[Hashable, str]:
+        """Probe the nodes in dependency order, skipping the children of nodes that are down.
+
+        :param timeout: float, seconds to wait for each batch of TCP connections.
+        :return: dict, {node: UP, DOWN, or PARENT_DOWN}
+        """
+
+        statuses = {}
+        self.port_results = {}
+        sorter = self.sorter()
+        sorter.prepare()  # raises graphlib.CycleError for circular dependencies
+        while sorter.is_active():
+            ready = sorter.get_ready()
+            to_probe = {}
+            for node in ready:
+                parent = self.parents[node]
+                if parent is not None and statuses[parent] != UP:
+                    statuses[node] = PARENT_DOWN
+                elif self.probes[node] is None:
+                    statuses[node] = UP
+                else:
+                    to_probe[node] = self.probes[node]
+
+            targets = {}
+            for probe in to_probe.values():
+                for port in probe_ports(probe):
+                    if (probe[0], port) not in self.port_results:  # e.g. a CheckServer port probed with its host
+                        targets.setdefault(probe[0], set()).add(port)
+            if targets:
+                self.port_results.update(sweep(targets, timeout))
+            for node, probe in to_probe.items():
+                port_up = any(self.port_results[(probe[0], port)] for port in probe_ports(probe))
+                statuses[node] = UP if port_up else DOWN
+            sorter.done(*ready)
+        return statuses
+
+    def root_causes(self, statuses: Dict[Hashable, str]) -> Dict[Hashable, int]:
+        """Get the down nodes that are the root cause of an outage and how many nodes are unreachable behind each.
+
+        :param statuses: dict, from sweep.
+        :return: dict, {down node: number of nodes marked PARENT_DOWN because of it}
+        """
+
+        causes = {node: 0 for node, status in statuses.items() if status == DOWN}
+        for node, status in statuses.items():
+            if status != PARENT_DOWN:
+                continue
+            root = self.parents[node]
+            while statuses[root] == PARENT_DOWN:
+                root = self.parents[root]
+            causes[root] += 1
+        return causes
+
+
+def sweep_fleet(systems, uplink_devices: dict = None, system_uplinks: dict = None,
+                timeout: float = 1.5) -> FleetReachability:
+    """Sweep the fleet in dependency order and log one alert for each root cause.
+
+    :param systems: iterable of SystemModel
+    :param uplink_devices: dict, see DependencyGraph.for_fleet.
+    :param system_uplinks: dict, see DependencyGraph.for_fleet.
+    :param timeout: float, seconds to wait for each batch of TCP connections.
+    :return: FleetReachability, by system and by address, with the ports behind a down parent marked as parent down.
+    """
+
+    graph = DependencyGraph.for_fleet(systems, uplink_devices, system_uplinks)
+    statuses = graph.sweep(timeout)
+
+    for (kind, key), suppressed in graph.root_causes(statuses).items():
+        probe = graph.probes[(kind, key)]
+        ports = ','.join(map(str, probe_ports(probe)))
+        if suppressed:
+            lg.warning('ROOT CAUSE: %s %s (%s:%s) is down, %s dependent probes were skipped as unreachable.',
+                       kind, key, probe[0], ports, suppressed)
+        else:
+            lg.warning('%s %s (%s:%s) is down.', kind, key, probe[0], ports)
+
+    results, parent_down = {}, set()
+    system_results, system_parent_down = {}, set()
+    for node, status in statuses.items():
+        probe = graph.probes[node]
+        if probe is None or node[0] == 'device':
+            continue
+        system_id = node[1] if node[0] == 'host' else graph.parents[node][1]
+        for port in probe_ports(probe):
+            address_port, system_port = (probe[0], port), (system_id, port)
+            if status == PARENT_DOWN:
+                results.setdefault(address_port, False)
+                parent_down.add(address_port)
+                system_results[system_port] = False
+                system_parent_down.add(system_port)
+            else:
+                # each port of an up host is up or down on its own, e.g. the SSH port can be down while the web
+                # servers answer
+                results[address_port] = system_results[system_port] = graph.port_results[address_port]
+    return FleetReachability(results, parent_down, system_results, system_parent_down)
@@ -0,0 +1,209 @@
+"""Fast TCP reachability sweep of the whole fleet, used to skip dead hosts before the slow SSH and HTTP checks.
+
+All of the connection attempts are started at once using non-blocking sockets and are then waited on together with a
+selector, so a sweep takes about as long as the slowest single attempt (bounded by the timeout) instead of the sum of
+the paramiko connect timeouts. Each address is resolved once, the name lookups are also run at the same time.
+"""
+import concurrent.futures
+import errno
+import selectors
+import socket
+import time
+from typing import Dict, Iterable, Tuple
+
+from log_setup import lg
+
+SSH_PORT = 22
+
+
+def fleet_targets(systems: Iterable) -> Dict[str, set]:
+    """Get the {address: {port, ...}} to sweep for the systems, port 22 plus the port for each CheckServer.
+
+    :param systems: iterable of SystemModel (or anything with web_address and check_servers).
+    :return: dict
+    """
+
+    targets = {}
+    for stm in systems:
+        ports = targets.setdefault(stm.web_address, set())
+        ports.add(SSH_PORT)
+        for chk_svr in stm.check_servers:
+            try:
+                ports.add(int(chk_svr.port))
+            except (TypeError, ValueError):
+                lg.warning('CheckServer %s has an invalid port "%s", it will not be swept.', chk_svr.id, chk_svr.port)
+    return targets
+
+
+MAX_RESOLVER_THREADS = 32
+LOOKUP_POLL_SECS = 0.02  # how often to check for finished name lookups while waiting on the connections
+
+
+def _resolve(address: str):
+    """Get the (family, type, proto, sockaddr) for the address, or None if it can't be resolved.
+
+    The port in the sockaddr is set when connecting.
+    """
+
+    try:
+        family, sock_type, proto, _, sock_address = socket.getaddrinfo(address, None, type=socket.SOCK_STREAM)[0]
+    except (socket.gaierror, UnicodeError) as gai_err:
+        lg.debug('Could not resolve %s: %s', address, gai_err)
+        return None
+    return family, sock_type, proto, sock_address
+
+
+def start_resolving(addresses: Iterable[str], executor: concurrent.futures.Executor):
+    """Resolve each address once, IP addresses right away and the names in the executor since getaddrinfo blocks.
+
+    :param addresses: iterable of str
+    :param executor: concurrent.futures.Executor, to look up the names in.
+    :return: tuple, (dict {address: (family, type, proto, sockaddr)} of the IP addresses, dict {future: name} of the
+        lookups started, each future's result is the same tuple or None)
+    """
+
+    resolved, lookups = {}, {}
+    for address in set(addresses):
+        try:
+            family, sock_type, proto, _, sock_address = socket.getaddrinfo(
+                address, None, type=socket.SOCK_STREAM, flags=socket.AI_NUMERICHOST)[0]
+            resolved[address] = family, sock_type, proto, sock_address
+        except (socket.gaierror, UnicodeError):
+            lookups[executor.submit(_resolve, address)] = address
+    return resolved, lookups
+
+
+def _start_connect(resolved: tuple, port: int):
+    """Start a non-blocking connection to a resolved address, returns the socket or None if it failed immediately."""
+
+    family, sock_type, proto, sock_address = resolved
+    sock = socket.socket(family, sock_type, proto)
+    sock.setblocking(False)
+    err = sock.connect_ex((sock_address[0], port) + tuple(sock_address[2:]))
+    if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, getattr(errno, 'WSAEWOULDBLOCK', -1)):
+        sock.close()
+        return None
+    return sock
+
+
+def sweep(targets: Dict[str, Iterable[int]], timeout: float = 1.5) -> Dict[Tuple[str, int], bool]:
+    """Try a TCP connection to every (address, port) at the same time.
+
+    :param targets: dict, {address: iterable of ports}.
+    :param timeout: float, seconds to wait for the name lookups and all the connections before calling the rest
+        unreachable.
+    :return: dict, {(address, port): bool reachable}
+    """
+
+    deadline = time.monotonic() + timeout
+    ports = {}
+    for address, address_ports in targets.items():
+        ports.setdefault(address, set()).update(int(port) for port in address_ports)
+    results = {(address, port): False for address, address_ports in ports.items() for port in address_ports}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_RESOLVER_THREADS)
+    selector = selectors.DefaultSelector()
+
+    def start_connects(address, resolved_address):
+        for port in ports[address]:
+            sock = _start_connect(resolved_address, port)
+            if sock is not None:
+                selector.register(sock, selectors.EVENT_WRITE, (address, port))
+
+    try:
+        resolved, lookups = start_resolving(ports, executor)
+        for address, resolved_address in resolved.items():
+            start_connects(address, resolved_address)
+
+        # the connections to each name are started as soon as its lookup finishes
+        while selector.get_map() or lookups:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for future in [future for future in lookups if future.done()]:
+                address = lookups.pop(future)
+                if future.result() is not None:
+                    start_connects(address, future.result())
+            wait_secs = min(remaining, LOOKUP_POLL_SECS) if lookups else remaining
+            if not selector.get_map():
+                concurrent.futures.wait(lookups, wait_secs, concurrent.futures.FIRST_COMPLETED)
+                continue
+            for key, _ in selector.select(wait_secs):
+                sock = key.fileobj
+                # writable means the connect finished, SO_ERROR says whether it worked
+                results[key.data] = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+                selector.unregister(sock)
+                sock.close()
+        if lookups:
+            lg.debug('Name lookups timed out for %s.', sorted(lookups.values()))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)  # a hung lookup must not hold up the sweep
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+
+    return results
+
+
+class FleetReachability:
+    """The result of a sweep, answers whether a host or one of its ports can be reached.
+
+    :param results: dict, {(address, port): bool reachable}
+    :param parent_down: set, of the (address, port) that were not probed because something they depend on is down.
+    :param system_results: dict, {(system id, port): bool reachable}, for systems that share an address but not
+        their dependencies, they take precedence over the address results when a system id is given.
+    :param system_parent_down: set, of the (system id, port) that were not probed because of a down parent.
+    """
+
+    def __init__(self, results: Dict[Tuple[str, int], bool], parent_down: set = None,
+                 system_results: Dict[Tuple[int, int], bool] = None, system_parent_down: set = None):
+        self.results = results
+        self.parent_down = parent_down or set()
+        self.system_results = system_results or {}
+        self.system_parent_down = system_parent_down or set()
+
+    @classmethod
+    def sweep_systems(cls, systems: Iterable, timeout: float = 1.5):
+        """Sweep port 22 and all CheckServer ports for the systems.
+
+        :param systems: iterable of SystemModel
+        :param timeout: float, seconds.
+        :return: FleetReachability
+        """
+
+        start = time.monotonic()
+        reach = cls(sweep(fleet_targets(systems), timeout))
+        lg.debug('Reachability sweep of %s ports took %.3f seconds, %s unreachable.',
+                 len(reach.results), time.monotonic() - start, len(reach.unreachable()))
+        return reach
+
+    def port_up(self, address: str, port, system_id: int = None) -> bool:
+        """Whether the port answered, ports that were not swept are assumed up so they still get checked."""
+
+        try:
+            port = int(port)
+        except (TypeError, ValueError):
+            return True
+        if (system_id, port) in self.system_results:
+            return self.system_results[(system_id, port)]
+        return self.results.get((address, port), True)
+
+    def host_up(self, address: str, system_id: int = None) -> bool:
+        """Whether the host answered on the SSH port."""
+
+        return self.port_up(address, SSH_PORT, system_id)
+
+    def behind_down_parent(self, address: str, port=SSH_PORT, system_id: int = None) -> bool:
+        """Whether the port was skipped because something it depends on is down (its root cause is already logged)."""
+
+        try:
+            port = int(port)
+        except (TypeError, ValueError):
+            return False
+        if (system_id, port) in self.system_results:
+            return (system_id, port) in self.system_parent_down
+        return (address, port) in self.parent_down
+
+    def unreachable(self):
+        """Get a list of the (address, port) that did not answer."""
+
+        return [address_port for address_port, is_up in self.results.items() if not is_up]
@@ -0,0 +1,116 @@
+import socket
+import unittest
+
+import mock
+
+from monitors.server_status.dependency_graph import DependencyGraph, DOWN, PARENT_DOWN, sweep_fleet, UP
+
+
+class CheckServer:
+    def __init__(self, id_, port):
+        self.id = id_
+        self.port = port
+
+
+class System:
+    def __init__(self, id_, web_address, check_servers=()):
+        self.id = id_
+        self.nickname = f'system{id_}'
+        self.web_address = web_address
+        self.check_servers = list(check_servers)
+
+
+class TestDependencyGraph(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen()
+        self.open_port = self.listener.getsockname()[1]
+
+        closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        closed.bind(('127.0.0.1', 0))
+        self.closed_port = closed.getsockname()[1]
+        closed.close()
+
+    def tearDown(self):
+        self.listener.close()
+
+    def test_children_of_down_parent_are_skipped(self):
+        graph = DependencyGraph()
+        graph.add('core', ('127.0.0.1', self.open_port))
+        graph.add('switch', ('127.0.0.1', self.closed_port), 'core')
+        graph.add('host', ('127.0.0.1', self.open_port), 'switch')
+        graph.add('check', ('127.0.0.1', self.open_port), 'host')
+
+        statuses = graph.sweep(timeout=1)
+        self.assertEqual(statuses, {'core': UP, 'switch': DOWN, 'host': PARENT_DOWN, 'check': PARENT_DOWN})
+        self.assertEqual(graph.root_causes(statuses), {'switch': 2})
+
+    def test_host_up_on_any_port(self):
+        graph = DependencyGraph()
+        graph.add('host', ('127.0.0.1', (self.closed_port, self.open_port)))
+        graph.add('check', ('127.0.0.1', self.open_port), 'host')
+        self.assertEqual(graph.sweep(timeout=1), {'host': UP, 'check': UP})
+        self.assertEqual(graph.port_results, {('127.0.0.1', self.closed_port): False,
+                                              ('127.0.0.1', self.open_port): True})
+
+    def test_cycle(self):
+        graph = DependencyGraph()
+        graph.add('a', None, 'b')
+        graph.add('b', None, 'a')
+        with self.assertRaises(ValueError):  # graphlib.CycleError
+            graph.sweep()
+
+    def test_sweep_fleet(self):
+        systems = [System(1, '127.0.0.1', [CheckServer(10, str(self.open_port))]),
+                   System(2, 'localhost', [CheckServer(20, str(self.open_port))])]
+        uplink_devices = {'switch': {'address': '127.0.0.1', 'port': self.open_port}}
+        with mock.patch('monitors.server_status.dependency_graph.SSH_PORT', self.open_port):
+            reach = sweep_fleet(systems, uplink_devices, {2: 'switch'}, timeout=1)
+        self.assertTrue(reach.port_up('localhost', self.open_port))
+
+        # with only the host's SSH port down its web server is still checked
+        with mock.patch('monitors.server_status.dependency_graph.SSH_PORT', self.closed_port):
+            reach = sweep_fleet(systems, uplink_devices, {2: 'switch'}, timeout=1)
+        self.assertFalse(reach.port_up('127.0.0.1', self.closed_port))
+        self.assertFalse(reach.behind_down_parent('127.0.0.1', self.closed_port))
+        self.assertTrue(reach.port_up('127.0.0.1', self.open_port))
+        self.assertFalse(reach.behind_down_parent('127.0.0.1', self.open_port))
+
+        # with all of the host's ports down its checks are skipped
+        systems[0].check_servers = [CheckServer(10, str(self.closed_port))]
+        with mock.patch('monitors.server_status.dependency_graph.SSH_PORT', self.closed_port):
+            graph = DependencyGraph.for_fleet(systems[:1])
+            statuses = graph.sweep(timeout=1)
+            reach = sweep_fleet(systems[:1], timeout=1)
+        self.assertEqual(statuses, {('host', 1): DOWN, ('check', 10): PARENT_DOWN})
+        self.assertFalse(reach.port_up('127.0.0.1', self.closed_port))
+        self.assertTrue(reach.behind_down_parent('127.0.0.1', self.closed_port))
+
+        # with the switch down nothing behind it is probed
+        uplink_devices['switch']['port'] = self.closed_port
+        reach = sweep_fleet(systems, uplink_devices, {2: 'switch'}, timeout=1)
+        self.assertFalse(reach.host_up('localhost'))
+        self.assertTrue(reach.behind_down_parent('localhost'))
+        self.assertTrue(reach.behind_down_parent('localhost', self.open_port))
+
+    def test_systems_sharing_an_address(self):
+        # two systems on one address, only the second behind a switch that is down
+        systems = [System(1, '127.0.0.1', [CheckServer(10, str(self.open_port))]),
+                   System(2, '127.0.0.1', [CheckServer(20, str(self.open_port))])]
+        uplink_devices = {'switch': {'address': '127.0.0.1', 'port': self.closed_port}}
+        with mock.patch('monitors.server_status.dependency_graph.SSH_PORT', self.open_port):
+            graph = DependencyGraph.for_fleet(systems, uplink_devices, {2: 'switch'})
+            statuses = graph.sweep(timeout=1)
+            reach = sweep_fleet(systems, uplink_devices, {2: 'switch'}, timeout=1)
+        self.assertEqual(statuses[('host', 1)], UP)
+        self.assertEqual(statuses[('host', 2)], PARENT_DOWN)
+        self.assertTrue(reach.port_up('127.0.0.1', self.open_port, system_id=1))
+        self.assertFalse(reach.behind_down_parent('127.0.0.1', self.open_port, system_id=1))
+        self.assertFalse(reach.port_up('127.0.0.1', self.open_port, system_id=2))
+        self.assertTrue(reach.behind_down_parent('127.0.0.1', self.open_port, system_id=2))
+        self.assertTrue(reach.port_up('127.0.0.1', self.open_port))  # by address, it was probed and answered
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import collections
+import socket
+import threading
+import time
+import unittest
+
+import mock
+
+from monitors.server_status import reachability
+from monitors.server_status.reachability import FleetReachability, sweep
+
+
+class TestReachabilitySweep(unittest.TestCase):
+    def setUp(self):
+        # one port listening and one port that was bound then released so nothing is listening on it
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen()
+        self.open_port = self.listener.getsockname()[1]
+
+        closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        closed.bind(('127.0.0.1', 0))
+        self.closed_port = closed.getsockname()[1]
+        closed.close()
+
+    def tearDown(self):
+        self.listener.close()
+
+    def test_sweep_open_and_closed_ports(self):
+        results = sweep({'127.0.0.1': [self.open_port, self.closed_port]}, timeout=1)
+        self.assertTrue(results[('127.0.0.1', self.open_port)])
+        self.assertFalse(results[('127.0.0.1', self.closed_port)])
+
+    def test_unresolvable_host_is_down(self):
+        results = sweep({'no-such-host.invalid': [22]}, timeout=0.5)
+        self.assertFalse(results[('no-such-host.invalid', 22)])
+
+    def test_slow_lookup_does_not_hold_up_the_sweep(self):
+        lookups = collections.Counter()
+        release = threading.Event()
+        resolve = reachability._resolve
+
+        def slow_resolve(address):
+            lookups[address] += 1
+            if address == 'slow.example':
+                release.wait(10)
+                return None
+            return resolve('127.0.0.1')
+
+        start = time.monotonic()
+        with mock.patch('monitors.server_status.reachability._resolve', slow_resolve):
+            results = sweep({'fast.example': [self.open_port, self.closed_port], 'slow.example': [22, 80]}, timeout=1)
+        release.set()
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertTrue(results[('fast.example', self.open_port)])
+        self.assertFalse(results[('fast.example', self.closed_port)])
+        self.assertFalse(results[('slow.example', 22)])
+        self.assertEqual(lookups, {'fast.example': 1, 'slow.example': 1})  # once for each address, not each port
+
+    def test_fleet_reachability(self):
+        reach = FleetReachability({('host', 22): False, ('host', 80): True})
+        self.assertFalse(reach.host_up('host'))
+        self.assertTrue(reach.port_up('host', '80'))
+        self.assertTrue(reach.port_up('other_host', 80))  # not swept, still gets checked
+        self.assertEqual(reach.unreachable(), [('host', 22)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import tempfile
+import textwrap
+import time
+import unittest
+
+from monitors.config_reload import apply_drive_checks, ConfigDiff, ConfigWatcher, FleetConfig
+
+MODULE_NAME = 'hot_reload_test_system_dicts'
+
+
+def fleet_source(hostname2='host2', port='80', alert_low_bytes=1_000, with_host3=False):
+    return textwrap.dedent(f'''
+        sysdicts = [dict(id=1, hostname='host1', username='su', password='pw'),
+                    dict(id=2, hostname='{hostname2}', username='su', password='pw')]
+        if {with_host3}:
+            sysdicts.append(dict(hostname='host3', username='su', password='pw'))
+        check_server_lists_dict = {{1: [dict(port='{port}', address_suffix='status',
+                                             status_condition_type='status_code',
+                                             status_condition_value_data={{'status_code': 200}})]}}
+        drive_check_table = {{1: dict(drive_letter='C', alert_low_bytes=[{alert_low_bytes}]),
+                              2: dict(drive_letter='D', alert_low_bytes=[1_000])}}
+        ''')
+
+
+class TestConfigReload(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.module_path = os.path.join(self.tmp_dir.name, f'{MODULE_NAME}.py')
+        self.dont_write_bytecode, sys.dont_write_bytecode = sys.dont_write_bytecode, False  # cache it as deployed
+        self.second = int(time.time())
+        self.write(fleet_source(), mtime=self.second + 0.1)
+        sys.path.insert(0, self.tmp_dir.name)
+        self.watcher = ConfigWatcher(MODULE_NAME)
+
+    def tearDown(self):
+        sys.dont_write_bytecode = self.dont_write_bytecode
+        sys.path.remove(self.tmp_dir.name)
+        sys.modules.pop(MODULE_NAME, None)
+        self.tmp_dir.cleanup()
+
+    def write(self, source, mtime=None):
+        with open(self.module_path, 'w') as mf:
+            mf.write(source)
+        if mtime is not None:
+            os.utime(self.module_path, (mtime, mtime))
+
+    def test_no_change(self):
+        self.assertIsNone(self.watcher.check())
+
+    def test_diff(self):
+        self.write(fleet_source(hostname2='host2-new', port='8080', alert_low_bytes=5_000, with_host3=True))
+        diff = self.watcher.check()
+        self.assertEqual(diff.systems_added, {'host3'})
+        self.assertEqual(diff.systems_removed, set())
+        self.assertEqual(diff.systems_changed, {2})
+        self.assertEqual(diff.check_servers_changed, {1})
+        self.assertEqual(diff.drive_checks_changed, {1})
+        self.assertIsNone(self.watcher.check())
+
+    def test_same_second_and_size(self):
+        # the cached bytecode can't tell this edit apart from the first version of the file
+        self.write(fleet_source(port='81'), mtime=self.second + 0.6)
+        diff = self.watcher.check()
+        self.assertEqual(diff.check_servers_changed, {1})
+        self.assertEqual(self.watcher.config.check_servers[1][('81', 'status')]['port'], '81')
+
+    def test_bad_config_keeps_last(self):
+        self.write('sysdicts = [')
+        self.assertIsNone(self.watcher.check())
+        self.assertEqual(set(self.watcher.config.systems), {1, 2})
+
+    def test_apply_drive_checks(self):
+        old = FleetConfig([], {}, {1: {'alert_low_bytes': [1]}, 2: {'alert_low_bytes': [2]}})
+        new = FleetConfig([], {}, {1: {'alert_low_bytes': [10]}, 3: {'alert_low_bytes': [3]}})
+        diff = ConfigDiff(old, new)
+        running = {1: {'alert_low_bytes': [1]}, 2: {'alert_low_bytes': [2]}}
+        apply_drive_checks(running, new, diff.drive_checks_changed)
+        self.assertEqual(running, {1: {'alert_low_bytes': [10]}, 3: {'alert_low_bytes': [3]}})
+
+
+if __name__ == '__main__':
+    unittest.main()
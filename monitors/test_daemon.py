@@ -0,0 +1,226 @@
+import os
+import sys
+import tempfile
+import textwrap
+import time
+import unittest
+
+import mock
+import paramiko
+import sqlalchemy
+from sqlalchemy.pool import StaticPool
+
+from models.availability_interval import AvailabilityInterval
+from models.check_server_table import CheckServer
+from models.fleet_snapshot import export_snapshot, load_systems_from_database
+from models.metric_history import MetricPoint
+from models.sqla_instance import Base, engine, Session
+from models.systems_settings import SystemModel
+from monitors.config_reload import ConfigWatcher
+from monitors.daemon import PollingDaemon
+from monitors.server_status.reachability import FleetReachability
+
+MODULE_NAME = 'daemon_test_system_dicts'
+
+local_engine = sqlalchemy.create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+
+
+def fleet_source(hostname2='host2', alert_low_bytes=1_000, password2='pw', port='80', with_host3=False,
+                 with_host2=True):
+    return textwrap.dedent(f'''
+        sysdicts = [dict(id=1, hostname='host1', username='su', password='pw')]
+        if {with_host2}:
+            sysdicts.append(dict(id=2, hostname='{hostname2}', username='su', password='{password2}'))
+        if {with_host3}:
+            sysdicts.append(dict(hostname='host3', username='su', password='pw'))
+        check_server_lists_dict = {{1: [dict(port='{port}', address_suffix='status',
+                                             status_condition_type='status_code',
+                                             status_condition_value_data={{'status_code': 200}})]}}
+        intervals = dict(min_interval_secs=0.01, max_interval_secs=0.01)
+        drive_check_table = {{1: dict(drive_letter='C', alert_low_bytes=[{alert_low_bytes}], **intervals),
+                              2: dict(drive_letter='D', alert_low_bytes=[1_000], **intervals)}}
+        ''')
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class DaemonTestCase(unittest.TestCase):
+    """The database is an in-memory sqlite one, seeded from the configuration module."""
+
+    def setUp(self):
+        Session.remove()
+        Session.configure(bind=local_engine)
+        _ = CheckServer, MetricPoint, AvailabilityInterval
+        Base.metadata.create_all(local_engine)
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_path = os.path.join(self.tmp_dir.name, 'fleet_snapshot.json')
+        self.module_path = os.path.join(self.tmp_dir.name, f'{MODULE_NAME}.py')
+        self.write_config(fleet_source())
+        sys.path.insert(0, self.tmp_dir.name)
+        self.watcher = ConfigWatcher(MODULE_NAME)
+        for system_dict in self.watcher.module.sysdicts:
+            SystemModel.apply_config(system_dict)
+        for system_id, server_dicts in self.watcher.module.check_server_lists_dict.items():
+            CheckServer.apply_config(system_id, server_dicts)
+        Session.remove()
+
+    def tearDown(self):
+        Session.remove()
+        Base.metadata.drop_all(local_engine)
+        Session.configure(bind=engine)
+        sys.path.remove(self.tmp_dir.name)
+        sys.modules.pop(MODULE_NAME, None)
+        self.tmp_dir.cleanup()
+
+    def write_config(self, source):
+        with open(self.module_path, 'w') as mf:
+            mf.write(source)
+
+    def daemon(self, database_up: bool) -> PollingDaemon:
+        daemon = PollingDaemon(self.watcher.module.drive_check_table, watch_config=False, sessions_per_minute=6_000,
+                               database_up=database_up, snapshot_path=self.snapshot_path)
+        daemon.config_watcher = self.watcher
+        daemon.config_check_secs = 0.02
+        return daemon
+
+
+@mock.patch('monitors.poller.sweep_fleet', return_value=FleetReachability({}))
+class TestPollingDaemon(DaemonTestCase):
+    def test_session_removed_after_each_cycle(self, _sweep_fleet):
+        sessions = []  # kept, so a new session can't reuse the id of a removed one
+
+        def check_system(stm, *args, **kwargs):
+            if stm.id == 1:
+                sessions.append(Session())
+            return {'free_space_bytes': 50_000_000_000}, {}
+
+        daemon = self.daemon(database_up=True)
+        with mock.patch('monitors.poller.check_system', check_system):
+            daemon.start()
+            self.assertTrue(wait_for(lambda: len(sessions) >= 3))
+            daemon.stop(5)
+
+        self.assertEqual(len({id(session) for session in sessions}), len(sessions))
+        for session in sessions[:-1]:
+            self.assertEqual(len(session.identity_map), 0)
+
+    def test_failing_host_does_not_stop_the_daemon(self, _sweep_fleet):
+        checked = []
+
+        def check_system(stm, *args, **kwargs):
+            checked.append(stm.id)
+            if stm.id == 1:
+                raise paramiko.SSHException('Error reading SSH protocol banner')
+            return {'free_space_bytes': 50_000_000_000}, {}
+
+        daemon = self.daemon(database_up=True)
+        with mock.patch('monitors.poller.check_system', check_system), self.assertLogs(level='ERROR') as logs:
+            daemon.start()
+            self.assertTrue(wait_for(lambda: checked.count(2) >= 3))
+            self.assertTrue(daemon.is_alive())
+            daemon.stop(5)
+
+        self.assertGreaterEqual(checked.count(1), 2)
+        self.assertIn('Could not check system', logs.output[0])
+
+    def test_switch_to_database_keeps_current_config(self, _sweep_fleet):
+        with SystemModel.session():
+            export_snapshot(load_systems_from_database(), self.watcher.module.drive_check_table, self.snapshot_path)
+
+        daemon = self.daemon(database_up=False)
+        checked = []
+        with mock.patch('monitors.poller.check_system', lambda stm, *args, **kwargs: checked.append(stm) or ({}, {})), \
+                mock.patch('monitors.daemon.SnapshotReconciler'):
+            daemon.start()
+            self.assertTrue(wait_for(lambda: len(checked) >= 2))
+            self.assertFalse(daemon.from_database)
+
+            # changed while running from the snapshot, only the threshold can be applied then
+            self.write_config(fleet_source(hostname2='host2-new', alert_low_bytes=5_000))
+            self.assertTrue(wait_for(lambda: daemon.drive_checks[1]['alert_low_bytes'] == [5_000]))
+            self.assertEqual(SystemModel.query.filter_by(id=2).one().hostname, 'host2')
+            Session.remove()
+
+            daemon.database_back(load_systems_from_database())
+            Session.remove()
+            self.assertTrue(wait_for(lambda: 'host2-new' in [stm.hostname for stm in daemon.systems]))
+            self.assertTrue(wait_for(lambda: isinstance(checked[-1], SystemModel)))  # polled from the database
+            daemon.stop(5)
+
+        self.assertTrue(daemon.from_database)
+        self.assertIsNotNone(daemon.ingest)
+        self.assertEqual(daemon.drive_checks[1]['alert_low_bytes'], [5_000])
+        self.assertEqual(SystemModel.query.filter_by(id=2).one().hostname, 'host2-new')
+
+
+class TestApplyConfig(DaemonTestCase):
+    def apply(self, daemon: PollingDaemon, source: str):
+        self.write_config(source)
+        try:
+            daemon.apply_config(self.watcher.check())
+        finally:
+            Session.remove()  # as reload_config does
+
+    def test_with_database(self):
+        daemon = self.daemon(database_up=True)
+        daemon.load()
+
+        # a new password, and system 1's check server moved to another port
+        with mock.patch.object(daemon.pool, 'evict') as evict:
+            self.apply(daemon, fleet_source(password2='new pw', port='8080'))
+        evict.assert_called_once_with(2)  # the next connection uses the new password
+        self.assertEqual(SystemModel.query.filter_by(id=2).one().password, 'new pw')
+        self.assertEqual([chk_svr.port for chk_svr in CheckServer.query.filter_by(parent_id=1)], ['8080'])
+        Session.remove()
+        running = {stm.id: stm for stm in daemon.systems}
+        self.assertEqual(running[2].password, 'new pw')
+        self.assertEqual([chk_svr.port for chk_svr in running[1].check_servers], ['8080'])
+
+        self.apply(daemon, fleet_source(with_host2=False, password2='new pw', port='8080'))
+        self.assertEqual([stm.id for stm in daemon.systems], [1])
+        self.assertIsNotNone(SystemModel.query.filter_by(id=2).one().entry_retired_ts)
+
+        # a retired system that is configured again is brought back
+        self.apply(daemon, fleet_source(password2='new pw', port='8080'))
+        self.assertEqual(sorted(stm.id for stm in daemon.systems), [1, 2])
+        self.assertIsNone(SystemModel.query.filter_by(id=2).one().entry_retired_ts)
+
+    def test_added_system_without_drive_check(self):
+        daemon = self.daemon(database_up=True)
+        daemon.load()
+        with self.assertLogs(level='WARNING') as logs:
+            self.apply(daemon, fleet_source(with_host3=True))
+        host3 = SystemModel.query.filter_by(hostname='host3').one()
+        self.assertIn(host3.id, [stm.id for stm in daemon.systems])
+        self.assertNotIn(host3.id, daemon.drive_checks)
+        self.assertTrue(any('has no drive_check_table entry' in line for line in logs.output))
+
+    def test_without_database(self):
+        with SystemModel.session():
+            export_snapshot(load_systems_from_database(), self.watcher.module.drive_check_table, self.snapshot_path)
+        daemon = self.daemon(database_up=False)
+        with mock.patch('monitors.daemon.SnapshotReconciler'):
+            daemon.load()
+
+        with self.assertLogs(level='WARNING') as logs:
+            self.apply(daemon, fleet_source(with_host2=False, with_host3=True, alert_low_bytes=5_000))
+        self.assertTrue(any('will be applied once the database is available' in line for line in logs.output))
+        # the removed system stops being polled, the rest waits for the database
+        self.assertEqual([stm.id for stm in daemon.systems], [1])
+        self.assertEqual(daemon.drive_checks[1]['alert_low_bytes'], [5_000])
+        self.assertIsNone(SystemModel.query.filter_by(id=2).one().entry_retired_ts)
+        self.assertIsNone(SystemModel.query.filter_by(hostname='host3').first())
+
+        self.apply(daemon, fleet_source(password2='new pw'))
+        self.assertEqual(SystemModel.query.filter_by(id=2).one().password, 'pw')
+
+if __name__ == '__main__':
+    unittest.main()
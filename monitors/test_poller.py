@@ -0,0 +1,58 @@
+import unittest
+
+import mock
+import paramiko
+
+from monitors.history.availability import AvailabilityTimeline, host_key
+from monitors.poller import check_system, poll_cycle
+from monitors.scheduling.adaptive import AdaptiveScheduler
+from monitors.server_status.reachability import FleetReachability
+
+
+class System:
+    def __init__(self, id_):
+        self.id = id_
+        self.nickname = f'system{id_}'
+        self.web_address = f'10.0.0.{id_}'
+        self.check_servers = []
+
+
+class TestPollCycle(unittest.TestCase):
+    def test_failing_host_does_not_stop_the_cycle(self):
+        systems = [System(1), System(2), System(3)]
+        checked = []
+
+        def check_system(stm, *args, **kwargs):
+            checked.append(stm.id)
+            if stm.id == 1:
+                raise paramiko.AuthenticationException('Authentication failed.')
+            return {'free_space_bytes': 50_000_000_000}, {}
+
+        scheduler = AdaptiveScheduler({})
+        timeline = AvailabilityTimeline()
+        with mock.patch('monitors.poller.check_system', check_system), \
+                mock.patch('monitors.poller.sweep_fleet', return_value=FleetReachability({})):
+            poll_cycle(scheduler.due(systems, now=0), {}, scheduler=scheduler, timeline=timeline)
+
+        self.assertEqual(checked, [1, 2, 3])
+        # the failed attempt is recorded, so the host is no longer due right away
+        self.assertEqual(scheduler.due(systems), [])
+        self.assertIsNotNone(timeline.checks.get(host_key(1)))
+
+    def test_system_without_drive_check(self):
+        # e.g. hot added to the configuration without an id, there is no SSH connection attempted
+        with mock.patch('monitors.poller.SystemConnection') as system_connection:
+            self.assertEqual(check_system(System(4), {1: {'drive_letter': 'C'}}), ({}, {}))
+        system_connection.assert_not_called()
+
+    def test_changed_host_key_is_alerted(self):
+        bad_key = paramiko.BadHostKeyException('10.0.0.1', paramiko.RSAKey.generate(1024),
+                                               paramiko.RSAKey.generate(1024))
+        with mock.patch('monitors.poller.SystemConnection', side_effect=bad_key), \
+                self.assertLogs(level='ERROR') as logs:
+            self.assertEqual(check_system(System(1), {1: {'drive_letter': 'C'}}), ({}, {}))
+        self.assertIn('HOST KEY CHANGED', logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()